@@ -0,0 +1,25 @@
+"""add rsync shards to staging orders
+
+Revision ID: 3f1c9e7b2a4d
+Revises: 74b309c44134
+Create Date: 2026-10-17 09:12:41.318227
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9e7b2a4d'
+down_revision = '74b309c44134'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('staging_orders', sa.Column('rsync_shards', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('staging_orders') as batch_op:
+        batch_op.drop_column('rsync_shards')
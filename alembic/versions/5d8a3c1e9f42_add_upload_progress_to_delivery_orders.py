@@ -0,0 +1,31 @@
+"""add upload progress to delivery orders
+
+Revision ID: 5d8a3c1e9f42
+Revises: c92f4e61a8d3
+Create Date: 2026-10-17 17:41:36.205184
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d8a3c1e9f42'
+down_revision = 'c92f4e61a8d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('delivery_orders', sa.Column('files_uploaded', sa.Integer(), nullable=True))
+    op.add_column('delivery_orders', sa.Column('bytes_uploaded', sa.BigInteger(), nullable=True))
+    op.add_column('delivery_orders', sa.Column('throughput', sa.Float(), nullable=True))
+    op.add_column('delivery_orders', sa.Column('eta', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('delivery_orders') as batch_op:
+        batch_op.drop_column('eta')
+        batch_op.drop_column('throughput')
+        batch_op.drop_column('bytes_uploaded')
+        batch_op.drop_column('files_uploaded')
@@ -0,0 +1,27 @@
+"""add delivery attempts to delivery orders
+
+Revision ID: a7e4c2d95b18
+Revises: 5d8a3c1e9f42
+Create Date: 2026-10-17 18:52:09.774310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7e4c2d95b18'
+down_revision = '5d8a3c1e9f42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('delivery_orders', sa.Column('delivery_attempts', sa.Integer(), nullable=True))
+    op.add_column('delivery_orders', sa.Column('attempt_timings', sa.String(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('delivery_orders') as batch_op:
+        batch_op.drop_column('attempt_timings')
+        batch_op.drop_column('delivery_attempts')
@@ -0,0 +1,31 @@
+"""add transfer progress to staging orders
+
+Revision ID: b7d2e4f81c3a
+Revises: 3f1c9e7b2a4d
+Create Date: 2026-10-17 10:41:07.529613
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2e4f81c3a'
+down_revision = '3f1c9e7b2a4d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('staging_orders', sa.Column('bytes_transferred', sa.BigInteger(), nullable=True))
+    op.add_column('staging_orders', sa.Column('files_transferred', sa.Integer(), nullable=True))
+    op.add_column('staging_orders', sa.Column('throughput', sa.Float(), nullable=True))
+    op.add_column('staging_orders', sa.Column('eta', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('staging_orders') as batch_op:
+        batch_op.drop_column('eta')
+        batch_op.drop_column('throughput')
+        batch_op.drop_column('files_transferred')
+        batch_op.drop_column('bytes_transferred')
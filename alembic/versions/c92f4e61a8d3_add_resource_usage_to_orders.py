@@ -0,0 +1,33 @@
+"""add resource usage to staging and delivery orders
+
+Revision ID: c92f4e61a8d3
+Revises: e3b58f2a7d19
+Create Date: 2026-10-17 15:04:12.381920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c92f4e61a8d3'
+down_revision = 'e3b58f2a7d19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ['staging_orders', 'delivery_orders']:
+        op.add_column(table, sa.Column('cpu_time', sa.Float(), nullable=True))
+        op.add_column(table, sa.Column('max_rss', sa.BigInteger(), nullable=True))
+        op.add_column(table, sa.Column('block_input', sa.BigInteger(), nullable=True))
+        op.add_column(table, sa.Column('block_output', sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    for table in ['staging_orders', 'delivery_orders']:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('block_output')
+            batch_op.drop_column('block_input')
+            batch_op.drop_column('max_rss')
+            batch_op.drop_column('cpu_time')
@@ -0,0 +1,25 @@
+"""add link dest to staging orders
+
+Revision ID: d41a6c9e0b57
+Revises: b7d2e4f81c3a
+Create Date: 2026-10-17 11:58:23.104482
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41a6c9e0b57'
+down_revision = 'b7d2e4f81c3a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('staging_orders', sa.Column('link_dest', sa.String(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('staging_orders') as batch_op:
+        batch_op.drop_column('link_dest')
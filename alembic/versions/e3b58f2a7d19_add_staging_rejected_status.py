@@ -0,0 +1,34 @@
+"""add staging rejected status
+
+Revision ID: e3b58f2a7d19
+Revises: d41a6c9e0b57
+Create Date: 2026-10-17 13:22:48.675301
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3b58f2a7d19'
+down_revision = 'd41a6c9e0b57'
+branch_labels = None
+depends_on = None
+
+old_staging_status = sa.Enum('pending', 'staging_failed', 'staging_in_progress', 'staging_successful',
+                             name='stagingstatus')
+new_staging_status = sa.Enum('pending', 'staging_failed', 'staging_in_progress', 'staging_successful',
+                             'staging_rejected', name='stagingstatus')
+
+
+def upgrade():
+    with op.batch_alter_table('staging_orders') as batch_op:
+        batch_op.alter_column('status', existing_type=old_staging_status, type_=new_staging_status,
+                              existing_nullable=False)
+
+
+def downgrade():
+    op.execute("UPDATE staging_orders SET status = 'staging_failed' WHERE status = 'staging_rejected'")
+    with op.batch_alter_table('staging_orders') as batch_op:
+        batch_op.alter_column('status', existing_type=new_staging_status, type_=old_staging_status,
+                              existing_nullable=False)
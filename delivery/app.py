@@ -1,7 +1,9 @@
 
+import logging
 import os
 
 from tornado.web import URLSpec as url
+from tornado.ioloop import IOLoop
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, scoped_session
@@ -16,10 +18,12 @@ from delivery.handlers.runfolder_handlers import RunfolderHandler
 from delivery.handlers.project_handlers import ProjectHandler, ProjectsForRunfolderHandler, \
     BestPracticeProjectSampleHandler
 from delivery.handlers.dds_handlers import DDSCreateProjectHandler
-from delivery.handlers.delivery_handlers import DeliverByStageIdHandler, DeliveryStatusHandler
+from delivery.handlers.delivery_handlers import DeliverByStageIdHandler, DeliverByStageIdsHandler, \
+    DeliveryStatusHandler
 from delivery.handlers.staging_handlers import StagingRunfolderHandler, StagingHandler,\
     StageGeneralDirectoryHandler, StagingProjectRunfoldersHandler
 from delivery.handlers.organise_handlers import OrganiseRunfolderHandler
+from delivery.handlers.event_handlers import OrderEventsHandler
 
 from delivery.repositories.runfolder_repository import FileSystemBasedRunfolderRepository, \
     FileSystemBasedUnorganisedRunfolderRepository
@@ -31,6 +35,7 @@ from delivery.repositories.sample_repository import RunfolderProjectBasedSampleR
 
 
 from delivery.services.dds_service import DDSService
+from delivery.services.dds_client import DDSClient
 from delivery.services.external_program_service import ExternalProgramService
 from delivery.services.staging_service import StagingService
 from delivery.services.file_system_service import FileSystemService
@@ -38,6 +43,9 @@ from delivery.services.delivery_service import DeliveryService
 from delivery.services.runfolder_service import RunfolderService
 from delivery.services.best_practice_analysis_service import BestPracticeAnalysisService
 from delivery.services.organise_service import OrganiseService
+from delivery.services.order_event_service import OrderEventService
+
+log = logging.getLogger(__name__)
 
 
 def routes(**kwargs):
@@ -71,12 +79,16 @@ def routes(**kwargs):
 
         url(r"/api/1.0/deliver/stage_id/(.+)", DeliverByStageIdHandler,
             name="delivery_by_state_id", kwargs=kwargs),
+        url(r"/api/1.0/deliver/stage_ids", DeliverByStageIdsHandler,
+            name="delivery_by_stage_ids", kwargs=kwargs),
 
         url(r"/api/1.0/deliver/status/(.+)", DeliveryStatusHandler,
             name="delivery_status", kwargs=kwargs),
 
         url(r"/api/1.0/dds_project/create/(.+)", DDSCreateProjectHandler,
             name="create_dds_project", kwargs=kwargs),
+
+        url(r"/api/1.0/events", OrderEventsHandler, name="order_events", kwargs=kwargs),
     ]
 
 
@@ -111,6 +123,12 @@ def compose_application(config):
             raise AssertionError(
                     "{} is not a directory".format(os.path.abspath(directory)))
 
+    def _optional_config(key, default):
+        try:
+            return config[key]
+        except KeyError:
+            return default
+
     staging_dir = config['staging_directory']
     _assert_is_dir(staging_dir)
 
@@ -120,7 +138,15 @@ def compose_application(config):
     project_links_directory = config["project_links_directory"]
     _assert_is_dir(project_links_directory)
 
-    runfolder_repo = FileSystemBasedRunfolderRepository(runfolder_dir)
+    runfolder_repo = FileSystemBasedRunfolderRepository(
+        runfolder_dir,
+        catalogue_refresh_interval=_optional_config('runfolder_catalogue_refresh_interval', None))
+    # The catalogue of runfolders is built in the background at startup, rather
+    # than by whichever request needs it first
+    if runfolder_repo.catalogue_refresh_interval:
+        IOLoop.current().add_callback(runfolder_repo.refresh_catalogue_periodically)
+    else:
+        IOLoop.current().add_callback(runfolder_repo.refresh_catalogue_in_background)
     project_repository = UnorganisedRunfolderProjectRepository(
         sample_repository=RunfolderProjectBasedSampleRepository()
     )
@@ -134,7 +160,8 @@ def compose_application(config):
 
     general_project_repo = GeneralProjectRepository(
             root_directory=general_project_dir)
-    external_program_service = ExternalProgramService()
+    external_program_service = ExternalProgramService(
+            pools=_optional_config('external_program_pools', {}))
 
     db_connection_string = config["db_connection_string"]
     engine = create_engine(db_connection_string, echo=False)
@@ -145,6 +172,10 @@ def compose_application(config):
     session_factory = scoped_session(sessionmaker())
     session_factory.configure(bind=engine)
 
+    # Publishes the changes of staging and delivery orders made through any
+    # session, so that clients can follow them without polling.
+    order_event_service = OrderEventService(session_factory)
+
     staging_repo = DatabaseBasedStagingRepository(
             session_factory=session_factory)
 
@@ -155,19 +186,37 @@ def compose_application(config):
             staging_repo=staging_repo,
             staging_dir=staging_dir,
             project_links_directory=project_links_directory,
-            session_factory=session_factory)
+            session_factory=session_factory,
+            staging_conf=_optional_config('staging_conf', {}))
+
+    # Pick up any staging orders which were still queued or being staged when
+    # the service was last stopped, once the IOLoop is running.
+    IOLoop.current().add_callback(staging_service.restart_pending_stage_orders)
+    IOLoop.current().add_callback(staging_service.recover_orphaned_stage_orders)
 
     delivery_repo = DatabaseBasedDeliveriesRepository(
             session_factory=session_factory)
 
     dds_conf = config['dds_conf']
+    dds_client = None
+    if dds_conf.get('use_library', False):
+        if DDSClient.is_available():
+            dds_client = DDSClient(log_path=dds_conf["log_path"])
+        else:
+            log.warning("The dds_cli library can not be imported, the dds executable will be used instead")
+
     dds_service = DDSService(
             external_program_service=external_program_service,
             staging_service=staging_service,
             staging_dir=staging_dir,
             delivery_repo=delivery_repo,
             session_factory=session_factory,
-            dds_conf=dds_conf)
+            dds_conf=dds_conf,
+            dds_client=dds_client)
+
+    # Deliveries whose dds process died with the service cannot be resumed,
+    # so they are marked as failed to allow them to be requested again.
+    IOLoop.current().add_callback(dds_service.recover_orphaned_delivery_orders)
 
     delivery_sources_repo = DatabaseBasedDeliverySourcesRepository(
             session_factory=session_factory)
@@ -196,7 +245,8 @@ def compose_application(config):
                 delivery_service=delivery_service,
                 general_project_repo=general_project_repo,
                 best_practice_analysis_service=best_practice_analysis_service,
-                organise_service=organise_service)
+                organise_service=organise_service,
+                order_event_service=order_event_service)
 
 
 def start():
@@ -15,6 +15,14 @@ class ChecksumNotFoundException(Exception):
     pass
 
 
+class ChecksumMismatchException(Exception):
+    """
+    Should be raised when the checksum of a copied file does not match the
+    expected checksum.
+    """
+    pass
+
+
 class ChecksumFileNotFoundException(Exception):
     """
     Should be raised when an expected checksum file could not be found.
@@ -5,6 +5,7 @@ import logging
 import tempfile
 
 from tornado.gen import coroutine
+from tornado.web import HTTPError
 
 from delivery.handlers import *
 from delivery.handlers.utility_handlers import ArteriaDeliveryBaseHandler
@@ -66,6 +67,65 @@ class DeliverByStageIdHandler(ArteriaDeliveryBaseHandler):
                          'delivery_order_link': status_end_point})
 
 
+class DeliverByStageIdsHandler(ArteriaDeliveryBaseHandler):
+    """
+    Handler for delivering several previously staged directories/files to the
+    same DDS project in one upload, releasing the project once at the end
+    """
+
+    def initialize(self, **kwargs):
+        self.delivery_service = kwargs["dds_service"]
+        super(DeliverByStageIdsHandler, self).initialize(kwargs)
+
+    @coroutine
+    def post(self):
+        """
+        Deliver the staging orders listed in `staging_ids` to the DDS project
+        `delivery_project_id`, authenticating with `auth_token`. Takes the
+        same optional members as delivering a single staging order, i.e.
+        `deadline`, `release` and `skip_delivery`. Returns one delivery order
+        per staging order, keyed by staging id.
+        """
+        required_members = [
+                "staging_ids",
+                "delivery_project_id",
+                "auth_token",
+                ]
+        request_data = self.body_as_object(required_members=required_members)
+
+        staging_ids = request_data["staging_ids"]
+        if not isinstance(staging_ids, list) or not staging_ids:
+            raise HTTPError(BAD_REQUEST, "Expecting 'staging_ids' to be a non-empty list in the JSON body")
+        # A staging order listed twice would be uploaded twice, with two delivery orders
+        if len(set(str(staging_id) for staging_id in staging_ids)) != len(staging_ids):
+            raise HTTPError(BAD_REQUEST, "Expecting 'staging_ids' to not list any staging id more than once")
+
+        dds_project = DDSProject(
+                self.delivery_service,
+                request_data["auth_token"],
+                request_data["delivery_project_id"])
+
+        delivery_ids = yield dds_project.put_many(
+                staging_ids,
+                skip_delivery=request_data.get("skip_delivery") is True,
+                deadline=request_data.get("deadline"),
+                release=request_data.get("release", True),
+                )
+
+        delivery_order_ids = {}
+        delivery_order_links = {}
+        for staging_id, delivery_id in zip(staging_ids, delivery_ids):
+            delivery_order_ids[staging_id] = delivery_id
+            delivery_order_links[staging_id] = "{0}://{1}{2}".format(
+                    self.request.protocol,
+                    self.request.host,
+                    self.reverse_url("delivery_status", delivery_id))
+
+        self.set_status(ACCEPTED)
+        self.write_json({'delivery_order_ids': delivery_order_ids,
+                         'delivery_order_links': delivery_order_links})
+
+
 class DeliveryStatusHandler(ArteriaDeliveryBaseHandler):
 
     def initialize(self, **kwargs):
@@ -74,6 +134,19 @@ class DeliveryStatusHandler(ArteriaDeliveryBaseHandler):
 
     @coroutine
     def get(self, delivery_order_id):
+        """
+        Returns the current status as json of the delivery order. While the upload is in progress, the
+        number of files and bytes uploaded so far, the current throughput (in bytes/s) and the estimated
+        number of seconds remaining (eta) are updated regularly. Return format looks like:
+        {
+           "id": 1,
+           "status": "delivery_in_progress",
+           "files_uploaded": 12,
+           "bytes_uploaded": 1238099,
+           "throughput": 12320768.0,
+           "eta": 1
+        }
+        """
         delivery_order = self.delivery_service\
             .get_delivery_order_by_id(delivery_order_id)
 
@@ -83,6 +156,10 @@ class DeliveryStatusHandler(ArteriaDeliveryBaseHandler):
         body = {
                 'id': delivery_order.id,
                 'status': delivery_order.delivery_status.name,
+                'files_uploaded': delivery_order.files_uploaded,
+                'bytes_uploaded': delivery_order.bytes_uploaded,
+                'throughput': delivery_order.throughput,
+                'eta': delivery_order.eta,
                 }
 
         self.write_json(body)
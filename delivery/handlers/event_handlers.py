@@ -0,0 +1,94 @@
+import json
+import logging
+from datetime import timedelta
+
+from tornado import gen
+from tornado.iostream import StreamClosedError
+
+from delivery.handlers.utility_handlers import ArteriaDeliveryBaseHandler
+from delivery.services.order_event_service import staging_order_event, delivery_order_event
+
+log = logging.getLogger(__name__)
+
+
+class OrderEventsHandler(ArteriaDeliveryBaseHandler):
+    """
+    Handler for streaming changes of staging and delivery orders to clients as Server-Sent Events
+    """
+
+    # Number of seconds between comments sent to keep idle connections open
+    KEEP_ALIVE_INTERVAL = 15
+
+    def initialize(self, **kwargs):
+        self.order_event_service = kwargs["order_event_service"]
+        self.delivery_service = kwargs["delivery_service"]
+        self.dds_service = kwargs["dds_service"]
+        self.subscription = None
+        super(OrderEventsHandler, self).initialize(kwargs)
+
+    @gen.coroutine
+    def get(self):
+        """
+        Stream changes of the status and progress of staging and delivery orders, as they happen, as
+        Server-Sent Events (content type text/event-stream). The events can be limited to some projects
+        and orders with the (repeatable) query arguments `project`, `staging_order_id` and
+        `delivery_order_id`, e.g. `/api/1.0/events?project=ABC_123&delivery_order_id=4`. If no arguments
+        are given all events are sent. The current state of any orders asked for by id is sent first.
+        Each event is named after the type of the order, and its data looks like:
+        event: staging_order
+        data: {"type": "staging_order", "id": 1, "project": "ABC_123", "status": "staging_in_progress",
+               "size": null, "bytes_transferred": 1238099, "files_transferred": 12,
+               "throughput": 12320768.0, "eta": 1}
+        or
+        event: delivery_order
+        data: {"type": "delivery_order", "id": 4, "project": "ABC_123", "delivery_project": "snpseq00001",
+               "staging_order_id": 1, "status": "delivery_in_progress", "files_uploaded": 12,
+               "bytes_uploaded": 1238099, "throughput": 12320768.0, "eta": 1}
+        """
+        staging_order_ids = self.get_arguments("staging_order_id")
+        delivery_order_ids = self.get_arguments("delivery_order_id")
+        try:
+            self.subscription = self.order_event_service.subscribe(
+                projects=self.get_arguments("project"),
+                staging_order_ids=staging_order_ids,
+                delivery_order_ids=delivery_order_ids)
+        except ValueError:
+            self.send_error(400, reason="Order ids must be integers")
+            return
+
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+
+        try:
+            for order_event in self._current_order_events(staging_order_ids, delivery_order_ids):
+                self._write_event(order_event)
+            yield self.flush()
+
+            while True:
+                try:
+                    order_event = yield self.subscription.queue.get(
+                        timeout=timedelta(seconds=self.KEEP_ALIVE_INTERVAL))
+                    self._write_event(order_event)
+                except gen.TimeoutError:
+                    self.write(": keep-alive\n\n")
+                yield self.flush()
+        except StreamClosedError:
+            log.debug("Event stream closed by the client")
+        finally:
+            self.order_event_service.unsubscribe(self.subscription)
+
+    def on_connection_close(self):
+        self.order_event_service.unsubscribe(self.subscription)
+
+    def _current_order_events(self, staging_order_ids, delivery_order_ids):
+        for staging_order_id in staging_order_ids:
+            staging_order = self.delivery_service.check_staging_status(staging_order_id)
+            if staging_order:
+                yield staging_order_event(staging_order)
+        for delivery_order_id in delivery_order_ids:
+            delivery_order = self.dds_service.get_delivery_order_by_id(delivery_order_id)
+            if delivery_order:
+                yield delivery_order_event(delivery_order)
+
+    def _write_event(self, order_event):
+        self.write("event: {}\ndata: {}\n\n".format(order_event["type"], json.dumps(order_event)))
@@ -1,4 +1,7 @@
 
+from tornado import gen
+from tornado.ioloop import IOLoop
+
 from delivery.handlers import *
 from delivery.handlers.utility_handlers import ArteriaDeliveryBaseHandler
 from delivery.exceptions import ProjectNotFoundException
@@ -33,6 +36,7 @@ class ProjectHandler(ProjectBaseHandler):
     Handler class for managing projects
     """
 
+    @gen.coroutine
     def get(self):
         """
         Returns all projects as json on the following format:
@@ -46,7 +50,8 @@ class ProjectHandler(ProjectBaseHandler):
             ]
         }
         """
-        projects = list(self.runfolder_repo.get_projects())
+        # The runfolders might have to be checked on disk, which is done in a separate thread
+        projects = yield IOLoop.current().run_in_executor(None, lambda: list(self.runfolder_repo.get_projects()))
         self.write_list_of_models_as_json(projects, key="projects")
 
 
@@ -1,4 +1,7 @@
 
+from tornado import gen
+from tornado.ioloop import IOLoop
+
 from delivery.handlers.utility_handlers import ArteriaDeliveryBaseHandler
 
 
@@ -11,6 +14,7 @@ class RunfolderHandler(ArteriaDeliveryBaseHandler):
         self.runfolder_repo = kwargs["runfolder_repo"]
         super(RunfolderHandler, self).initialize(kwargs)
 
+    @gen.coroutine
     def get(self):
         """
         Returns all runfolders as json on the following format:
@@ -30,5 +34,7 @@ class RunfolderHandler(ArteriaDeliveryBaseHandler):
             ]
         }
         """
-        runfolders = list(self.runfolder_repo.get_runfolders())
+        # The runfolders might have to be checked on disk, which is done in a separate thread
+        runfolders = yield IOLoop.current().run_in_executor(
+            None, lambda: list(self.runfolder_repo.get_runfolders()))
         self.write_list_of_models_as_json(runfolders, key="runfolders")
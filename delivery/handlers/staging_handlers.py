@@ -2,6 +2,7 @@
 import logging
 
 from tornado.gen import coroutine
+from tornado.web import HTTPError
 
 from arteria.web.handlers import BaseRestHandler
 
@@ -30,6 +31,20 @@ class BaseStagingHandler(BaseRestHandler):
 
         return link_results, id_results
 
+    @staticmethod
+    def _get_rsync_shards(request_data):
+        """
+        Get the number of rsync processes to split a staging between from the request, if any
+        :param request_data: the body of the request
+        :return: the number of rsync processes, or None to use the default
+        :raises HTTPError: if `rsync_shards` is given, but not as a positive integer
+        """
+        rsync_shards = request_data.get("rsync_shards", None)
+        if rsync_shards is not None and \
+                (isinstance(rsync_shards, bool) or not isinstance(rsync_shards, int) or rsync_shards < 1):
+            raise HTTPError(BAD_REQUEST, reason="Expecting 'rsync_shards' to be a positive integer")
+        return rsync_shards
+
 
 class StagingProjectRunfoldersHandler(BaseStagingHandler):
     """
@@ -47,7 +62,10 @@ class StagingProjectRunfoldersHandler(BaseStagingHandler):
         is specified different behaviour will be exhibited. The possible modes are CLEAN, BATCH and FORCE. If CLEAN
         is specified the staging will only be allowed if the project has not been delivered before. If BATCH is
         specified, any runfolders which have not previously been staged will be staged. If FORCE is specified all
-        runfolders will, regardless of their current status, be staged together.
+        runfolders will, regardless of their current status, be staged together. Optionally `rsync_shards` can be
+        specified to split the staging of a large project between several rsync processes. If `incremental` is
+        true, files which are unchanged since the last staged batch of the project (if it is still present in the
+        staging area) are hardlinked from it rather than copied.
 
         Here is a python code example of how to call the endpoint.
 
@@ -56,7 +74,7 @@ class StagingProjectRunfoldersHandler(BaseStagingHandler):
 
             url = "http://molmed-43:8080/api/1.0/stage/project/runfolders/ABC_123"
 
-            payload = {'delivery_mode': 'BATCH'}
+            payload = {'delivery_mode': 'BATCH', 'rsync_shards': 4, 'incremental': True}
             headers = {
             'content-type': "application/json",
             }
@@ -77,11 +95,14 @@ class StagingProjectRunfoldersHandler(BaseStagingHandler):
             request_data = {}
 
         requested_delivery_mode = request_data.get("delivery_mode", None)
+        rsync_shards = self._get_rsync_shards(request_data)
+        incremental = request_data.get("incremental", False)
         try:
             delivery_mode = DeliveryMode[requested_delivery_mode]
             log.info("Will attempt to stage runfolders for project {} with type {}".format(project_id, delivery_mode))
 
-            project_and_stage_id, projects = self.delivery_service.deliver_all_runfolders_for_project(project_id, delivery_mode)
+            project_and_stage_id, projects = yield self.delivery_service.deliver_all_runfolders_for_project(
+                project_id, delivery_mode, rsync_shards=rsync_shards, incremental=incremental)
             links, staging_ids_ids = self._construct_response_from_project_and_status(project_and_stage_id)
             project_and_staged_id_dict = list(map(lambda project: project.to_dict(), projects))
 
@@ -122,7 +143,8 @@ class StagingRunfolderHandler(BaseStagingHandler):
         Attempt to stage projects from the the specified runfolder, so that they can then be delivered.
         Will return a set of status links, one for each project that can be queried for the status of
         that staging attempt. A list of project names can be specified in the request body to limit which projects
-        should be staged. E.g:
+        should be staged, and `rsync_shards` to split the staging of each project between several rsync processes.
+        E.g:
 
             import requests
 
@@ -152,12 +174,14 @@ class StagingRunfolderHandler(BaseStagingHandler):
         try:
             projects_to_stage = request_data.get("projects", [])
             force_delivery = request_data.get("force_delivery", False)
+            rsync_shards = self._get_rsync_shards(request_data)
 
             log.debug("Got the following projects to stage: {}".format(projects_to_stage))
 
             staging_order_projects_and_ids = self.delivery_service.deliver_single_runfolder(runfolder_id,
                                                                                             projects_to_stage,
-                                                                                            force_delivery)
+                                                                                            force_delivery,
+                                                                                            rsync_shards=rsync_shards)
 
             link_results, id_results = self._construct_response_from_project_and_status(staging_order_projects_and_ids)
 
@@ -195,8 +219,8 @@ class StageGeneralDirectoryHandler(BaseStagingHandler):
             }
 
             # Optionally send a project alias (when the name of the dir is something else
-            than the project name) or force the delivery
-            data = {"project_alias": "my_test_project_batch1", "force_delivery": "True"}
+            than the project name), force the delivery or split the staging between several rsync processes
+            data = {"project_alias": "my_test_project_batch1", "force_delivery": "True", "rsync_shards": 4}
 
             response = requests.request("POST", url, data='', headers=headers)
 
@@ -217,12 +241,14 @@ class StageGeneralDirectoryHandler(BaseStagingHandler):
 
         project_alias = request_data.get("project_alias", None)
         force_delivery = request_data.get("force_delivery", False)
+        rsync_shards = self._get_rsync_shards(request_data)
 
         try:
             stage_order_and_id = self.delivery_service.\
                 deliver_arbitrary_directory_project(project_name=directory_name,
                                                     dir_name=project_alias,
-                                                    force_delivery=force_delivery)
+                                                    force_delivery=force_delivery,
+                                                    rsync_shards=rsync_shards)
 
             link_results, id_results = self._construct_response_from_project_and_status(stage_order_and_id)
 
@@ -240,15 +266,28 @@ class StagingHandler(BaseRestHandler):
     def get(self, stage_id):
         """
         Returns the current status as json of the of the staging order, or 404 if the order is unknown.
-        Possible values for status are: pending, staging_in_progress, staging_successful, staging_failed
+        Possible values for status are: pending, staging_in_progress, staging_successful, staging_failed,
+        staging_rejected (if the order could not be fit in the staging area)
+        While the staging is in progress, the number of bytes and files transferred so far, the current
+        throughput (in bytes/s) and the estimated number of seconds remaining (eta) are updated regularly.
         Return format looks like:
         {
-           "status": "staging_successful"
+           "status": "staging_in_progress",
+           "size": null,
+           "bytes_transferred": 1238099,
+           "files_transferred": 12,
+           "throughput": 12320768.0,
+           "eta": 1
         }
         """
         stage_order = self.delivery_service.check_staging_status(stage_id)
         if stage_order:
-            self.write_json({'status': stage_order.status.name, 'size': stage_order.size})
+            self.write_json({'status': stage_order.status.name,
+                             'size': stage_order.size,
+                             'bytes_transferred': stage_order.bytes_transferred,
+                             'files_transferred': stage_order.files_transferred,
+                             'throughput': stage_order.throughput,
+                             'eta': stage_order.eta})
         else:
             self.set_status(NOT_FOUND, reason='No stage order with id: {} found.'.format(stage_id))
 
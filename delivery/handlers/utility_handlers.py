@@ -20,9 +20,14 @@ class ArteriaDeliveryBaseHandler(BaseRestHandler):
         """
         self.config = config
 
+    @staticmethod
+    def _public_attributes(model):
+        # Private attributes, e.g. the lazily loaded checksums of a runfolder, are left out
+        return {k: v for k, v in model.__dict__.items() if not k.startswith("_")}
+
     def write_list_of_models_as_json(self, model_list, key):
         if model_list:
-            as_json = json.dumps({key: model_list}, default=lambda x: x.__dict__)
+            as_json = json.dumps({key: model_list}, default=self._public_attributes)
             self.write_json(as_json)
         else:
             self.write_json({key: list()})
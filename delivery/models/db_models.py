@@ -1,8 +1,7 @@
 
 import os
 import enum as base_enum
-
-from sqlalchemy import Column, Integer, BigInteger, String, Enum
+from sqlalchemy import Column, Integer, BigInteger, Float, String, Enum
 from sqlalchemy.ext.declarative import declarative_base
 
 """
@@ -50,6 +49,9 @@ class StagingStatus(base_enum.Enum):
     staging_successful = 'staging_successful'
     staging_failed = 'staging_failed'
 
+    # The source will not fit in the staging area
+    staging_rejected = 'staging_rejected'
+
 
 class StagingOrder(SQLAlchemyBase):
     """
@@ -79,9 +81,43 @@ class StagingOrder(SQLAlchemyBase):
     # which did do it if the status is no longer in progress.
     pid = Column(Integer)
 
+    # The number of rsync processes to split the staging between, if not set the
+    # default from the staging configuration is used.
+    rsync_shards = Column(Integer)
+
+    # A previously staged directory which rsync uses as reference, so that unchanged
+    # files are hardlinked from it rather than copied.
+    link_dest = Column(String)
+
+    # The progress of the staging as last reported by rsync, i.e. the number of bytes and
+    # files transferred so far, the current throughput in bytes/s and the estimated number
+    # of seconds remaining. Once the staging has succeeded, the number of files is the
+    # number of files staged, including any which were already in place.
+    bytes_transferred = Column(BigInteger)
+    files_transferred = Column(Integer)
+    throughput = Column(Float)
+    eta = Column(Integer)
+
+    # The resources used by the rsync processes carrying out the staging, i.e. their total CPU
+    # time in seconds, the largest resident set size in bytes and the number of blocks read
+    # and written.
+    cpu_time = Column(Float)
+    max_rss = Column(BigInteger)
+    block_input = Column(BigInteger)
+    block_output = Column(BigInteger)
+
     def get_staging_path(self):
         return os.path.join(self.staging_target)
 
+    def get_project_name(self):
+        """
+        :return: the name of the project being staged, which is the last part of the staging target,
+        or None if the staging target has not been set yet
+        """
+        if not self.staging_target:
+            return None
+        return os.path.basename(os.path.normpath(self.staging_target))
+
     def __repr__(self):
         return (
                 "Staging order: {"
@@ -119,7 +155,8 @@ class DeliveryOrder(SQLAlchemyBase):
     delivery_project = Column(String, nullable=False)
     ngi_project_name = Column(String, nullable=True)
 
-    # Process id of Mover process used to start the delivery
+    # Process id of the dds process used to upload the delivery, or of the service
+    # process which will start it while the delivery order is pending
     dds_pid = Column(Integer)
 
     delivery_status = Column(Enum(DeliveryStatus))
@@ -129,6 +166,28 @@ class DeliveryOrder(SQLAlchemyBase):
     # skipping it for now. / JD 20161107
     staging_order_id = Column(Integer)
 
+    # The number of times the upload has been attempted so far, and when each attempt was started,
+    # how many seconds it ran and the status code of dds, as a JSON list, e.g:
+    # [{"started": "2022-06-23T10:00:00", "duration": 12.3, "status_code": 1}]
+    delivery_attempts = Column(Integer)
+    attempt_timings = Column(String)
+
+    # The progress of the upload as last seen, i.e. the number of files and bytes uploaded so far,
+    # the current throughput in bytes/s and the estimated number of seconds remaining. Delivery
+    # orders uploaded together by one dds process all get the progress of the whole upload.
+    files_uploaded = Column(Integer)
+    bytes_uploaded = Column(BigInteger)
+    throughput = Column(Float)
+    eta = Column(Integer)
+
+    # The resources used by the dds process carrying out the delivery, i.e. its CPU time in
+    # seconds, its largest resident set size in bytes and the number of blocks read and written.
+    # Delivery orders uploaded together by one dds process all get the usage of that process.
+    cpu_time = Column(Float)
+    max_rss = Column(BigInteger)
+    block_input = Column(BigInteger)
+    block_output = Column(BigInteger)
+
     def __repr__(self):
         return (
                 "Delivery order: {"
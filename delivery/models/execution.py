@@ -7,16 +7,77 @@ class ExecutionResult(BaseModel):
     Used to represent the result of a external program execution
     """
 
-    def __init__(self, stdout, stderr, status_code):
+    def __init__(self, stdout, stderr, status_code, resource_usage=None):
         """
         Instantiate the execution result
         :param stdout: of the executed process
         :param stderr: of the executed process
         :param status_code: exit code of the program
+        :param resource_usage: a ResourceUsage with the resources used by the program, if known
         """
         self.stdout = stdout
         self.stderr = stderr
         self.status_code = status_code
+        self.resource_usage = resource_usage
+
+
+class ResourceUsage(BaseModel):
+    """
+    The resources used by one or more external program executions
+    """
+
+    def __init__(self, cpu_time, max_rss, block_input, block_output):
+        """
+        Instantiate the resource usage
+        :param cpu_time: the user and system CPU time used, in seconds
+        :param max_rss: the maximum resident set size, in bytes
+        :param block_input: the number of blocks read from the file systems
+        :param block_output: the number of blocks written to the file systems
+        """
+        self.cpu_time = cpu_time
+        self.max_rss = max_rss
+        self.block_input = block_input
+        self.block_output = block_output
+
+    @staticmethod
+    def from_rusage(rusage):
+        """
+        Create a ResourceUsage from the rusage returned by `os.wait4`
+        :param rusage: a resource.struct_rusage
+        :return: a ResourceUsage
+        """
+        # ru_maxrss is given in kilobytes on Linux
+        return ResourceUsage(cpu_time=rusage.ru_utime + rusage.ru_stime,
+                             max_rss=rusage.ru_maxrss * 1024,
+                             block_input=rusage.ru_inblock,
+                             block_output=rusage.ru_oublock)
+
+    @staticmethod
+    def total(resource_usages):
+        """
+        Combine the resources used by executions running side by side. CPU time and block I/O are
+        summed, while the maximum resident set size is that of the largest execution.
+        :param resource_usages: a list of ResourceUsage, where unknown usages are None
+        :return: a ResourceUsage, or None if none of the usages are known
+        """
+        known = [resource_usage for resource_usage in resource_usages if resource_usage]
+        if not known:
+            return None
+        return ResourceUsage(cpu_time=sum(usage.cpu_time for usage in known),
+                             max_rss=max(usage.max_rss for usage in known),
+                             block_input=sum(usage.block_input for usage in known),
+                             block_output=sum(usage.block_output for usage in known))
+
+    def store_on(self, order):
+        """
+        Store the resource usage on a StagingOrder or DeliveryOrder
+        :param order: the order to update
+        :return: None
+        """
+        order.cpu_time = self.cpu_time
+        order.max_rss = self.max_rss
+        order.block_input = self.block_input
+        order.block_output = self.block_output
 
 
 class Execution(BaseModel):
@@ -24,11 +85,13 @@ class Execution(BaseModel):
     Model a ongoing execution and provides a handle for the associated process object
     """
 
-    def __init__(self, pid, process_obj):
+    def __init__(self, pid, process_obj, pool=None):
         """
         Instantiate a ongoing external program execution
         :param pid: of the process
         :param process_obj: the python process object associated with the execution
+        :param pool: the PoolPlace held by the execution in an ExecutionPool, if any
         """
         self.pid = pid
         self.process_obj = process_obj
+        self.pool = pool
@@ -1,18 +1,24 @@
 import os
 import re
+import hashlib
 import json
 import shutil
 import tempfile
 import logging
+from datetime import datetime, timedelta
 from tornado import gen
 
 from delivery.models import BaseModel
 from delivery.exceptions import CannotParseDDSOutputException, \
         InvalidStatusException, ProjectNotFoundException
 from delivery.models.db_models import StagingStatus, DeliveryStatus
+from delivery.services.dds_service import DDSUploadMonitor
 
 log = logging.getLogger(__name__)
 
+# The pool of the ExternalProgramService which dds uploads are run in
+DDS_POOL = 'dds'
+
 
 class BaseProject(BaseModel):
     """
@@ -124,7 +130,10 @@ class DDSProject:
 
         if os.path.exists(auth_token):
             token_path = auth_token
+            with open(token_path) as token_file:
+                token = token_file.read()
         else:
+            token = auth_token
             self.temporary_token = tempfile.NamedTemporaryFile(
                     mode='w', delete=True)
             self.temporary_token.write(auth_token)
@@ -134,6 +143,9 @@ class DDSProject:
 
         self.dds_service = dds_service
         self.project_id = dds_project_id
+        self._token_path = token_path
+        # Identifies the token in the cache of NGI project names, without keeping the token itself
+        self._token_digest = hashlib.sha256(token.encode()).hexdigest()
 
         self._base_cmd = [
                 'dds',
@@ -191,47 +203,81 @@ class DDSProject:
                 dds_project_id=None,
                 )
 
-        cmd = self._base_cmd[:]
+        dds_client = dds_service.dds_client
+        if dds_client:
+            self.project_id = yield dds_client.create_project(
+                token_path=self._token_path,
+                title=ngi_project_name.replace('-', ''),
+                description=project_metadata['description'],
+                pi=project_metadata['pi'],
+                owners=project_metadata.get('owners', []),
+                researchers=project_metadata.get('researchers', []),
+                non_sensitive=project_metadata.get('non-sensitive', False))
+        else:
+            cmd = self._base_cmd[:]
 
-        cmd += [
-            'project', 'create',
-            '--title', ngi_project_name.replace('-', ''),
-            '--description', '"{}"'.format(project_metadata['description']),
-            '-pi',  project_metadata['pi']
-            ]
+            cmd += [
+                'project', 'create',
+                '--title', ngi_project_name.replace('-', ''),
+                '--description', '"{}"'.format(project_metadata['description']),
+                '-pi',  project_metadata['pi']
+                ]
 
-        cmd += [
-            args
-            for owner in project_metadata.get('owners', [])
-            for args in ['--owner', owner]
-            ]
+            cmd += [
+                args
+                for owner in project_metadata.get('owners', [])
+                for args in ['--owner', owner]
+                ]
 
-        cmd += [
-            args
-            for researcher in project_metadata.get('researchers', [])
-            for args in ['--researcher', researcher]
-            ]
+            cmd += [
+                args
+                for researcher in project_metadata.get('researchers', [])
+                for args in ['--researcher', researcher]
+                ]
 
-        if project_metadata.get('non-sensitive', False):
-            cmd += ['--non-sensitive']
+            if project_metadata.get('non-sensitive', False):
+                cmd += ['--non-sensitive']
 
-        stdout = yield self._run(cmd)
-        self.project_id = cls._parse_dds_project_id(stdout)
+            stdout = yield self._run(cmd)
+            self.project_id = cls._parse_dds_project_id(stdout)
 
         self._ngi_project_name = ngi_project_name
+        dds_service.cache_ngi_project_name(self._token_digest, self.project_id, ngi_project_name)
 
         return self
 
+    @staticmethod
+    def _ngi_project_name_from_title(dds_project_title):
+        """
+        The title of a project in DDS is its NGI project name without the
+        dash, e.g. AB1234 for AB-1234.
+        """
+        return re.sub(r"(\D{2})(\d{4})", r"\1-\2", dds_project_title)
+
     @gen.coroutine
     def get_ngi_project_name(self):
         """
         NGI project name (e.g. AB-1234).
 
-        If the attribute is not set, it will fetched from DDS.
+        If the attribute is not set, it will be taken from the cache of the
+        DDSService (if it was cached for the same token), or else fetched from
+        DDS.
         """
         try:
             return self._ngi_project_name
         except AttributeError:
+            pass
+
+        cached_ngi_project_name = self.dds_service.get_cached_ngi_project_name(
+                self._token_digest, self.project_id)
+        if cached_ngi_project_name:
+            self._ngi_project_name = cached_ngi_project_name
+            return self._ngi_project_name
+
+        dds_client = self.dds_service.dds_client
+        if dds_client:
+            dds_projects = yield dds_client.list_projects(self._token_path)
+        else:
             cmd = self._base_cmd[:]
             cmd += [
                     'ls',
@@ -239,21 +285,26 @@ class DDSProject:
                     ]
 
             dds_output = yield self._run(cmd)
-            try:
-                dds_project_title = next(
-                        project["Title"]
-                        for project in json.loads(dds_output)
-                        if project["Project ID"] == self.project_id
-                        )
-
-                self._ngi_project_name = re.sub(
-                        r"(\D{2})(\d{4})",
-                        r"\1-\2",
-                        dds_project_title)
-            except StopIteration:
-                err_msg = "Project {self.project_id} not found in DDS."
-                log.error(err_msg)
-                raise ProjectNotFoundException(err_msg)
+            dds_projects = json.loads(dds_output)
+
+        # Remember the names of all listed projects, since further
+        # deliveries are likely to be made to some of them
+        for project in dds_projects:
+            self.dds_service.cache_ngi_project_name(
+                    self._token_digest,
+                    project["Project ID"],
+                    self._ngi_project_name_from_title(project["Title"]))
+
+        try:
+            self._ngi_project_name = next(
+                    self._ngi_project_name_from_title(project["Title"])
+                    for project in dds_projects
+                    if project["Project ID"] == self.project_id
+                    )
+        except StopIteration:
+            err_msg = "Project {self.project_id} not found in DDS."
+            log.error(err_msg)
+            raise ProjectNotFoundException(err_msg)
 
         return self._ngi_project_name
 
@@ -285,47 +336,107 @@ class DDSProject:
         int
             Delivery order id, can be used to retrieve delivery status.
         """
-        staging_order = self.dds_service.staging_service \
-            .get_stage_order_by_id(staging_id)
-        if not staging_order or \
-                not staging_order.status == StagingStatus.staging_successful:
-            raise InvalidStatusException(
-                "Only deliver by staging_id if it has a successful status!"
-                "Staging order was: {}".format(staging_order))
+        delivery_order_ids = yield self.put_many(
+                [staging_id],
+                skip_delivery=skip_delivery,
+                deadline=deadline,
+                release=release)
+        return delivery_order_ids[0]
+
+    @gen.coroutine
+    def put_many(
+            self,
+            staging_ids,
+            skip_delivery=False,
+            deadline=None,
+            release=True,
+            ):
+        """
+        Upload the data of several staging orders to DDS with a single
+        `dds data put`, and release the project once all of it has been
+        uploaded. One delivery order is created per staging order.
+
+        Parameters
+        ----------
+        staging_ids: list(int)
+            ids of the staging orders to deliver
+        skip_delivery: bool
+            whether or not to skip the delivery step and only create the
+            DeliveryOrders (for testing purposes only).
+        deadline: int
+            project deadline in days.
+        release: bool
+            whether or not to release the project on DDS
+
+        Returns
+        -------
+        list(int)
+            Delivery order ids, in the same order as the staging ids. Can be
+            used to retrieve the delivery status of each staging order.
+        """
+        staging_orders = []
+        for staging_id in staging_ids:
+            staging_order = self.dds_service.staging_service \
+                .get_stage_order_by_id(staging_id)
+            if not staging_order or \
+                    not staging_order.status == StagingStatus.staging_successful:
+                raise InvalidStatusException(
+                    "Only deliver by staging_id if it has a successful status!"
+                    "Staging order was: {}".format(staging_order))
+            staging_orders.append(staging_order)
 
         ngi_project_name = yield self.get_ngi_project_name()
 
-        delivery_order = self.dds_service.delivery_repo.create_delivery_order(
-            delivery_source=staging_order.get_staging_path(),
-            delivery_project=self.project_id,
-            ngi_project_name=ngi_project_name,
-            delivery_status=DeliveryStatus.pending,
-            staging_order_id=staging_id,
-            )
+        delivery_orders = [
+            self.dds_service.delivery_repo.create_delivery_order(
+                delivery_source=staging_order.get_staging_path(),
+                delivery_project=self.project_id,
+                ngi_project_name=ngi_project_name,
+                delivery_status=DeliveryStatus.pending,
+                staging_order_id=staging_id,
+                )
+            for staging_id, staging_order in zip(staging_ids, staging_orders)
+            ]
 
+        # The upload gets a log of its own while it runs, so that its
+        # progress can be followed. It is added to the dds log afterwards.
+        upload_log_path = "{}.delivery_{}".format(
+                self.dds_service.dds_conf["log_path"], delivery_orders[0].id)
         cmd = self._base_cmd[:]
+        cmd[cmd.index('--log-file') + 1] = upload_log_path
 
         cmd += [
                 'data', 'put',
                 '--mount-dir', self.dds_service.staging_dir,
-                '--source', delivery_order.delivery_source,
-                '--project', delivery_order.delivery_project,
+                ]
+
+        for delivery_order in delivery_orders:
+            cmd += ['--source', delivery_order.delivery_source]
+
+        cmd += [
+                '--project', self.project_id,
                 '--silent',
                 ]
 
+        upload_threads = self.dds_service.get_upload_threads(staging_orders)
+        if upload_threads:
+            cmd += ['--num-threads', str(upload_threads)]
+
         if skip_delivery:
             session = self.dds_service.session_factory()
-            delivery_order.delivery_status = DeliveryStatus.delivery_skipped
+            for delivery_order in delivery_orders:
+                delivery_order.delivery_status = DeliveryStatus.delivery_skipped
             session.commit()
         else:
             self._run_delivery(
                     cmd,
-                    delivery_order,
-                    staging_order,
+                    delivery_orders,
+                    staging_orders,
+                    upload_log_path,
                     deadline=deadline,
                     release=release)
 
-        return delivery_order.id
+        return [delivery_order.id for delivery_order in delivery_orders]
 
     @gen.coroutine
     def release(self, deadline=None):
@@ -337,6 +448,11 @@ class DDSProject:
         deadline: int
             project deadline in days.
         """
+        dds_client = self.dds_service.dds_client
+        if dds_client:
+            yield dds_client.release_project(self._token_path, self.project_id, deadline=deadline)
+            return
+
         cmd = self._base_cmd[:]
 
         cmd += [
@@ -363,8 +479,9 @@ class DDSProject:
         """
         log.debug(f"Running dds with command: {' '.join(cmd)}")
         execution = self.dds_service.external_program_service.run(cmd)
+        # The whole output is kept, since it is parsed by the callers
         execution_result = yield self.dds_service.external_program_service \
-            .wait_for_execution(execution)
+            .wait_for_execution(execution, output_tail_size=None)
 
         if execution_result.status_code != 0:
             error_msg = (
@@ -379,22 +496,26 @@ class DDSProject:
     def _run_delivery(
             self,
             cmd,
-            delivery_order,
-            staging_order,
+            delivery_orders,
+            staging_orders,
+            upload_log_path,
             deadline=None,
             release=True,
             ):
         """
-        Start a delivery and release the project in DDS
+        Start a delivery and release the project in DDS. The progress of the
+        upload is stored on the delivery orders while it runs.
 
         Parameters
         ----------
         cmd: str
             dds command to run to start the delivery.
-        delivery_order: DeliveryOrder
-            Delivery Order associated to the delivery
-        staging_order: StagingOrder
-            Staging Order to deliver
+        delivery_orders: list(DeliveryOrder)
+            Delivery Orders associated to the delivery, one per staging order
+        staging_orders: list(StagingOrder)
+            Staging Orders to deliver
+        upload_log_path: str
+            log file written by dds for this upload
         deadline: int
             project deadline in days.
         release: bool
@@ -402,22 +523,54 @@ class DDSProject:
         """
         session = self.dds_service.session_factory()
         try:
-            log.debug(f"Delivering {delivery_order}...")
+            log.debug(f"Delivering {delivery_orders}...")
             log.debug("Running dds with cmd: {}".format(" ".join(cmd)))
 
-            execution = self.dds_service.dds_external_program_service.run(cmd)
-
-            delivery_order.delivery_status = DeliveryStatus.delivery_in_progress
-            delivery_order.dds_pid = execution.pid
-            session.commit()
-
-            execution_result = yield self.dds_service \
-                .dds_external_program_service \
-                .wait_for_execution(execution)
+            total_size = sum(staging_order.size or 0 for staging_order in staging_orders)
+            attempt_timings = []
+            max_attempts = 1 + self.dds_service.upload_retries
+            for attempt in range(1, max_attempts + 1):
+                started = datetime.now()
+                execution_result = yield self._upload(
+                        cmd,
+                        delivery_orders,
+                        upload_log_path,
+                        total_size,
+                        session)
+
+                attempt_timings.append({
+                    'started': started.isoformat(timespec='seconds'),
+                    'duration': round((datetime.now() - started).total_seconds(), 1),
+                    'status_code': execution_result.status_code,
+                    })
+                for delivery_order in delivery_orders:
+                    delivery_order.delivery_attempts = attempt
+                    delivery_order.attempt_timings = json.dumps(attempt_timings)
+                session.commit()
+
+                if execution_result.status_code == 0 or attempt == max_attempts:
+                    break
+
+                # Files which were uploaded by the failed attempt are
+                # skipped by dds when the same tree is put again
+                backoff = self.dds_service.upload_retry_backoff * 2 ** (attempt - 1)
+                log.warning(
+                    f"Upload of {delivery_orders} failed with status code: "
+                    f"{execution_result.status_code}, retrying in {backoff} "
+                    f"seconds (attempt {attempt + 1} of {max_attempts})")
+                # The dds process of the failed attempt is gone, so the
+                # orders wait for the next attempt as pending, owned by this
+                # process like orders waiting for a place in the dds pool
+                for delivery_order in delivery_orders:
+                    delivery_order.delivery_status = DeliveryStatus.pending
+                    delivery_order.dds_pid = os.getpid()
+                session.commit()
+                yield gen.sleep(backoff)
 
             if execution_result.status_code == 0:
-                log.info(f"Removing staged runfolder at {staging_order.staging_target}")
-                shutil.rmtree(staging_order.staging_target)
+                for staging_order in staging_orders:
+                    log.info(f"Removing staged runfolder at {staging_order.staging_target}")
+                    shutil.rmtree(staging_order.staging_target)
 
                 if release:
                     # OBS: in the future we might want to do this through a
@@ -426,22 +579,121 @@ class DDSProject:
                     log.info(f"Releasing project {self.project_id}")
                     yield self.release(deadline=deadline)
 
-                delivery_order.delivery_status = DeliveryStatus.delivery_successful
-                log.info(f"Successfully delivered: {delivery_order}")
+                for delivery_order in delivery_orders:
+                    delivery_order.delivery_status = DeliveryStatus.delivery_successful
+                    log.info(f"Successfully delivered: {delivery_order}")
             else:
-                delivery_order.delivery_status = DeliveryStatus.delivery_failed
                 error_msg = \
-                    f"Failed to deliver: {delivery_order}." \
+                    f"Failed to deliver: {delivery_orders}." \
                     f"DDS returned status code: {execution_result.status_code}"
                 log.error(error_msg)
                 raise RuntimeError(error_msg)
 
         except Exception as e:
-            delivery_order.delivery_status = DeliveryStatus.delivery_failed
+            for delivery_order in delivery_orders:
+                delivery_order.delivery_status = DeliveryStatus.delivery_failed
             raise e
         finally:
             session.commit()
 
+    @gen.coroutine
+    def _upload(
+            self,
+            cmd,
+            delivery_orders,
+            upload_log_path,
+            total_size,
+            session,
+            ):
+        """
+        Run one attempt at uploading data to DDS, storing the progress of the
+        upload on the delivery orders while it runs.
+
+        Parameters
+        ----------
+        cmd: str
+            dds command to run to upload the data.
+        delivery_orders: list(DeliveryOrder)
+            Delivery Orders associated to the upload
+        upload_log_path: str
+            log file written by dds for this upload
+        total_size: int
+            number of bytes to upload
+        session: Session
+            database session to commit the progress with
+
+        Returns
+        -------
+        ExecutionResult
+            the result of the dds process
+        """
+        try:
+            # The delivery orders stay as they are while waiting for a place
+            # in the dds pool
+            execution = yield self.dds_service.dds_external_program_service.run_in_pool(
+                cmd, DDS_POOL,
+                size=total_size,
+                group=self.project_id)
+
+            for delivery_order in delivery_orders:
+                delivery_order.delivery_status = DeliveryStatus.delivery_in_progress
+                delivery_order.dds_pid = execution.pid
+            session.commit()
+
+            upload_monitor = DDSUploadMonitor(
+                    execution.pid,
+                    upload_log_path,
+                    total_size,
+                    source_directories=[
+                        delivery_order.delivery_source
+                        for delivery_order in delivery_orders
+                        ])
+            uploading = self.dds_service \
+                .dds_external_program_service \
+                .wait_for_execution(execution)
+            while True:
+                try:
+                    execution_result = yield gen.with_timeout(
+                            timedelta(seconds=self.dds_service.progress_update_interval),
+                            uploading)
+                    break
+                except gen.TimeoutError:
+                    upload_monitor.update()
+                    for delivery_order in delivery_orders:
+                        upload_monitor.store_on(delivery_order)
+                    session.commit()
+            upload_monitor.update()
+            for delivery_order in delivery_orders:
+                upload_monitor.store_on(delivery_order)
+            if execution_result.resource_usage:
+                for delivery_order in delivery_orders:
+                    execution_result.resource_usage.store_on(delivery_order)
+
+            return execution_result
+        finally:
+            # Each attempt starts with an empty log, so that its progress is
+            # counted from the start
+            self._append_upload_log(upload_log_path)
+
+    def _append_upload_log(self, upload_log_path):
+        """
+        Move the log of an upload into the dds log.
+
+        Parameters
+        ----------
+        upload_log_path: str
+            log file written by dds for the upload
+        """
+        try:
+            with open(upload_log_path, 'rb') as upload_log, \
+                    open(self.dds_service.dds_conf["log_path"], 'ab') as dds_log:
+                shutil.copyfileobj(upload_log, dds_log)
+            os.remove(upload_log_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.warning(f"Could not add {upload_log_path} to the dds log: {e}")
+
     @staticmethod
     def _parse_dds_project_id(dds_output):
         """
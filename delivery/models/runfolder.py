@@ -21,6 +21,32 @@ class Runfolder(BaseModel):
         self.projects = projects
         self.checksums = checksums
 
+    @property
+    def checksums(self):
+        """
+        The checksums of the files in the runfolder, as a dict with the paths relative to the runfolder as
+        keys. If the runfolder has been given a way to load its checksums (see `load_checksums_with`), they
+        are loaded the first time they are asked for.
+        """
+        if self._checksum_loader:
+            self._checksums = self._checksum_loader()
+            self._checksum_loader = None
+        return self._checksums
+
+    @checksums.setter
+    def checksums(self, checksums):
+        self._checksums = checksums
+        self._checksum_loader = None
+
+    def load_checksums_with(self, checksum_loader):
+        """
+        Defer loading the checksums of the runfolder until they are asked for
+        :param checksum_loader: a function without arguments, returning the checksums of the runfolder
+        :return: None
+        """
+        self._checksums = None
+        self._checksum_loader = checksum_loader
+
     def __eq__(self, other):
         """
         Two runfolders should be considered the same if the represent the same directory on disk
@@ -1,7 +1,11 @@
+import os
 
+
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound
 
 from delivery.models.db_models import DeliveryOrder
+from delivery.services.order_event_service import collect_order_event
 
 
 class DatabaseBasedDeliveriesRepository(object):
@@ -45,6 +49,42 @@ class DatabaseBasedDeliveriesRepository(object):
         except NoResultFound:
             return None
 
+    def get_delivery_orders_by_status(self, delivery_status):
+        """
+        Get all delivery orders with the given status
+        :param delivery_status: the DeliveryStatus to search for
+        :return: all matching delivery orders as a list
+        """
+        return self.session.query(DeliveryOrder).\
+            filter(DeliveryOrder.delivery_status == delivery_status).\
+            order_by(DeliveryOrder.id).all()
+
+    def claim_delivery_order(self, delivery_order, new_status):
+        """
+        Change the status of a delivery order, provided that its status and dds pid in the database are still
+        the ones of the given instance. Since this is done in a single update statement, only one of several
+        processes trying to claim the same delivery order will succeed.
+        :param delivery_order: the DeliveryOrder to claim
+        :param new_status: the DeliveryStatus to set
+        :return: True if the delivery order was claimed, otherwise False
+        """
+        if delivery_order.dds_pid is None:
+            pid_unchanged = DeliveryOrder.dds_pid.is_(None)
+        else:
+            pid_unchanged = DeliveryOrder.dds_pid == delivery_order.dds_pid
+        nbr_of_updated_orders = self.session.query(DeliveryOrder).\
+            filter(DeliveryOrder.id == delivery_order.id).\
+            filter(DeliveryOrder.delivery_status == delivery_order.delivery_status).\
+            filter(pid_unchanged).\
+            update({DeliveryOrder.delivery_status: new_status}, synchronize_session=False)
+        claimed = nbr_of_updated_orders == 1
+        if claimed:
+            set_committed_value(delivery_order, 'delivery_status', new_status)
+            # The update is not flushed from the session, so the change is published explicitly
+            collect_order_event(self.session, delivery_order)
+        self.session.commit()
+        return claimed
+
     def get_delivery_orders(self):
         """
         Return all delivery orders for the database as a list
@@ -68,7 +108,8 @@ class DatabaseBasedDeliveriesRepository(object):
         :param staging_order_id: NOTA BENE: this will need to be verified
             against the staging table before inserting it here, because at this
             point there is no validation that the value is valid!
-        :return: the created delivery order
+        :return: the created delivery order, whose dds pid is the one of this process until its dds
+        process has been started
         """
         order = DeliveryOrder(
                 delivery_source=delivery_source,
@@ -76,6 +117,7 @@ class DatabaseBasedDeliveriesRepository(object):
                 ngi_project_name=ngi_project_name,
                 delivery_status=delivery_status,
                 staging_order_id=staging_order_id,
+                dds_pid=os.getpid(),
                               )
         self.session.add(order)
         self.session.commit()
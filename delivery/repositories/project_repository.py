@@ -116,13 +116,7 @@ class UnorganisedRunfolderProjectRepository(object):
         :return: a list of RunfolderProject instances or None if no projects were found
         :raises: ProjectsDirNotfoundException if the Unaligned directory could not be found in the runfolder
         """
-        def dir_contains_fastq_files(d):
-            return any(
-                map(
-                    lambda f: f.endswith("fastq.gz"),
-                    self.filesystem_service.list_files_recursively(d)))
-
-        def project_from_dir(d):
+        def project_from_dir(d, files_in_project):
             project = RunfolderProject(
                 name=os.path.basename(d),
                 path=os.path.join(projects_base_dir, d),
@@ -130,28 +124,37 @@ class UnorganisedRunfolderProjectRepository(object):
                 runfolder_name=runfolder.name
             )
             try:
-                project.project_files = self.get_report_files(project, checksums=runfolder.checksums)
+                project.project_files = self.get_report_files(
+                    project,
+                    checksums=runfolder.checksums,
+                    files_in_project=files_in_project)
             except ProjectReportNotFoundException as e:
                 log.warning(e)
 
-            project.samples = self.sample_repository.get_samples(project, runfolder)
+            project.samples = self.sample_repository.get_samples(
+                project,
+                runfolder,
+                files_in_project=files_in_project)
             return project
 
         try:
             projects_base_dir = os.path.join(runfolder.path, self.PROJECTS_DIR)
 
-            # only include directories that have fastq.gz files beneath them
-            project_directories = filter(
-                dir_contains_fastq_files,
-                self.filesystem_service.find_project_directories(projects_base_dir)
-            )
+            projects = []
+            for project_directory in self.filesystem_service.find_project_directories(projects_base_dir):
+                # the files in the project are listed once, and used to find both its samples and its reports
+                files_in_project = list(self.filesystem_service.list_files_recursively(project_directory))
+
+                # only include directories that have fastq.gz files beneath them
+                if any(map(lambda f: f.endswith("fastq.gz"), files_in_project)):
+                    projects.append(project_from_dir(project_directory, files_in_project))
 
-            return list(map(project_from_dir, project_directories)) or None
+            return projects or None
 
         except FileNotFoundError:
             raise ProjectsDirNotfoundException("Did not find Unaligned folder for: {}".format(runfolder.name))
 
-    def get_report_files(self, project, checksums=None):
+    def get_report_files(self, project, checksums=None, files_in_project=None):
         """
         Gets the paths to files associated with the supplied project's report. This can be either a MultiQC report or,
         if no such report was found, a Sisyphus report. If a pre-calculated checksum cannot be found for a file, it will
@@ -160,9 +163,18 @@ class UnorganisedRunfolderProjectRepository(object):
         :param project: a RunfolderProject instance
         :param checksums: a dict with pre-calculated checksums for files. paths are keys and the corresponding
         checksum is the value
+        :param files_in_project: the paths to all files below the project path, if they have already been listed.
+        Report files in the project are then looked for among them rather than on disk
         :return: a list of RunfolderFile objects
         :raises ProjectReportNotFoundException: if no MultiQC or Sisyphus report was found for the project
         """
+        files_in_project = set(files_in_project) if files_in_project is not None else None
+
+        def _exists(file_path):
+            if files_in_project is not None and file_path.startswith(os.path.join(project.path, "")):
+                return file_path in files_in_project
+            return self.filesystem_service.exists(file_path)
+
         def _file_object_from_path(file_path):
             relative_file_path = self.filesystem_service.relpath(
                 file_path,
@@ -172,16 +184,18 @@ class UnorganisedRunfolderProjectRepository(object):
             return RunfolderFile(file_path, file_checksum=checksum)
 
         checksums = checksums or {}
-        if self.filesystem_service.exists(self.multiqc_report_path(project)):
+        if _exists(self.multiqc_report_path(project)):
             log.info("MultiQC reports found in Unaligned/{}, overriding organisation of seqreports".format(project.name))
             return list(map(_file_object_from_path, self.multiqc_report_files(project)))
         for sisyphus_report_path in self.sisyphus_report_path(project):
-            if self.filesystem_service.exists(sisyphus_report_path):
+            if _exists(sisyphus_report_path):
                 log.info("Organising sisyphus reports for {}".format(project.name))
+                report_dir = self.filesystem_service.dirname(sisyphus_report_path)
                 return list(map(
                     _file_object_from_path,
                     self.sisyphus_report_files(
-                        self.filesystem_service.dirname(sisyphus_report_path))))
+                        report_dir,
+                        files_in_report_dir=files_in_project if report_dir == project.path else None)))
         if self.filesystem_service.exists(self.seqreports_path(project)):
             log.info("Organising seqreports for {}".format(project.name))
             return list(map(_file_object_from_path, self.seqreports_files(project)))
@@ -194,17 +208,18 @@ class UnorganisedRunfolderProjectRepository(object):
                os.path.join(
                    project.path, "report.html")
 
-    def sisyphus_report_files(self, report_dir):
+    def sisyphus_report_files(self, report_dir, files_in_report_dir=None):
         report_files = [
             os.path.join(report_dir, "report.html"),
             os.path.join(report_dir, "report.xml"),
             os.path.join(report_dir, "report.xsl")
         ]
-        report_files.extend(list(
-            self.filesystem_service.list_files_recursively(
-                os.path.join(
-                    report_dir,
-                    "Plots"))))
+        plots_dir = os.path.join(report_dir, "Plots")
+        if files_in_report_dir is not None:
+            plot_files = filter(lambda f: f.startswith(os.path.join(plots_dir, "")), files_in_report_dir)
+        else:
+            plot_files = self.filesystem_service.list_files_recursively(plots_dir)
+        report_files.extend(list(plot_files))
         return report_files
 
     @staticmethod
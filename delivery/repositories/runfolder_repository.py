@@ -3,6 +3,11 @@ from collections import OrderedDict
 import logging
 import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado import gen
+from tornado.ioloop import IOLoop
 
 from delivery.exceptions import ChecksumFileNotFoundException
 from delivery.models.runfolder import Runfolder, RunfolderFile
@@ -16,20 +21,41 @@ log = logging.getLogger(__name__)
 class FileSystemBasedRunfolderRepository(object):
     """
     Uses the file system as a source of truth for information about what runfolders are available.
+
+    The runfolders found are kept in a catalogue, so that listing them does not mean reading every runfolder
+    again. A runfolder is only read again once its directory, its projects directory or its checksum file has
+    been modified, and the runfolder directory is only listed again once it has been modified. Bringing the
+    catalogue up to date still means checking every runfolder on disk, so it should not be done on the IOLoop.
     """
 
     CHECKSUM_FILE_PATH = os.path.join("MD5", "checksums.md5")
     SAMPLESHEET_PATH = "SampleSheet.csv"
+    RUNFOLDER_EXPRESSION = r"^\d+_"
 
-    def __init__(self, base_path, file_system_service=FileSystemService(), metadata_service=MetadataService()):
+    def __init__(self, base_path, file_system_service=FileSystemService(), metadata_service=MetadataService(),
+                 catalogue_refresh_interval=None, max_workers=8):
         """
         Instantiate a new FileSystemBasedRunfolderRepository
         :param base_path: the directory where runfolders are stored
         :param file_system_service: a service which can access the file system.
+        :param catalogue_refresh_interval: if set, the number of seconds between bringing the catalogue of
+        runfolders up to date in the background (see `refresh_catalogue_periodically`), in which case runfolders
+        and projects are looked up as last catalogued. Otherwise the catalogue is brought up to date on every
+        lookup.
+        :param max_workers: the number of runfolders to check and read at the same time when cataloguing them
         """
         self._base_path = base_path
         self.file_system_service = file_system_service
         self.metadata_service = metadata_service
+        self.catalogue_refresh_interval = catalogue_refresh_interval
+        self.max_workers = max_workers
+
+        # Runfolder directory -> (modification times of the runfolder when it was read, Runfolder)
+        self._catalogue = None
+        # Project name -> the projects with that name in the catalogued runfolders
+        self._project_index = {}
+        self._base_path_mtime = None
+        self._catalogue_lock = threading.Lock()
 
     def _add_projects_to_runfolder(self, runfolder):
         """
@@ -39,7 +65,7 @@ class FileSystemBasedRunfolderRepository(object):
         :return: None
         """
         try:
-            projects_base_dir = os.path.join(runfolder.path, "Projects")
+            projects_base_dir = self._projects_base_dir(runfolder.path)
             project_directories = self.file_system_service.find_project_directories(
                 projects_base_dir)
 
@@ -60,21 +86,40 @@ class FileSystemBasedRunfolderRepository(object):
             log.warning("Did not find Project folder for: {}".format(runfolder.name))
             pass
 
+    def _projects_base_dir(self, runfolder_path):
+        return os.path.join(runfolder_path, "Projects")
+
     def _add_checksums_for_runfolder(self, runfolder, ignore_errors=False):
-        try:
-            checksums = self.metadata_service.parse_checksum_file(self.checksum_file(runfolder))
-            runfolder.checksums = checksums
-        except ChecksumFileNotFoundException as e:
-            if not ignore_errors:
-                raise
+        """
+        Let the runfolder load its checksums once they are needed, since the checksum file can list a very
+        large number of files.
+        :param runfolder: to add checksums to
+        :param ignore_errors: if False, raise a ChecksumFileNotFoundException right away if the runfolder has
+        no checksum file, otherwise leave the checksums of the runfolder as None
+        :return: None
+        """
+        checksum_file = self.checksum_file(runfolder)
+        if not ignore_errors and not self.file_system_service.isfile(checksum_file):
+            raise ChecksumFileNotFoundException("Checksum file '{}' could not be found".format(checksum_file))
 
-    def _get_runfolder_directories(self):
+        def _load_checksums():
+            try:
+                return self.metadata_service.parse_checksum_file(checksum_file)
+            except ChecksumFileNotFoundException:
+                if not ignore_errors:
+                    raise
+                return None
+
+        runfolder.load_checksums_with(_load_checksums)
+
+    def _is_runfolder_name(self, name):
         # TODO Filter based on expression for runfolders...
-        runfolder_expression = r"^\d+_"
+        return re.match(self.RUNFOLDER_EXPRESSION, name) is not None
 
+    def _get_runfolder_directories(self):
         directories = self.file_system_service.find_runfolder_directories(self._base_path)
         for directory in directories:
-            if re.match(runfolder_expression, os.path.basename(directory)):
+            if self._is_runfolder_name(os.path.basename(directory)):
                 yield directory
 
     def _get_runfolder_object(self, directory, ignore_errors=False):
@@ -85,16 +130,94 @@ class FileSystemBasedRunfolderRepository(object):
         self._add_projects_to_runfolder(runfolder)
         return runfolder
 
-    def _get_runfolders(self, ignore_errors=False):
-        for directory in self._get_runfolder_directories():
-            yield self._get_runfolder_object(directory, ignore_errors=ignore_errors)
+    def _runfolder_signature(self, directory):
+        path = os.path.join(self._base_path, directory)
+        return tuple(
+            self.file_system_service.mtime(p)
+            for p in (path, self._projects_base_dir(path), os.path.join(path, self.CHECKSUM_FILE_PATH)))
+
+    def refresh_catalogue(self):
+        """
+        Bring the catalogue of runfolders up to date with the file system, only reading the runfolders which
+        have been added or modified since they were last catalogued. Every catalogued runfolder is checked,
+        which only means looking up the modification times of its signature (see `_runfolder_signature`).
+        :return: None
+        """
+        with self._catalogue_lock:
+            previous_catalogue = self._catalogue or {}
+            # The modification time is taken before listing, so that any runfolder added while listing is
+            # picked up by the next refresh
+            base_path_mtime = self.file_system_service.mtime(self._base_path)
+            if self._catalogue is None or base_path_mtime != self._base_path_mtime:
+                directories = list(self._get_runfolder_directories())
+            else:
+                directories = list(previous_catalogue.keys())
+
+            def _catalogue_entry(directory):
+                catalogued = previous_catalogue.get(directory)
+                signature = self._runfolder_signature(directory)
+                if catalogued and catalogued[0] == signature:
+                    return catalogued
+                return signature, self._get_runfolder_object(directory, ignore_errors=True)
+
+            # Checking and reading a runfolder is mostly spent waiting for the file system, so they are
+            # checked and read in parallel
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                catalogue = dict(zip(directories, executor.map(_catalogue_entry, directories)))
+
+            # Indexing the projects is cheap compared to reading the runfolders, so the index is rebuilt
+            # whenever any runfolder has been added, removed or read again
+            if catalogue.keys() != previous_catalogue.keys() or \
+                    any(entry is not previous_catalogue[directory] for directory, entry in catalogue.items()):
+                self._project_index = self._index_projects(catalogue)
+
+            self._catalogue = catalogue
+            self._base_path_mtime = base_path_mtime
+
+    @staticmethod
+    def _index_projects(catalogue):
+        project_index = {}
+        for _, runfolder in catalogue.values():
+            for project in runfolder.projects or []:
+                project_index.setdefault(project.name, []).append(project)
+        return project_index
+
+    @gen.coroutine
+    def refresh_catalogue_in_background(self):
+        """
+        Bring the catalogue of runfolders up to date in a separate thread, so that the IOLoop is not blocked
+        while reading the runfolders, e.g. to build the catalogue at startup.
+        :return: None
+        """
+        try:
+            yield IOLoop.current().run_in_executor(None, self.refresh_catalogue)
+        except Exception as e:
+            log.error("Could not refresh the catalogue of runfolders: {}".format(e))
+
+    @gen.coroutine
+    def refresh_catalogue_periodically(self):
+        """
+        Bring the catalogue of runfolders up to date every `catalogue_refresh_interval` seconds, in a separate
+        thread so that the IOLoop is not blocked while reading the runfolders.
+        :return: None
+        """
+        while True:
+            yield self.refresh_catalogue_in_background()
+            yield gen.sleep(self.catalogue_refresh_interval)
+
+    def _get_runfolders(self, refresh=True):
+        if refresh:
+            self.refresh_catalogue()
+        # The catalogue is empty until it has been built in the background
+        for _, runfolder in (self._catalogue or {}).values():
+            yield runfolder
 
     def get_runfolders(self):
         """
-        Get all runfolders
+        Get all runfolders, bringing the catalogue up to date first unless it is refreshed in the background
         :return: a generator of known runfolders
         """
-        return self._get_runfolders(ignore_errors=True)
+        return self._get_runfolders(refresh=not self.catalogue_refresh_interval)
 
     def get_runfolder(self, runfolder):
         """
@@ -104,6 +227,14 @@ class FileSystemBasedRunfolderRepository(object):
         :raises: a AssertionError if more than one runfolder was found
                 matching the given name.
         """
+        if not self._is_runfolder_name(runfolder):
+            return None
+
+        # The name is a directory in the base path, so it is looked for there before listing all runfolders
+        if os.path.basename(runfolder) == runfolder:
+            if self.file_system_service.isdir(os.path.join(self._base_path, runfolder)):
+                return self._get_runfolder_object(runfolder)
+
         directories = self._get_runfolder_directories()
         matching_name = list([r for r in directories if os.path.basename(r) == runfolder])
 
@@ -114,20 +245,30 @@ class FileSystemBasedRunfolderRepository(object):
         else:
             return None
 
+    def _get_projects(self, refresh=True):
+        for runfolder in self._get_runfolders(refresh=refresh):
+            if runfolder.projects:
+                for project in runfolder.projects:
+                    yield project
+
     def get_projects(self):
         """
-        Pick up all projects
+        Pick up all projects, bringing the catalogue up to date first unless it is refreshed in the background
         :return: a generator of project instances
         """
-        for runfolder in self.get_runfolders():
-            if runfolder.projects:
-                for project in runfolder.projects:
-                    yield project
+        return self._get_projects(refresh=not self.catalogue_refresh_interval)
 
     def get_project(self, project_name):
-        for project in self.get_projects():
-            if project.name == project_name:
-                yield project
+        """
+        Get all projects with a name, i.e. the project in every runfolder it has been sequenced in. The catalogue
+        is always brought up to date first, also when it is refreshed in the background, so that a project is
+        found in every runfolder it has been added to. Only the runfolders which have been modified since they
+        were catalogued are read again (see `refresh_catalogue`).
+        :param project_name: to look for
+        :return: a generator of the matching project instances
+        """
+        self.refresh_catalogue()
+        return iter(self._project_index.get(project_name, []))
 
     def samplesheet_file(self, runfolder):
         return os.path.join(runfolder.path, self.SAMPLESHEET_PATH)
@@ -163,6 +304,9 @@ class FileSystemBasedUnorganisedRunfolderRepository(FileSystemBasedRunfolderRepo
             metadata_service=metadata_service)
         self.project_repository = project_repository
 
+    def _projects_base_dir(self, runfolder_path):
+        return os.path.join(runfolder_path, self.project_repository.PROJECTS_DIR)
+
     def _add_projects_to_runfolder(self, runfolder):
         runfolder.projects = self.project_repository.get_projects(runfolder)
 
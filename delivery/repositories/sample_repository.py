@@ -23,17 +23,19 @@ class RunfolderProjectBasedSampleRepository(object):
     def __init__(self, file_system_service=FileSystemService()):
         self.file_system_service = file_system_service
 
-    def get_samples(self, project, runfolder):
+    def get_samples(self, project, runfolder, files_in_project=None):
         """
         Parse the supplied project directory and create Sample instances representing the samples in the project.
 
         :param project: a Project instance
         :param runfolder: a Runfolder instance
+        :param files_in_project: the paths to all files below the project path, if they have already been listed,
+        otherwise they are listed from disk
         :return: a list of Sample instances
         """
-        return self._get_samples(project, runfolder)
+        return self._get_samples(project, runfolder, files_in_project=files_in_project)
 
-    def _get_samples(self, project, runfolder):
+    def _get_samples(self, project, runfolder, files_in_project=None):
 
         def _is_fastq_file(f):
             return re.match(self.filename_regexp, f) is not None
@@ -48,9 +50,12 @@ class RunfolderProjectBasedSampleRepository(object):
         def _sample_file_from_path(p):
             return self.sample_file_from_sample_path(p, runfolder)
 
+        if files_in_project is None:
+            files_in_project = self.file_system_service.list_files_recursively(project.path)
+
         project_fastq_files = filter(
             _is_fastq_file,
-            self.file_system_service.list_files_recursively(project.path))
+            files_in_project)
 
         # create SampleFile objects from the paths
         project_sample_files = list(map(
@@ -2,10 +2,12 @@
 import os
 import logging
 
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound
 
-from delivery.models.db_models import StagingOrder
+from delivery.models.db_models import StagingOrder, StagingStatus, DeliverySource
 from delivery.services.file_system_service import FileSystemService
+from delivery.services.order_event_service import collect_order_event
 
 log = logging.getLogger(__name__)
 
@@ -56,7 +58,73 @@ class DatabaseBasedStagingRepository(object):
         except NoResultFound:
             return None
 
-    def create_staging_order(self, source, status, staging_target_dir, project_name):
+    def get_staging_orders_by_status(self, status, custom_session=None):
+        """
+        Get all staging orders with the given status, in the order they were created
+        :param status: the StagingStatus to search for
+        :param custom_session: provide an other session object if that is neccessary for your use case.
+        :return: All staging orders with that status as a list
+        """
+        if custom_session:
+            session = custom_session
+        else:
+            session = self.session
+        return session.query(StagingOrder).\
+            filter(StagingOrder.status == status).\
+            order_by(StagingOrder.id).all()
+
+    def claim_staging_order(self, staging_order, new_status, custom_session=None):
+        """
+        Change the status of a staging order, provided that its status and pid in the database are still the
+        ones of the given instance. Since this is done in a single update statement, only one of several
+        processes trying to claim the same staging order will succeed. The pid of the order is set to the one
+        of the claiming process, so that the order is not considered orphaned while that process is running,
+        and the given instance is updated to match the database.
+        :param staging_order: the StagingOrder to claim
+        :param new_status: the StagingStatus to set
+        :param custom_session: provide an other session object if that is neccessary for your use case.
+        :return: True if the staging order was claimed, otherwise False
+        """
+        if custom_session:
+            session = custom_session
+        else:
+            session = self.session
+        if staging_order.pid is None:
+            pid_unchanged = StagingOrder.pid.is_(None)
+        else:
+            pid_unchanged = StagingOrder.pid == staging_order.pid
+        owner_pid = os.getpid()
+        nbr_of_updated_orders = session.query(StagingOrder).\
+            filter(StagingOrder.id == staging_order.id).\
+            filter(StagingOrder.status == staging_order.status).\
+            filter(pid_unchanged).\
+            update({StagingOrder.status: new_status, StagingOrder.pid: owner_pid}, synchronize_session=False)
+        claimed = nbr_of_updated_orders == 1
+        if claimed:
+            set_committed_value(staging_order, 'status', new_status)
+            set_committed_value(staging_order, 'pid', owner_pid)
+            # The update is not flushed from the session, so the change is published explicitly
+            collect_order_event(session, staging_order)
+        session.commit()
+        return claimed
+
+    def get_last_successful_batch_staging_order(self, project_name):
+        """
+        Get the most recent successful staging order of a batch of runfolders for a project, i.e. a staging
+        order whose source is the links directory of a batch delivery
+        :param project_name: the project to search for
+        :return: the matching StagingOrder or None, if the project has not been staged in batch before
+        """
+        return self.session.query(StagingOrder).\
+            join(DeliverySource, StagingOrder.source == DeliverySource.path).\
+            filter(DeliverySource.project_name == project_name).\
+            filter(DeliverySource.source_name.like("{}/batch%".format(project_name))).\
+            filter(StagingOrder.status == StagingStatus.staging_successful).\
+            order_by(StagingOrder.id.desc()).\
+            first()
+
+    def create_staging_order(self, source, status, staging_target_dir, project_name, rsync_shards=None,
+                             link_dest=None):
         """
         Create a StatingOrder and commit it to the database
         :param source: the directory or file to stage
@@ -64,21 +132,26 @@ class DatabaseBasedStagingRepository(object):
         :param staging_target_dir: the directory to which the StagingOrder should transfer the source
         :param project_name: name of the project to stage (this will be used to determine the name of the
         staging target)
+        :param rsync_shards: the number of rsync processes to split the staging between, or None to use
+        the default
+        :param link_dest: a previously staged directory, files in it which are unchanged in the source will be
+        hardlinked rather than copied
         :return:
         """
 
-        order = StagingOrder(source=source, status=status)
-        self.session.add(order)
-
-        self.session.commit()
-
-        if self.file_system_service.isfile(order.source):
+        if self.file_system_service.isfile(source):
             log.debug("Order source is a file")
-        elif self.file_system_service.isdir(order.source):
+        elif self.file_system_service.isdir(source):
             log.debug("Order source is a dir")
         else:
             raise NotImplementedError("Could not parse a valid type from: {}, valid types"
-                                      " are directory and file.".format(order.source))
+                                      " are directory and file.".format(source))
+
+        order = StagingOrder(source=source, status=status, rsync_shards=rsync_shards, link_dest=link_dest)
+        self.session.add(order)
+        # The order is flushed to get its id, and committed once it has got its staging target as well,
+        # so that it is only published once
+        self.session.flush()
 
         staging_target = os.path.join(staging_target_dir, str(order.id), project_name)
 
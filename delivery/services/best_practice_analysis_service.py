@@ -11,8 +11,11 @@ class BestPracticeAnalysisService(object):
 
     def get_samples(self, project_name):
         project = self.general_project_repo.get_project(project_name=project_name)
-        for directory in self.file_system_service.list_directories(project.path):
-            if self.file_system_service.isfile("{}.lst".format(directory)) and \
-                    self.file_system_service.isfile("{}.md5".format(directory)):
-                yield self.file_system_service.basename(directory)
+        # A sample is a directory with a .lst and a .md5 file next to it, which are all found in one scan
+        entries = list(self.file_system_service.scan(project.path))
+        file_names = set(entry.name for entry in entries if not entry.is_dir)
+        for entry in entries:
+            if entry.is_dir and "{}.lst".format(entry.name) in file_names and \
+                    "{}.md5".format(entry.name) in file_names:
+                yield entry.name
 
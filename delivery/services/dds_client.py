@@ -0,0 +1,146 @@
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+try:
+    from dds_cli.data_lister import DataLister
+    from dds_cli.project_creator import ProjectCreator
+    from dds_cli.project_status import ProjectStatusManager
+except ImportError:
+    DataLister = ProjectCreator = ProjectStatusManager = None
+
+
+class DDSClient(object):
+    """
+    Talks to DDS through the dds_cli library in-process, rather than by running the `dds` executable, which
+    saves starting a new interpreter for every call. The library is blocking, so it is called in a thread
+    pool of its own.
+
+    The dds_cli clients authenticate with the token when they are created, so one client of each kind is kept
+    per token and reused for up to `client_ttl` seconds. The clients are looked up by a digest of the token
+    rather than by the token file, since a token given as a string is written to a new temporary file for
+    every request. dds_cli does not keep a session of its own, so every request is still sent over a new
+    connection. Releasing a project needs a client bound to
+    that project, which is created for each release.
+
+    Uploads are not done through the client, since they are long running and need a process which can be
+    followed and killed, see `DDSProject.put`.
+    """
+
+    def __init__(self, log_path=None, max_workers=4, client_ttl=3600):
+        """
+        Instantiate a new DDSClient
+        :param log_path: file which the log of dds_cli is written to, like `dds --log-file`
+        :param max_workers: the number of calls to DDS which can be made at the same time
+        :param client_ttl: the number of seconds to reuse an authenticated client for
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dds-client")
+        self.client_ttl = client_ttl
+        # (client class, digest of the token) -> (time.monotonic() at which the client expires, client,
+        # lock held while using it)
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        if log_path:
+            dds_cli_log = logging.getLogger("dds_cli")
+            dds_cli_log.setLevel(logging.INFO)
+            dds_cli_log.addHandler(logging.FileHandler(log_path))
+
+    @staticmethod
+    def is_available():
+        """
+        :return: True if the dds_cli library can be used, otherwise False
+        """
+        return ProjectCreator is not None
+
+    def _call(self, fn, *args):
+        return IOLoop.current().run_in_executor(self.executor, fn, *args)
+
+    def _client(self, client_class, token_path, **kwargs):
+        """
+        Get the authenticated dds_cli client of a class for the token in a file, creating it if there is none
+        yet or if the one there is has expired. Any other expired clients are dropped at the same time.
+        :param client_class: the dds_cli class to get a client of
+        :param token_path: path to the DDS token file
+        :param kwargs: any other arguments to create the client with
+        :return: a tuple with the client, and a lock to hold while using it
+        """
+        with open(token_path, 'rb') as token_file:
+            key = (client_class, hashlib.sha256(token_file.read().strip()).hexdigest())
+        now = time.monotonic()
+        with self._clients_lock:
+            for expired in [k for k, (expires, _, _) in self._clients.items() if expires <= now]:
+                del self._clients[expired]
+            cached = self._clients.get(key)
+            if cached is None:
+                client = client_class(no_prompt=True, token_path=token_path, **kwargs)
+                cached = (now + self.client_ttl, client, threading.Lock())
+                self._clients[key] = cached
+        return cached[1], cached[2]
+
+    @gen.coroutine
+    def create_project(self, token_path, title, description, pi, owners=None, researchers=None,
+                       non_sensitive=False):
+        """
+        Create a new project in DDS
+        :param token_path: path to the DDS token file
+        :param title: the title of the project
+        :param description: the description of the project
+        :param pi: email of the principal investigator
+        :param owners: list of emails of users to add as project owners
+        :param researchers: list of emails of users to add as researchers
+        :param non_sensitive: True if the project does not contain sensitive data
+        :return: the id of the new project in DDS
+        """
+        users_to_add = [{"email": owner, "role": "Project Owner"} for owner in owners or []]
+        users_to_add += [{"email": researcher, "role": "Researcher"} for researcher in researchers or []]
+
+        def _create_project():
+            creator, creator_lock = self._client(ProjectCreator, token_path)
+            with creator_lock:
+                return creator.create_project(
+                    title=title,
+                    description=description,
+                    principal_investigator=pi,
+                    non_sensitive=non_sensitive,
+                    users_to_add=users_to_add)
+
+        created, project_id, _, error = yield self._call(_create_project)
+        if not created:
+            raise RuntimeError("Failed to create project in DDS: {}".format(error))
+        return project_id
+
+    @gen.coroutine
+    def list_projects(self, token_path):
+        """
+        List the projects in DDS which the user has access to
+        :param token_path: path to the DDS token file
+        :return: a list of projects, in the same format as the output of `dds ls --json`
+        """
+        def _list_projects():
+            lister, lister_lock = self._client(DataLister, token_path, json=True)
+            with lister_lock:
+                return lister.list_projects()
+
+        projects = yield self._call(_list_projects)
+        return projects
+
+    @gen.coroutine
+    def release_project(self, token_path, project_id, deadline=None):
+        """
+        Release a project in DDS, without notifying its users by email
+        :param token_path: path to the DDS token file
+        :param project_id: the id of the project in DDS
+        :param deadline: project deadline in days
+        :return: None
+        """
+        def _release_project():
+            with ProjectStatusManager(project=project_id, no_prompt=True, token_path=token_path) as updater:
+                updater.update_status(new_status="Available", deadline=int(deadline) if deadline else None,
+                                      no_mail=True)
+
+        yield self._call(_release_project)
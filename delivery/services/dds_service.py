@@ -1,10 +1,138 @@
 import logging
+import math
+import os
+import re
+import time
 from tornado import gen
 
+from delivery.models.db_models import DeliveryStatus
+
 
 log = logging.getLogger(__name__)
 
 
+class DDSUploadMonitor(object):
+    """
+    Follows the progress of a `dds data put` while it is running. The files uploaded are picked up from the log
+    written by dds for the upload, and the number of bytes uploaded is the size of those files. If the size of
+    a file which dds has logged can not be found, the number of bytes uploaded is instead estimated from the
+    number of bytes read by the dds process (which reads each file once to compress, encrypt and upload it)
+    for the rest of the upload. That estimate also counts any other reads, so it runs ahead of the upload.
+    """
+
+    UPLOADED_PATTERN = re.compile(r'successfully uploaded(?:.*:\s*(\S.*?))?\s*$', re.IGNORECASE)
+
+    def __init__(self, pid, log_path, total_size, source_directories=None):
+        """
+        Instantiate a new DDSUploadMonitor
+        :param pid: the pid of the dds process
+        :param log_path: the log file written by dds for this upload only
+        :param total_size: the number of bytes to upload
+        :param source_directories: the directories being uploaded, which the files logged by dds are
+        looked up in
+        """
+        self.pid = pid
+        self.log_path = log_path
+        self.total_size = total_size
+        self.source_directories = source_directories or []
+
+        self.files_uploaded = 0
+        self.bytes_uploaded = 0
+        self.throughput = 0.0
+        self.eta = None
+
+        self._log_offset = 0
+        self._unfinished_line = b""
+        self._last_sample = None
+        self._uploaded_files = set()
+        self._bytes_of_uploaded_files = 0
+        self._estimate_from_bytes_read = False
+
+    def _file_size(self, uploaded_file):
+        candidates = [uploaded_file] if os.path.isabs(uploaded_file) else \
+            [os.path.join(base, uploaded_file)
+             for source in self.source_directories
+             for base in (os.path.dirname(source), source)]
+        for candidate in candidates:
+            try:
+                return os.path.getsize(candidate)
+            except OSError:
+                continue
+        return None
+
+    def _read_log(self):
+        try:
+            with open(self.log_path, 'rb') as log_file:
+                log_file.seek(self._log_offset)
+                output = log_file.read()
+        except FileNotFoundError:
+            return
+        self._log_offset += len(output)
+        lines = (self._unfinished_line + output).split(b"\n")
+        self._unfinished_line = lines.pop()
+        for line in lines:
+            match = self.UPLOADED_PATTERN.search(line.decode('UTF-8', errors='replace'))
+            if not match:
+                continue
+            uploaded_file = match.group(1)
+            if uploaded_file in self._uploaded_files:
+                continue
+            self.files_uploaded += 1
+            size = self._file_size(uploaded_file) if uploaded_file else None
+            if size is None:
+                log.debug("Could not find the size of uploaded file: {}, estimating the progress from the bytes "
+                          "read by dds instead".format(uploaded_file))
+                self._estimate_from_bytes_read = True
+            else:
+                self._uploaded_files.add(uploaded_file)
+                self._bytes_of_uploaded_files += size
+
+    def _bytes_read(self):
+        try:
+            with open("/proc/{}/io".format(self.pid)) as io_file:
+                for line in io_file:
+                    if line.startswith("rchar:"):
+                        return int(line.split()[1])
+        except OSError:
+            # The process has exited, or its I/O counters are not available on this system
+            return None
+
+    def update(self):
+        """
+        Update the progress of the upload
+        :return: None
+        """
+        self._read_log()
+
+        if self._estimate_from_bytes_read:
+            bytes_uploaded = self._bytes_read()
+            if bytes_uploaded is None:
+                bytes_uploaded = self._bytes_of_uploaded_files
+        else:
+            bytes_uploaded = self._bytes_of_uploaded_files
+        bytes_uploaded = max(min(bytes_uploaded, self.total_size), self.bytes_uploaded)
+
+        now = time.monotonic()
+        if self._last_sample:
+            last_time, last_bytes_uploaded = self._last_sample
+            if now > last_time:
+                self.throughput = (bytes_uploaded - last_bytes_uploaded) / (now - last_time)
+        self._last_sample = (now, bytes_uploaded)
+        self.bytes_uploaded = bytes_uploaded
+        self.eta = int((self.total_size - bytes_uploaded) / self.throughput) if self.throughput > 0 else None
+
+    def store_on(self, delivery_order):
+        """
+        Store the progress of the upload on a DeliveryOrder
+        :param delivery_order: the DeliveryOrder to update
+        :return: None
+        """
+        delivery_order.files_uploaded = self.files_uploaded
+        delivery_order.bytes_uploaded = self.bytes_uploaded
+        delivery_order.throughput = self.throughput
+        delivery_order.eta = self.eta
+
+
 class DDSService(object):
     def __init__(
             self,
@@ -13,7 +141,18 @@ class DDSService(object):
             staging_dir,
             delivery_repo,
             session_factory,
-            dds_conf):
+            dds_conf,
+            dds_client=None):
+        """
+        Instantiate a new DDSService
+        :param external_program_service: a instance of ExternalProgramService, used to run the dds executable
+        :param staging_service: a instance of StagingService
+        :param staging_dir: the directory which data is staged in before delivery
+        :param delivery_repo: a instance of DatabaseBasedDeliveriesRepository
+        :param session_factory: a factory method which can produce new sqlalchemy Session instances
+        :param dds_conf: the `dds_conf` section of the configuration
+        :param dds_client: a DDSClient to talk to DDS in-process with, if not given the dds executable is used
+        """
         self.external_program_service = external_program_service
         self.dds_external_program_service = self.external_program_service
         self.staging_service = staging_service
@@ -21,6 +160,74 @@ class DDSService(object):
         self.delivery_repo = delivery_repo
         self.session_factory = session_factory
         self.dds_conf = dds_conf
+        self.dds_client = dds_client
+
+        # NGI project names by digest of the token used and DDS project id, together with the time at which
+        # they expire. The token is part of the key, so that a name is only given to users who have access
+        # to the project.
+        self._ngi_project_names = {}
+        self.project_name_cache_ttl = dds_conf.get('project_name_cache_ttl', 3600)
+
+        # Minimum number of seconds between storing the progress of an upload
+        self.progress_update_interval = dds_conf.get('progress_update_interval', 5)
+
+        # Number of times to retry a failed upload, waiting upload_retry_backoff seconds before the
+        # first retry and twice as long before each one after that
+        self.upload_retries = dds_conf.get('upload_retries', 0)
+        self.upload_retry_backoff = dds_conf.get('upload_retry_backoff', 60)
+
+    def get_cached_ngi_project_name(self, token_digest, project_id):
+        """
+        Look up the NGI project name of a DDS project, as last listed or created with the same token
+        :param token_digest: a digest of the token used to access DDS
+        :param project_id: the id of the project in DDS
+        :return: the NGI project name (e.g. AB-1234), or None if it is not cached or has expired
+        """
+        try:
+            ngi_project_name, expires = self._ngi_project_names[(token_digest, project_id)]
+        except KeyError:
+            return None
+        if time.monotonic() >= expires:
+            del self._ngi_project_names[(token_digest, project_id)]
+            return None
+        return ngi_project_name
+
+    def cache_ngi_project_name(self, token_digest, project_id, ngi_project_name):
+        """
+        Remember the NGI project name of a DDS project for `project_name_cache_ttl` seconds
+        :param token_digest: a digest of the token used to access DDS
+        :param project_id: the id of the project in DDS
+        :param ngi_project_name: the NGI project name (e.g. AB-1234)
+        :return: None
+        """
+        self._ngi_project_names[(token_digest, project_id)] = \
+            (ngi_project_name, time.monotonic() + self.project_name_cache_ttl)
+
+    def get_upload_threads(self, staging_orders):
+        """
+        Pick the number of threads for `dds data put` to upload staged data with, so that large deliveries
+        get enough threads to fill the uplink while small ones leave room for others. One thread is used per
+        `upload_bytes_per_thread` bytes of staged data, but no more than the number of files staged, within
+        `min_upload_threads` and `max_upload_threads` of the dds configuration.
+        :param staging_orders: the StagingOrders to upload together
+        :return: the number of threads to use, or None to use the default of dds if `max_upload_threads`
+                 is not configured
+        """
+        max_threads = self.dds_conf.get('max_upload_threads')
+        if not max_threads:
+            return None
+        min_threads = self.dds_conf.get('min_upload_threads', 1)
+        bytes_per_thread = self.dds_conf.get('upload_bytes_per_thread', 10 * 1024 ** 3)
+
+        total_size = sum(staging_order.size or 0 for staging_order in staging_orders)
+        threads = math.ceil(total_size / bytes_per_thread)
+
+        # Once staged, the files transferred of a staging order is the number of files staged, which is
+        # not known when the data was linked into place
+        if all(staging_order.files_transferred for staging_order in staging_orders):
+            threads = min(threads, sum(staging_order.files_transferred for staging_order in staging_orders))
+
+        return max(min_threads, min(max_threads, threads))
 
     def get_delivery_order_by_id(self, delivery_order_id):
         return self.delivery_repo.get_delivery_order_by_id(delivery_order_id)
@@ -32,3 +239,24 @@ class DDSService(object):
         """
         # NB: this is done automatically with the new DDS implementation now.
         return self.get_delivery_order_by_id(delivery_order_id)
+
+    def recover_orphaned_delivery_orders(self):
+        """
+        Find delivery orders which are `pending` or `delivery_in_progress`, but whose process is no longer
+        running, e.g. because the service was restarted while they were waiting for a place in the dds pool,
+        being uploaded or waiting to be retried, and mark them as failed. They cannot be resumed since the token used to
+        authenticate is not kept, but the staged data is, so the delivery can be requested again. Orders
+        without a pid cannot be told apart from ones which are just being started, and are left alone.
+        :return: None
+        """
+        for status in [DeliveryStatus.pending, DeliveryStatus.delivery_in_progress]:
+            for delivery_order in self.delivery_repo.get_delivery_orders_by_status(status):
+                if delivery_order.dds_pid is None:
+                    log.warning("Cannot tell if delivery order: {} is orphaned, since it has no pid".format(
+                        delivery_order))
+                    continue
+                if self.external_program_service.is_running(delivery_order.dds_pid):
+                    continue
+                if self.delivery_repo.claim_delivery_order(delivery_order, DeliveryStatus.delivery_failed):
+                    log.warning("Marked orphaned delivery order as failed: {}".format(delivery_order))
+
@@ -2,6 +2,9 @@
 import os
 import logging
 
+from tornado import gen
+from tornado.ioloop import IOLoop
+
 from delivery.services.file_system_service import FileSystemService
 from delivery.exceptions import ProjectAlreadyDeliveredException, RunfolderNotFoundException, ProjectNotFoundException
 from delivery.models.delivery_modes import DeliveryMode
@@ -42,21 +45,24 @@ class DeliveryService(object):
         else:
             self.delivery_sources_repo.add_source(source)
 
-    def _validate_and_stage_source(self, source, force_delivery, path, project_name):
+    def _validate_and_stage_source(self, source, force_delivery, path, project_name, rsync_shards=None):
         self._validate_source_and_add_to_repo(source, force_delivery, path)
         # Start staging
-        stage_order = self.staging_service.create_new_stage_order(path=source.path, project_name=project_name)
+        stage_order = self.staging_service.create_new_stage_order(path=source.path,
+                                                                  project_name=project_name,
+                                                                  rsync_shards=rsync_shards)
         self.staging_service.stage_order(stage_order)
         return stage_order
 
-    def _start_staging_projects(self, projects, force_delivery):
+    def _start_staging_projects(self, projects, force_delivery, rsync_shards=None):
         projects_and_stage_order_ids = {}
         for project in projects:
             source = self.delivery_sources_repo.create_source(project_name=project.name,
                                                               source_name="{}/{}".format(project.runfolder_name,
                                                                                          project.name),
                                                               path=project.path)
-            stage_order = self._validate_and_stage_source(source, force_delivery, project.path, project.name)
+            stage_order = self._validate_and_stage_source(source, force_delivery, project.path, project.name,
+                                                          rsync_shards=rsync_shards)
             projects_and_stage_order_ids[project.name] = stage_order.id
 
         return projects_and_stage_order_ids
@@ -89,10 +95,10 @@ class DeliveryService(object):
 
         return self.file_system_service.abspath(project_dir)
 
-    def deliver_single_runfolder(self, runfolder_name, only_these_projects, force_delivery):
+    def deliver_single_runfolder(self, runfolder_name, only_these_projects, force_delivery, rsync_shards=None):
         runfolder = self.runfolder_service.find_runfolder(runfolder_name)
         projects = list(self.runfolder_service.find_projects_on_runfolder(runfolder, only_these_projects))
-        return self._start_staging_projects(projects, force_delivery)
+        return self._start_staging_projects(projects, force_delivery, rsync_shards=rsync_shards)
 
     def _get_projects_to_deliver(self, projects, mode, batch_nbr):
         # First create sources for all the projects, depending on mode
@@ -129,7 +135,8 @@ class DeliveryService(object):
                     raise NotImplementedError("This is not a valid state, delivery mode needs to be CLEAN/"
                                               "BATCH/FORCE.")
 
-    def deliver_all_runfolders_for_project(self, project_name, mode):
+    @gen.coroutine
+    def deliver_all_runfolders_for_project(self, project_name, mode, rsync_shards=None, incremental=False):
         """
         This method will attempt to deliver all runfolders for the specified
         project.
@@ -154,9 +161,16 @@ class DeliveryService(object):
 
         :param project_name: of project to deliver
         :param mode: A DeliveryMode
+        :param rsync_shards: the number of rsync processes to split the staging between, or None to use
+        the default
+        :param incremental: if True, the staged directory of the previous batch of the project is used as
+        reference when staging, so that files which are unchanged since then are hardlinked rather than copied
         :return: a tupple with a dict with {<project name>: <staging order id>}, and the projects
         """
-        projects = list(self.runfolder_service.find_runfolders_for_project(project_name))
+        # Looking the project up brings the catalogue of runfolders up to date, which is done in a separate
+        # thread so that the IOLoop is not blocked while checking the runfolders
+        projects = yield IOLoop.current().run_in_executor(
+            None, lambda: list(self.runfolder_service.find_runfolders_for_project(project_name)))
 
         if len(projects) < 1:
             raise ProjectNotFoundException("Could not find any Project "
@@ -185,11 +199,20 @@ class DeliveryService(object):
 
         self.delivery_sources_repo.add_source(source)
 
-        stage_order = self.staging_service.create_new_stage_order(path=source.path, project_name=project_name)
+        if incremental:
+            link_dest = self.staging_service.get_incremental_staging_reference(project_name)
+        else:
+            link_dest = None
+
+        stage_order = self.staging_service.create_new_stage_order(path=source.path,
+                                                                  project_name=project_name,
+                                                                  rsync_shards=rsync_shards,
+                                                                  link_dest=link_dest)
         self.staging_service.stage_order(stage_order)
         return {source.project_name: stage_order.id}, projects_to_deliver
 
-    def deliver_arbitrary_directory_project(self, project_name, dir_name=None, force_delivery=False):
+    def deliver_arbitrary_directory_project(self, project_name, dir_name=None, force_delivery=False,
+                                            rsync_shards=None):
 
         if not dir_name:
             dir_name = project_name
@@ -202,7 +225,8 @@ class DeliveryService(object):
                                                           source_name=os.path.basename(project.path),
                                                           path=project.path)
 
-        stage_order = self._validate_and_stage_source(source, force_delivery, project.path, project_name)
+        stage_order = self._validate_and_stage_source(source, force_delivery, project.path, project_name,
+                                                      rsync_shards=rsync_shards)
         return {source.project_name: stage_order.id}
 
     def check_staging_status(self, staging_id):
@@ -1,18 +1,168 @@
 
+import codecs
+import collections
+import itertools
+import os
 
 from tornado.process import Subprocess
+from tornado.iostream import StreamClosedError
 from tornado import gen
+from tornado.concurrent import Future
 
 from subprocess import PIPE
 
-from delivery.models.execution import ExecutionResult, Execution
+from delivery.models.execution import ExecutionResult, Execution, ResourceUsage
+
+
+class OutputTail(object):
+    """
+    Keeps the last part of the output of a process, so that the memory needed does not grow with the
+    amount of output.
+    """
+
+    def __init__(self, max_size):
+        """
+        Instantiate a new OutputTail
+        :param max_size: the number of bytes to keep, or None to keep everything
+        """
+        self.max_size = max_size
+        self._chunks = collections.deque()
+        self._size = 0
+
+    def append(self, chunk):
+        """
+        Add a chunk of output, dropping the oldest output which no longer fits
+        :param chunk: the output as bytes
+        :return: None
+        """
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        while self.max_size is not None and self._size - len(self._chunks[0]) >= self.max_size:
+            self._size -= len(self._chunks.popleft())
+
+    def getvalue(self):
+        """
+        :return: the kept output, decoded as UTF-8
+        """
+        output = b"".join(self._chunks)
+        if self.max_size is not None:
+            output = output[-self.max_size:]
+        return output.decode('UTF-8', errors='replace')
+
+
+class ExecutionPool(object):
+    """
+    Limits the number of programs running at the same time. When a place becomes available it is handed
+    to one of the waiting programs according to the policy of the pool:
+
+        fifo: the program which has waited the longest
+        smallest_first: the program with the smallest size, e.g. the amount of data it will handle
+        fair_share: a program of the group (e.g. project) with the fewest programs running
+
+    Ties are broken by the time waited.
+    """
+
+    POLICIES = ('fifo', 'smallest_first', 'fair_share')
+
+    def __init__(self, max_concurrency, policy='fifo'):
+        """
+        Instantiate a new ExecutionPool
+        :param max_concurrency: the maximum number of programs running at the same time
+        :param policy: one of POLICIES
+        """
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown execution pool policy: {}, should be one of: {}".format(
+                policy, ", ".join(self.POLICIES)))
+        self.max_concurrency = max_concurrency
+        self.policy = policy
+        self.running = collections.Counter()
+        self._waiting = []
+        self._arrivals = itertools.count()
+
+    def _priority(self, waiter):
+        arrival, size, group, _ = waiter
+        if self.policy == 'smallest_first':
+            return size or 0, arrival
+        if self.policy == 'fair_share':
+            return self.running[group], arrival
+        return arrival
+
+    def _dispatch(self):
+        while self._waiting and sum(self.running.values()) < self.max_concurrency:
+            waiter = min(self._waiting, key=self._priority)
+            self._waiting.remove(waiter)
+            _, _, group, future = waiter
+            if future.done():
+                # The waiting program has given up
+                continue
+            self.running[group] += 1
+            future.set_result(PoolPlace(self, group))
+
+    def acquire(self, size=None, group=None):
+        """
+        Wait for a place in the pool
+        :param size: the size of the program, used by the `smallest_first` policy
+        :param group: the group of the program, used by the `fair_share` policy
+        :return: a Future resolving to a PoolPlace, which must be released once the program has finished
+        """
+        future = Future()
+        self._waiting.append((next(self._arrivals), size, group, future))
+        self._dispatch()
+        return future
+
+    def _release(self, group):
+        self.running[group] -= 1
+        if not self.running[group]:
+            del self.running[group]
+        self._dispatch()
+
+
+class PoolPlace(object):
+    """
+    A place held in an ExecutionPool
+    """
+
+    def __init__(self, pool, group):
+        self._pool = pool
+        self._group = group
+
+    def release(self):
+        """
+        Give the place back to the pool, letting the next program waiting run
+        :return: None
+        """
+        if self._pool:
+            self._pool._release(self._group)
+            self._pool = None
 
 
 class ExternalProgramService(object):
     """
-    A service for running external programs
+    A service for running external programs. The output of the programs is read as it is written, so that
+    programs writing a lot of output cannot block on a full pipe, and so that the output can be followed
+    while the program is running.
+
+    Programs can be run in named pools (e.g. `rsync` or `dds`), which limit the number of programs of a
+    kind running at the same time, see ExecutionPool.
     """
 
+    # The number of bytes of stdout and stderr respectively to keep in an ExecutionResult by default
+    OUTPUT_TAIL_SIZE = 1024 * 1024
+
+    def __init__(self, pools=None):
+        """
+        Instantiate a new ExternalProgramService
+        :param pools: a dict with the configuration of each named pool, which is either the maximum number
+                      of programs to run at the same time, or a dict with `max_concurrency` and `policy`
+                      (see ExecutionPool). Pools which are not listed do not limit the number of programs.
+        """
+        self.pools = {}
+        for name, pool_conf in (pools or {}).items():
+            if isinstance(pool_conf, dict):
+                self.pools[name] = ExecutionPool(pool_conf['max_concurrency'], pool_conf.get('policy', 'fifo'))
+            else:
+                self.pools[name] = ExecutionPool(pool_conf)
+
     @staticmethod
     def run(cmd):
         """
@@ -21,24 +171,153 @@ class ExternalProgramService(object):
         :return: A instance of Execution
         """
         p = Subprocess(cmd,
-                       stdout=PIPE,
-                       stderr=PIPE,
+                       stdout=Subprocess.STREAM,
+                       stderr=Subprocess.STREAM,
                        stdin=PIPE)
         return Execution(pid=p.pid, process_obj=p)
 
+    @gen.coroutine
+    def run_in_pool(self, cmd, pool, size=None, group=None):
+        """
+        Run a process once there is room for it in a pool, and do not wait for it to finish. The place in
+        the pool is given back once `wait_for_execution` returns for the execution.
+        :param cmd: the command to run as a list, i.e. ['ls','-l', '/']
+        :param pool: the name of the pool to run the process in
+        :param size: the size of the work done by the process, used if the pool runs the smallest first
+        :param group: the group the process belongs to, used if the pool shares its places fairly by group
+        :return: A instance of Execution
+        """
+        execution_pool = self.pools.get(pool)
+        if execution_pool is None:
+            return self.run(cmd)
+
+        place = yield execution_pool.acquire(size=size, group=group)
+        try:
+            execution = self.run(cmd)
+        except Exception:
+            place.release()
+            raise
+        execution.pool = place
+        return execution
+
+    @staticmethod
+    def line_callback(callback):
+        """
+        Adapt a callback taking single lines of output, to be used as a callback for `wait_for_execution`.
+        Both newlines and carriage returns (used by e.g. progress meters) are treated as line breaks.
+        :param callback: called with each line of output, without the line break
+        :return: a callback taking chunks of output
+        """
+        unfinished_line = ""
+
+        def _callback(output):
+            nonlocal unfinished_line
+            lines = (unfinished_line + output).replace("\r", "\n").split("\n")
+            unfinished_line = lines.pop()
+            for line in lines:
+                callback(line)
+
+        return _callback
+
     @staticmethod
     @gen.coroutine
-    def wait_for_execution(execution):
+    def _read_stream(stream, callback, max_size):
         """
-        Wait for an execution to finish
+        Read from a stream until it is closed, passing each chunk on to a callback. The chunks are decoded
+        incrementally, so that a character split between two chunks is passed on whole.
+        :param stream: the IOStream to read
+        :param callback: called with each chunk of output as a string, or None
+        :param max_size: the number of bytes at the end of the output to return, or None for all output
+        :return: the output read from the stream, as a string
+        """
+        tail = OutputTail(max_size)
+        decoder = codecs.getincrementaldecoder('UTF-8')(errors='replace')
+        while True:
+            try:
+                chunk = yield stream.read_bytes(65536, partial=True)
+            except StreamClosedError:
+                break
+            tail.append(chunk)
+            if callback:
+                output = decoder.decode(chunk)
+                if output:
+                    callback(output)
+        if callback:
+            output = decoder.decode(b"", final=True)
+            if output:
+                callback(output)
+        return tail.getvalue()
+
+    @staticmethod
+    def _exit_code(status):
+        """
+        Decode a status returned by wait, like `os.waitstatus_to_exitcode` which is not available before
+        python 3.9
+        :param status: the status of an exited process
+        :return: the exit code of the process, or minus the number of the signal which killed it
+        """
+        if os.WIFEXITED(status):
+            return os.WEXITSTATUS(status)
+        if os.WIFSIGNALED(status):
+            return -os.WTERMSIG(status)
+        raise ValueError("Unexpected status of exited process: {}".format(status))
+
+    @staticmethod
+    @gen.coroutine
+    def _wait_for_exit(process_obj):
+        """
+        Reap a process with wait4, rather than leaving it to tornado, in order to get hold of the resources
+        used by it. This is done once its stdout and stderr have been closed, which in most cases means that
+        the process has already exited, so it is polled with an increasing interval.
+        :param process_obj: the tornado Subprocess to wait for
+        :return: a tuple with the exit code of the process and its ResourceUsage, which is None if the
+                 process has already been reaped elsewhere
+        """
+        poll_interval = 0.01
+        while True:
+            try:
+                pid, status, rusage = os.wait4(process_obj.pid, os.WNOHANG)
+            except ChildProcessError:
+                status_code = yield process_obj.wait_for_exit(raise_error=False)
+                return status_code, None
+            if pid:
+                break
+            yield gen.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, 1)
+
+        status_code = ExternalProgramService._exit_code(status)
+        # Let the process objects know that the process has been reaped
+        process_obj.returncode = status_code
+        process_obj.proc.returncode = status_code
+        return status_code, ResourceUsage.from_rusage(rusage)
+
+    @staticmethod
+    @gen.coroutine
+    def wait_for_execution(execution, stdout_callback=None, stderr_callback=None,
+                           output_tail_size=OUTPUT_TAIL_SIZE):
+        """
+        Wait for an execution to finish, reading its stdout and stderr while it runs
         :param execution: instance of Execution
+        :param stdout_callback: called with each chunk of stdout as it is written, see `line_callback` to get
+                                single lines instead
+        :param stderr_callback: called with each chunk of stderr as it is written
+        :param output_tail_size: the number of bytes at the end of stdout and stderr respectively to keep in
+                                 the result, or None to keep all of the output
         :return: an ExecutionResult for the execution
         """
-        status_code = yield execution.process_obj.wait_for_exit(raise_error=False)
-        out = execution.process_obj.stdout.read().decode('UTF-8')
-        err = execution.process_obj.stderr.read().decode('UTF-8')
+        try:
+            out, err = yield [
+                ExternalProgramService._read_stream(execution.process_obj.stdout, stdout_callback,
+                                                    output_tail_size),
+                ExternalProgramService._read_stream(execution.process_obj.stderr, stderr_callback,
+                                                    output_tail_size)]
+            status_code, resource_usage = yield ExternalProgramService._wait_for_exit(execution.process_obj)
+        finally:
+            if execution.pool:
+                execution.pool.release()
+                execution.pool = None
 
-        return ExecutionResult(out, err, status_code)
+        return ExecutionResult(out, err, status_code, resource_usage=resource_usage)
 
     @staticmethod
     def run_and_wait(cmd):
@@ -50,3 +329,18 @@ class ExternalProgramService(object):
         execution = ExternalProgramService.run(cmd)
         return ExternalProgramService.wait_for_execution(execution)
 
+    @staticmethod
+    def is_running(pid):
+        """
+        Check if a process is still running
+        :param pid: the pid of the process
+        :return: True if there is a process with the pid, otherwise False
+        """
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # The process exists, but belongs to someone else
+            return True
+        return True
@@ -1,16 +1,102 @@
 
 import os
 import logging
+import shutil
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 log = logging.getLogger(__name__)
 
 
+"""
+An entry found when scanning a directory (see `FileSystemService.scan`). `is_dir` is True for directories and
+links to directories. `size` and `mtime` (in nanoseconds) are only set if the entries were scanned with `stat`.
+"""
+ScanEntry = namedtuple("ScanEntry", ["path", "name", "is_dir", "size", "mtime"])
+
+
 class FileSystemService(object):
     """
     File system service, used for accessing the file system in a way that can
     easily be mocked out in testing.
     """
 
+    @staticmethod
+    def scan(base_path, recursive=False, stat=False, max_workers=8, follow_symlinks=False):
+        """
+        Scan the entries of a directory. Whether an entry is a directory is taken from the directory listing
+        where the file system provides it, rather than by calling stat on every entry. When scanning
+        recursively, directories are scanned in parallel, which pays off on network file systems where each
+        directory listing has a high latency. Like `os.walk`, links to directories are not followed unless
+        asked to, and subdirectories which cannot be listed are skipped.
+        :param base_path: the directory to scan
+        :param recursive: if True, scan all directories below base_path as well
+        :param stat: if True, call stat on every entry to get its size and modification time (of the target,
+                     for links)
+        :param max_workers: the maximum number of directories to scan at the same time
+        :param follow_symlinks: if True, scan the directories which links point to as well when scanning
+                                recursively, the way `rsync --copy-links` copies them. Links pointing back up
+                                the tree are not followed, since they would be followed forever.
+        :return: a generator of ScanEntry, in no particular order when scanning recursively
+        :raises: an OSError if base_path cannot be listed
+        """
+        def _scan(directory, ancestors):
+            entries = []
+            subdirs = []
+            with os.scandir(directory) as dir_entries:
+                for dir_entry in dir_entries:
+                    try:
+                        is_dir = dir_entry.is_dir()
+                        if stat:
+                            entry_stat = dir_entry.stat()
+                            size, mtime = entry_stat.st_size, entry_stat.st_mtime_ns
+                        else:
+                            size, mtime = None, None
+                    except FileNotFoundError:
+                        # e.g. removed after being listed, or a broken link
+                        is_dir, size, mtime = False, None, None
+                    entries.append(ScanEntry(dir_entry.path, dir_entry.name, is_dir, size, mtime))
+                    if not (recursive and is_dir):
+                        continue
+                    if not follow_symlinks:
+                        if not dir_entry.is_symlink():
+                            subdirs.append((dir_entry.path, ancestors))
+                        continue
+                    real_path = os.path.realpath(dir_entry.path)
+                    if real_path not in ancestors:
+                        subdirs.append((dir_entry.path, ancestors | {real_path}))
+            return entries, subdirs
+
+        def _scan_subdir(directory, ancestors):
+            try:
+                return _scan(directory, ancestors)
+            except OSError as e:
+                log.warning("Could not scan {}: {}".format(directory, e))
+                return [], []
+
+        # The real paths of the directories above the one scanned, which are only needed to follow links
+        root_ancestors = frozenset([os.path.realpath(base_path)]) if follow_symlinks else frozenset()
+        entries, subdirs = _scan(base_path, root_ancestors)
+        yield from entries
+        if not subdirs:
+            return
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        pending = set(executor.submit(_scan_subdir, subdir, ancestors) for subdir, ancestors in subdirs)
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    entries, subdirs = future.result()
+                    pending.update(executor.submit(_scan_subdir, subdir, ancestors)
+                                   for subdir, ancestors in subdirs)
+                    yield from entries
+        finally:
+            # Do not scan any further if the caller stops early
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
     @staticmethod
     def list_directories(base_path):
         """
@@ -18,11 +104,9 @@ class FileSystemService(object):
         :param base_path: base path to list directories in.
         :return: a generator of paths to directories
         """
-        for my_dir in os.listdir(base_path):
-            dir_abs_path = os.path.abspath(os.path.join(base_path, my_dir))
-
-            if os.path.isdir(dir_abs_path):
-                yield dir_abs_path
+        for entry in FileSystemService.scan(base_path):
+            if entry.is_dir:
+                yield os.path.abspath(entry.path)
 
     def find_project_directories(self, projects_base_dir):
         """
@@ -42,8 +126,79 @@ class FileSystemService(object):
 
     @staticmethod
     def list_files_recursively(base_path):
-        for root, dirs, files in os.walk(base_path):
-            yield from map(lambda f: os.path.join(root, f), files)
+        """
+        List all files below a directory
+        :param base_path: the directory to list files in
+        :return: a generator of paths to files, in sorted order. Like `os.walk`, nothing is listed if
+        base_path cannot be listed.
+        """
+        try:
+            # The directories are scanned in parallel, so the files are sorted to list them in the same
+            # order every time
+            files = sorted(entry.path for entry in FileSystemService.scan(base_path, recursive=True)
+                           if not entry.is_dir)
+        except OSError as e:
+            log.debug("Could not list files in {}: {}".format(base_path, e))
+            return
+        yield from files
+
+    @staticmethod
+    def entry_sizes(base_path, max_workers=8):
+        """
+        Get the sizes of all files and directories below a path, following symlinks like `tree_size`. The
+        size of a directory is the total size of the files beneath it.
+        :param base_path: the directory to look in
+        :param max_workers: the maximum number of directories to scan at the same time
+        :return: a dict with paths relative to base_path as keys and sizes in bytes as values, in sorted order
+        """
+        sizes = {}
+        for entry in FileSystemService.scan(base_path, recursive=True, stat=True, max_workers=max_workers,
+                                            follow_symlinks=True):
+            relative_path = os.path.relpath(entry.path, base_path)
+            if entry.is_dir:
+                sizes.setdefault(relative_path, 0)
+                continue
+            if entry.size is None:
+                log.warning("Could not find the target of {}, it will not be counted".format(entry.path))
+                continue
+            sizes[relative_path] = entry.size
+            parent = os.path.dirname(relative_path)
+            while parent:
+                sizes[parent] = sizes.get(parent, 0) + entry.size
+                parent = os.path.dirname(parent)
+        return dict(sorted(sizes.items()))
+
+    @staticmethod
+    def tree_size(base_path, max_workers=8):
+        """
+        Get the total size of the files below a path, following symlinks the way `rsync --copy-links`
+        does, see `scan`.
+        :param base_path: the file or directory to get the size of
+        :param max_workers: the maximum number of directories to scan at the same time
+        :return: the total size in bytes
+        """
+        if not os.path.isdir(base_path):
+            return os.stat(base_path).st_size
+
+        total_size = 0
+        for entry in FileSystemService.scan(base_path, recursive=True, stat=True, max_workers=max_workers,
+                                            follow_symlinks=True):
+            if entry.is_dir:
+                continue
+            if entry.size is None:
+                log.warning("Could not find the target of {}, it will not be counted".format(entry.path))
+                continue
+            total_size += entry.size
+        return total_size
+
+    @staticmethod
+    def disk_usage(path):
+        """
+        Shadows shutil.disk_usage
+        :param path: a path on the filesystem to check
+        :return: a named tuple with the total, used and free space of the filesystem in bytes
+        """
+        return shutil.disk_usage(path)
 
     @staticmethod
     def isdir(path):
@@ -109,6 +264,27 @@ class FileSystemService(object):
         """
         os.makedirs(path, **kwargs)
 
+    @staticmethod
+    def stat(path):
+        """
+        Shadows os.stat
+        :param path: to stat
+        :return: a os.stat_result for the path
+        """
+        return os.stat(path)
+
+    @staticmethod
+    def mtime(path):
+        """
+        Get the time a path was last modified
+        :param path: to get the modification time of
+        :return: the modification time in nanoseconds, or None if the path does not exist
+        """
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
     @staticmethod
     def exists(path):
         return os.path.exists(path)
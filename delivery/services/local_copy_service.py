@@ -0,0 +1,419 @@
+
+import errno
+import fcntl
+import logging
+import os
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from delivery.exceptions import ChecksumMismatchException
+from delivery.services.file_system_service import FileSystemService
+from delivery.services.metadata_service import MetadataService
+
+log = logging.getLogger(__name__)
+
+# ioctl request number for cloning a file, from linux/fs.h
+FICLONE = 0x40049409
+
+# The number of bytes to copy with each system call
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+# The number of bytes to read at a time when files are hashed while being copied
+HASH_CHUNK_SIZE = 1024 * 1024
+
+CHECKSUM_FILE_NAME = "checksums.md5"
+
+
+class CopyProgress(object):
+    """
+    Keeps track of the progress of a copy which is carried out by several threads
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.start_time = time.monotonic()
+        self.total_bytes = None
+        self.bytes_transferred = 0
+        self.files_transferred = 0
+
+    def add(self, nbr_of_bytes=0, nbr_of_files=0):
+        """
+        Register that more data has been copied
+        :param nbr_of_bytes: the number of bytes copied
+        :param nbr_of_files: the number of files completed
+        :return: None
+        """
+        with self._lock:
+            self.bytes_transferred += nbr_of_bytes
+            self.files_transferred += nbr_of_files
+
+    @property
+    def throughput(self):
+        """
+        :return: the average number of bytes copied per second so far
+        """
+        elapsed = time.monotonic() - self.start_time
+        return self.bytes_transferred / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """
+        :return: the estimated number of seconds until the copy is done, or None if it cannot be estimated
+        """
+        throughput = self.throughput
+        if self.total_bytes is None or not throughput:
+            return None
+        return int(max(self.total_bytes - self.bytes_transferred, 0) / throughput)
+
+
+class LocalCopyService(object):
+    """
+    Materialises a directory tree in another location on the local machine. Files can either be linked
+    into place without copying any data, provided that the target is on the same filesystem, or be copied
+    by the kernel (without passing the data through user space) using a pool of threads.
+
+    When linking, files are reflinked where the filesystem supports it (i.e. a copy-on-write clone which
+    shares the data blocks with the original file), otherwise they are hardlinked. Symlinks in the source
+    tree, like the ones created when organising a runfolder or when setting up the links area of a batch
+    delivery, are resolved so that the result only holds regular files and directories.
+
+    When copying, files listed in a `checksums.md5` file in the source tree can be verified as they are
+    copied, see `copy_tree`.
+
+    Both ways of staging a tree can be given a previously staged tree as reference, like `rsync --link-dest`.
+    Files which are unchanged in the reference, i.e. which have the same size and modification time there,
+    are then hardlinked from the reference rather than linked or copied from the source.
+    """
+
+    def __init__(self, file_system_service=FileSystemService(), use_reflinks=True,
+                 metadata_service=MetadataService()):
+        """
+        Instantiate a new LocalCopyService
+        :param file_system_service: an instance of FileSystemService
+        :param use_reflinks: if True, try to reflink files before falling back to hardlinks
+        :param metadata_service: an instance of MetadataService
+        """
+        self.file_system_service = file_system_service
+        self.use_reflinks = use_reflinks
+        self.metadata_service = metadata_service
+
+    def _files_on_device(self, source, device):
+        """
+        List the files below a directory, following symlinks, provided that they are all stored on
+        the given device.
+        :param source: the directory to list
+        :param device: the device id which all files need to be stored on
+        :return: a tuple of lists with the directories and the files, as (relative path, real path) pairs,
+                 or None if any file is stored on another device
+        """
+        directories = []
+        files = []
+        for root, dirs, filenames in os.walk(source, followlinks=True):
+            relative_root = os.path.relpath(root, source)
+            directories.append((relative_root, root))
+            for filename in filenames:
+                real_path = os.path.realpath(os.path.join(root, filename))
+                if self.file_system_service.stat(real_path).st_dev != device:
+                    log.debug("{} is not on the same device as the staging target".format(real_path))
+                    return None
+                files.append((os.path.normpath(os.path.join(relative_root, filename)), real_path))
+        return directories, files
+
+    def _reflink(self, src, dst):
+        """
+        Clone a file using the FICLONE ioctl
+        :param src: the file to clone
+        :param dst: the path of the clone
+        :return: None
+        """
+        with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        src_stat = os.stat(src)
+        os.utime(dst, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+
+    def _link_file(self, src, dst):
+        """
+        Reflink or hardlink a file, replacing any existing file at the destination
+        :param src: the file to link
+        :param dst: the path of the link
+        :return: None
+        """
+        if os.path.lexists(dst):
+            os.unlink(dst)
+
+        if self.use_reflinks:
+            try:
+                self._reflink(src, dst)
+                return
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV):
+                    raise
+                log.info("Reflinks are not supported for {}, falling back to hardlinks".format(dst))
+                self.use_reflinks = False
+                os.unlink(dst)
+
+        os.link(src, dst)
+
+    def _link_unchanged_file(self, src, dst, reference):
+        """
+        Hardlink a file from a previously staged tree, provided that it is unchanged there, replacing any
+        existing file at the destination
+        :param src: the file in the source tree
+        :param dst: the path of the link
+        :param reference: the path of the same file in the previously staged tree
+        :return: True if the file was linked from the reference, otherwise False
+        """
+        try:
+            src_stat = self.file_system_service.stat(src)
+            reference_stat = self.file_system_service.stat(reference)
+        except FileNotFoundError:
+            return False
+        if not stat.S_ISREG(reference_stat.st_mode) or \
+                reference_stat.st_size != src_stat.st_size or \
+                reference_stat.st_mtime_ns != src_stat.st_mtime_ns:
+            return False
+
+        if os.path.lexists(dst):
+            os.unlink(dst)
+        try:
+            os.link(reference, dst)
+        except OSError as e:
+            log.debug("Could not link {} from {}, staging it from the source instead: {}".format(
+                dst, reference, e))
+            return False
+        return True
+
+    def link_tree(self, source, target, link_dest=None):
+        """
+        Recreate the tree below source in target, without copying the data of the files. If any of the
+        files are stored on another device than target nothing is done, since then the data has to be
+        copied anyway.
+        :param source: the directory to link from
+        :param target: an existing directory to link to
+        :param link_dest: a previously staged tree, which files that are unchanged since then are
+                          hardlinked from, or None
+        :return: the total size of the linked files in bytes, or None if the tree could not be linked
+        """
+        listing = self._files_on_device(source, self.file_system_service.stat(target).st_dev)
+        if listing is None:
+            return None
+        directories, files = listing
+
+        for relative_dir, _ in directories:
+            self.file_system_service.makedirs(os.path.join(target, relative_dir), exist_ok=True)
+
+        total_size = 0
+        for relative_path, real_path in files:
+            dst = os.path.join(target, relative_path)
+            if not (link_dest and
+                    self._link_unchanged_file(real_path, dst, os.path.join(link_dest, relative_path))):
+                self._link_file(real_path, dst)
+            total_size += self.file_system_service.stat(real_path).st_size
+
+        # Set the directory modification times last, since linking files into them updates them
+        for relative_dir, source_dir in reversed(directories):
+            dir_stat = self.file_system_service.stat(source_dir)
+            os.utime(os.path.join(target, relative_dir), ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+
+        return total_size
+
+    @staticmethod
+    def _copy_data(src_fd, dst_fd, progress):
+        """
+        Copy the contents of one open file to another, using copy_file_range where possible and falling
+        back to sendfile otherwise (e.g. across filesystems on older kernels)
+        :param src_fd: file descriptor to read from
+        :param dst_fd: file descriptor to write to
+        :param progress: a CopyProgress which is updated as data is copied
+        :return: the number of bytes copied
+        """
+        copy_chunk = getattr(os, "copy_file_range", None)
+        copied = 0
+        while True:
+            try:
+                if copy_chunk:
+                    nbr_of_bytes = copy_chunk(src_fd, dst_fd, COPY_CHUNK_SIZE)
+                else:
+                    nbr_of_bytes = os.sendfile(dst_fd, src_fd, None, COPY_CHUNK_SIZE)
+            except OSError as e:
+                if copy_chunk and copied == 0 and \
+                        e.errno in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL):
+                    copy_chunk = None
+                    continue
+                raise
+            if nbr_of_bytes == 0:
+                return copied
+            copied += nbr_of_bytes
+            progress.add(nbr_of_bytes=nbr_of_bytes)
+
+    def _copy_and_hash_data(self, src_file, dst_file, progress):
+        """
+        Copy the contents of one open file to another through a buffer, computing the checksum of the
+        data on the way, so that the file is only read once
+        :param src_file: the file object to read from
+        :param dst_file: the file object to write to
+        :param progress: a CopyProgress which is updated as data is copied
+        :return: a tuple with the number of bytes copied and the checksum of the data
+        """
+        hasher = self.metadata_service.get_hash_object()
+        buffer = bytearray(HASH_CHUNK_SIZE)
+        view = memoryview(buffer)
+        copied = 0
+        while True:
+            nbr_of_bytes = src_file.readinto(buffer)
+            if not nbr_of_bytes:
+                return copied, hasher.hexdigest()
+            hasher.update(view[:nbr_of_bytes])
+            dst_file.write(view[:nbr_of_bytes])
+            copied += nbr_of_bytes
+            progress.add(nbr_of_bytes=nbr_of_bytes)
+
+    def _copy_file(self, src, dst, progress, hash_data=False):
+        """
+        Copy a file, and its access and modification times
+        :param src: the file to copy
+        :param dst: the path of the copy
+        :param progress: a CopyProgress which is updated as data is copied
+        :param hash_data: if True, compute the checksum of the file while copying it
+        :return: a tuple with the number of bytes copied and the checksum, or None if it was not computed
+        """
+        checksum = None
+        with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+            if hash_data:
+                copied, checksum = self._copy_and_hash_data(src_file, dst_file, progress)
+            else:
+                copied = self._copy_data(src_file.fileno(), dst_file.fileno(), progress)
+            src_stat = os.fstat(src_file.fileno())
+        os.utime(dst, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+        progress.add(nbr_of_files=1)
+        return copied, checksum
+
+    def _stage_file(self, src, dst, progress, hash_data=False, reference=None):
+        """
+        Hardlink a file from a previously staged tree if it is unchanged there, otherwise copy it
+        :param src: the file to stage
+        :param dst: the path to stage it to
+        :param progress: a CopyProgress which is updated as the file is staged
+        :param hash_data: if True, compute the checksum of the file
+        :param reference: the path of the same file in a previously staged tree, or None
+        :return: a tuple with the size of the file and the checksum, or None if it was not computed
+        """
+        if reference and self._link_unchanged_file(src, dst, reference):
+            size = self.file_system_service.stat(dst).st_size
+            progress.add(nbr_of_bytes=size, nbr_of_files=1)
+            checksum = self.metadata_service.hash_file(dst) if hash_data else None
+            return size, checksum
+        return self._copy_file(src, dst, progress, hash_data)
+
+    def _expected_checksums(self, checksum_files):
+        """
+        Collect the checksums listed in the checksum files of a tree. The paths in a checksum file are
+        relative to the parent of the directory holding it, which is the case both for the `MD5/checksums.md5`
+        of a runfolder and the `<runfolder>/checksums.md5` of an organised project.
+        :param checksum_files: a list of (path relative to the tree, absolute path) pairs of checksum files
+        :return: a dict with paths relative to the tree as keys and checksums as values
+        """
+        expected_checksums = {}
+        for relative_path, checksum_file in checksum_files:
+            base_dir = os.path.dirname(os.path.dirname(relative_path))
+            for file_path, checksum in self.metadata_service.parse_checksum_file(checksum_file).items():
+                expected_checksums[os.path.normpath(os.path.join(base_dir, file_path))] = checksum
+        return expected_checksums
+
+    @staticmethod
+    def _write_checksum_report(checksum_report, results):
+        """
+        Write the outcome of verifying the files of a tree, in the style of `md5sum --check`
+        :param checksum_report: the path of the report to write
+        :param results: a list of (relative path, expected checksum, actual checksum) tuples
+        :return: None
+        """
+        with open(checksum_report, "w") as fh:
+            for relative_path, expected_checksum, actual_checksum in sorted(results):
+                if expected_checksum is None:
+                    outcome = "NOT VERIFIED"
+                elif expected_checksum == actual_checksum:
+                    outcome = "OK"
+                else:
+                    outcome = "FAILED"
+                fh.write("{}: {}\n".format(relative_path, outcome))
+
+    def copy_tree(self, source, target, progress=None, max_workers=8, checksum_report=None, link_dest=None):
+        """
+        Copy the tree below source into target, following any symlinks in the source. Files are copied
+        in parallel, and modification times are preserved like `rsync --times` does.
+
+        If a checksum report is requested, files listed in any `checksums.md5` file in the tree are hashed
+        while they are copied and compared to the listed checksums. The outcome for each file is written to
+        the report, and if any file does not match a ChecksumMismatchException is raised once all files
+        have been copied.
+        :param source: the directory to copy from
+        :param target: an existing directory to copy to
+        :param progress: a CopyProgress which is updated as the copy proceeds
+        :param max_workers: the maximum number of files to copy at the same time
+        :param checksum_report: path to a file to write the outcome of the verification of each file to,
+                                or None to not verify the files. It must be outside of the target, so that
+                                it is not delivered along with the copied files.
+        :param link_dest: a previously staged tree, which files that are unchanged since then are
+                          hardlinked from rather than copied, or None
+        :return: the total number of bytes staged, whether copied or linked
+        :raises ValueError: if the checksum report would be written into the target
+        """
+        if checksum_report:
+            target_dir = os.path.realpath(target)
+            report_dir = os.path.realpath(os.path.dirname(os.path.abspath(checksum_report)))
+            if os.path.commonpath([target_dir, report_dir]) == target_dir:
+                raise ValueError("The checksum report {} must not be written into the target {}".format(
+                    checksum_report, target))
+
+        progress = progress or CopyProgress()
+
+        directories = []
+        files = []
+        for root, dirs, filenames in os.walk(source, followlinks=True):
+            relative_root = os.path.relpath(root, source)
+            directories.append((relative_root, root))
+            self.file_system_service.makedirs(os.path.join(target, relative_root), exist_ok=True)
+            for filename in filenames:
+                files.append((os.path.normpath(os.path.join(relative_root, filename)),
+                              os.path.join(root, filename)))
+        progress.total_bytes = sum(self.file_system_service.stat(src).st_size for _, src in files)
+
+        if checksum_report:
+            expected_checksums = self._expected_checksums(
+                [(relative_path, src) for relative_path, src in files
+                 if os.path.basename(relative_path) == CHECKSUM_FILE_NAME])
+        else:
+            expected_checksums = {}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            copies = [executor.submit(self._stage_file, src, os.path.join(target, relative_path), progress,
+                                      relative_path in expected_checksums,
+                                      os.path.join(link_dest, relative_path) if link_dest else None)
+                      for relative_path, src in files]
+            try:
+                copy_results = [copy.result() for copy in copies]
+            except Exception:
+                for copy in copies:
+                    copy.cancel()
+                raise
+        total_size = sum(copied for copied, _ in copy_results)
+
+        for relative_dir, source_dir in reversed(directories):
+            dir_stat = self.file_system_service.stat(source_dir)
+            os.utime(os.path.join(target, relative_dir), ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+
+        if checksum_report:
+            results = [(relative_path, expected_checksums.get(relative_path), checksum)
+                       for (relative_path, _), (_, checksum) in zip(files, copy_results)]
+            self._write_checksum_report(checksum_report, results)
+            mismatches = [relative_path for relative_path, expected_checksum, checksum in results
+                          if expected_checksum is not None and expected_checksum != checksum]
+            if mismatches:
+                raise ChecksumMismatchException(
+                    "{} files did not match their checksums, e.g. {}, see {} for details".format(
+                        len(mismatches), mismatches[0], checksum_report))
+
+        return total_size
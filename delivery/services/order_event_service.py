@@ -0,0 +1,163 @@
+import logging
+
+from sqlalchemy import event
+from tornado.queues import Queue, QueueFull
+
+from delivery.models.db_models import StagingOrder, DeliveryOrder
+
+log = logging.getLogger(__name__)
+
+
+def staging_order_event(staging_order):
+    """
+    Describe the current state of a staging order as an event
+    :param staging_order: the StagingOrder to describe
+    :return: a dict which can be serialized to json
+    """
+    return {'type': 'staging_order',
+            'id': staging_order.id,
+            'project': staging_order.get_project_name(),
+            'status': staging_order.status.name if staging_order.status else None,
+            'size': staging_order.size,
+            'bytes_transferred': staging_order.bytes_transferred,
+            'files_transferred': staging_order.files_transferred,
+            'throughput': staging_order.throughput,
+            'eta': staging_order.eta}
+
+
+def delivery_order_event(delivery_order):
+    """
+    Describe the current state of a delivery order as an event
+    :param delivery_order: the DeliveryOrder to describe
+    :return: a dict which can be serialized to json
+    """
+    return {'type': 'delivery_order',
+            'id': delivery_order.id,
+            'project': delivery_order.ngi_project_name,
+            'delivery_project': delivery_order.delivery_project,
+            'staging_order_id': delivery_order.staging_order_id,
+            'status': delivery_order.delivery_status.name if delivery_order.delivery_status else None,
+            'files_uploaded': delivery_order.files_uploaded,
+            'bytes_uploaded': delivery_order.bytes_uploaded,
+            'throughput': delivery_order.throughput,
+            'eta': delivery_order.eta}
+
+
+def collect_order_event(session, order):
+    """
+    Describe the current state of an order as an event, which is published once the session is committed.
+    Changes are picked up from the session when they are flushed, so this is only needed for changes which
+    are not flushed, e.g. ones made by a bulk update.
+    :param session: the session which the change is committed with
+    :param order: the StagingOrder or DeliveryOrder to describe
+    :return: None
+    """
+    if isinstance(order, StagingOrder):
+        order_event = staging_order_event(order)
+    elif isinstance(order, DeliveryOrder):
+        order_event = delivery_order_event(order)
+    else:
+        return
+    session.info.setdefault('order_events', {})[(order_event['type'], order_event['id'])] = order_event
+
+
+class OrderEventSubscription(object):
+    """
+    The events which a client has subscribed to, they are put on `queue` as they happen. An event matches
+    the subscription if it is about one of the projects or orders listed, or if nothing is listed at all.
+    """
+
+    def __init__(self, projects=None, staging_order_ids=None, delivery_order_ids=None, max_queued_events=1000):
+        """
+        Instantiate a new OrderEventSubscription
+        :param projects: names of projects (or ids of DDS projects) to follow
+        :param staging_order_ids: ids of staging orders to follow
+        :param delivery_order_ids: ids of delivery orders to follow
+        :param max_queued_events: the number of events to keep for a client which does not keep up, any
+        events after that are dropped
+        """
+        self.projects = set(projects or [])
+        self.staging_order_ids = set(int(order_id) for order_id in staging_order_ids or [])
+        self.delivery_order_ids = set(int(order_id) for order_id in delivery_order_ids or [])
+        self.queue = Queue(maxsize=max_queued_events)
+
+    def matches(self, order_event):
+        """
+        :param order_event: the event to check
+        :return: True if the event should be sent to the subscriber, otherwise False
+        """
+        if not (self.projects or self.staging_order_ids or self.delivery_order_ids):
+            return True
+        if order_event['project'] in self.projects or order_event.get('delivery_project') in self.projects:
+            return True
+        if order_event['type'] == 'staging_order':
+            return order_event['id'] in self.staging_order_ids
+        return order_event['id'] in self.delivery_order_ids
+
+
+class OrderEventService(object):
+    """
+    Publishes changes of staging and delivery orders to any subscribers as they are committed to the database,
+    so that clients do not have to poll for the status of the orders. The changes are picked up from the
+    sessions created by `session_factory`, regardless of which service made them.
+    """
+
+    def __init__(self, session_factory):
+        """
+        Instantiate a new OrderEventService
+        :param session_factory: factory of the database sessions to follow
+        """
+        self.subscriptions = []
+        event.listen(session_factory, 'after_flush', self._collect_events)
+        event.listen(session_factory, 'after_commit', self._publish_events)
+        event.listen(session_factory, 'after_soft_rollback', self._discard_events)
+
+    def subscribe(self, projects=None, staging_order_ids=None, delivery_order_ids=None):
+        """
+        Subscribe to events about orders, see `OrderEventSubscription`
+        :return: a OrderEventSubscription, whose queue the events will be put on
+        """
+        subscription = OrderEventSubscription(projects, staging_order_ids, delivery_order_ids)
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Stop publishing events to a subscription
+        :param subscription: the OrderEventSubscription to remove
+        :return: None
+        """
+        try:
+            self.subscriptions.remove(subscription)
+        except ValueError:
+            pass
+
+    def publish(self, order_event):
+        """
+        Put an event on the queue of every subscription which it matches
+        :param order_event: the event to publish
+        :return: None
+        """
+        for subscription in self.subscriptions:
+            if subscription.matches(order_event):
+                try:
+                    subscription.queue.put_nowait(order_event)
+                except QueueFull:
+                    log.warning("Dropping event about {} {} for a subscriber which is not keeping up".format(
+                        order_event['type'], order_event['id']))
+
+    def _collect_events(self, session, flush_context):
+        # The events are described while the changes are still available in the session, but
+        # are not published until they have been committed.
+        if not self.subscriptions:
+            return
+        changed = list(session.new) + [instance for instance in session.dirty if session.is_modified(instance)]
+        for instance in changed:
+            collect_order_event(session, instance)
+
+    def _publish_events(self, session):
+        for order_event in session.info.pop('order_events', {}).values():
+            self.publish(order_event)
+
+    def _discard_events(self, session, previous_transaction):
+        session.info.pop('order_events', None)
@@ -1,19 +1,81 @@
 
+import collections
+import heapq
 import logging
 import os
 import signal
 import re
+import tempfile
+import time
+from contextlib import ExitStack
+from datetime import timedelta
 
 from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.locks import Semaphore, Condition
 
 from delivery.models.db_models import StagingStatus
+from delivery.models.execution import ResourceUsage
 from delivery.exceptions import RunfolderNotFoundException, InvalidStatusException,\
     ProjectNotFoundException, TooManyProjectsFound
 
+from delivery.services.external_program_service import ExternalProgramService
 from delivery.services.file_system_service import FileSystemService
+from delivery.services.local_copy_service import LocalCopyService, CopyProgress
 
 log = logging.getLogger(__name__)
 
+# The pool of the ExternalProgramService which rsync processes are run in
+RSYNC_POOL = 'rsync'
+
+
+class RsyncProgressParser(object):
+    """
+    Follows the output of `rsync --info=progress2`, which reports the progress of the transfer as a
+    whole on lines separated by carriage returns, e.g:
+
+        1,238,099  42%   11.75MB/s    0:00:01 (xfr#12, to-chk=44/100)
+
+    The output can be fed to the parser in chunks as it is produced, which are split into lines by
+    `ExternalProgramService.line_callback`.
+    """
+
+    PROGRESS_PATTERN = re.compile(r'^\s*([\d,]+)\s+(\d+)%\s+([\d.]+)([kMGT]?)B/s\s+[\d:]+(?:\s+\(xfr#(\d+),)?')
+    UNITS = {"": 1, "k": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+    def __init__(self):
+        self.bytes_transferred = 0
+        self.files_transferred = 0
+        self.throughput = 0.0
+        self.eta = None
+        # Parse a chunk of rsync output, as a string, and update the progress accordingly
+        self.feed = ExternalProgramService.line_callback(self.parse_line)
+
+    def parse_line(self, line):
+        """
+        Parse a line of rsync output and update the progress accordingly
+        :param line: the line, without the line break
+        :return: None
+        """
+        match = self.PROGRESS_PATTERN.match(line)
+        if not match:
+            return
+        self.bytes_transferred = int(match.group(1).replace(",", ""))
+        percent_done = int(match.group(2))
+        self.throughput = float(match.group(3)) * self.UNITS[match.group(4)]
+        if match.group(5):
+            self.files_transferred = int(match.group(5))
+
+        # rsync only reports the time remaining while a file is in transfer, so the eta
+        # is instead estimated from the total progress and the current throughput
+        if percent_done >= 100:
+            self.eta = 0
+        elif percent_done > 0 and self.throughput > 0:
+            bytes_remaining = self.bytes_transferred * (100 - percent_done) / percent_done
+            self.eta = int(bytes_remaining / self.throughput)
+        else:
+            self.eta = None
+
 
 class StagingService(object):
     """
@@ -21,22 +83,24 @@ class StagingService(object):
     directory before delivering it.  This service handles that in a
     asynchronous way. Copying operations (right now powered by rsync) can be
     started, and their status monitored by querying the underlying database for
-    their status.
+    their status. With the `link` staging engine, sources on the same filesystem
+    as the staging directory are reflinked or hardlinked into place instead of
+    being copied, and with the `copy` staging engine data is copied by the service
+    itself rather than by rsync.
+
+    Staging orders are queued with the status `pending` and are only started
+    once a worker slot is available. The number of slots can be limited both
+    globally and per filesystem holding the source, see `staging_conf`. If the
+    `check_staging_space` option is set, the size of the source is estimated
+    once the order has got its slots, and the order is held back until there is
+    room for it in the staging area, or rejected if it will never fit.
+
+    Orders are moved between statuses with a compare-and-set update in the database,
+    so several service processes can share a database without staging the same order
+    twice. This is what makes it safe to recover orders which were left behind by a
+    stopped service on startup, see `recover_orphaned_stage_orders`.
     """
 
-    # TODO On initiation of a Staging service, restart any ongoing stagings
-    # since they should all have been killed.
-    # And if we do so we need to make sure that the Staging service
-    # acts as a singleton, look at:
-    # http://python-3-patterns-idioms-test.readthedocs.io/en/latest/Singleton.html
-    #
-    # Alternative suggestion from Steinar on how to solve the problem, which is probably better:
-    # "Do you mean to ensure that only one thread tries doing that at a time? An idea could
-    #  be to take a database lock to ensure this, i.e. fetch all objects in the unfinished
-    #  state, restart them, change the status and then commit, locking the sqlite database
-    #  briefly while doing so (I think row level locking is limited in sqlite.)"
-    #  / JD 20161111
-
     def __init__(self,
                  staging_dir,
                  external_program_service,
@@ -45,7 +109,9 @@ class StagingService(object):
                  project_dir_repo,
                  project_links_directory,
                  session_factory,
-                 file_system_service = FileSystemService):
+                 file_system_service = FileSystemService,
+                 staging_conf=None,
+                 local_copy_service=None):
         """
         Instantiate a new StagingService
         :param staging_dir: the directory to which files/dirs should be staged
@@ -56,6 +122,15 @@ class StagingService(object):
         :param project_links_directory: a path to a directory where links will be created temporarily
                                         before they are rsynced into staging (for batched deliveries etc)
         :param session_factory: a factory method which can produce new sqlalchemy Session instances
+        :param staging_conf: a dict with staging options, e.g. `max_concurrent_stagings` and
+                             `max_concurrent_stagings_per_filesystem`. Limits which are not set are
+                             considered unbounded. `staging_engine` can be `rsync` (default), `link` or
+                             `copy`, and `copy_workers` sets the number of files the `copy` engine copies
+                             at the same time. With `verify_checksums`, the `copy` engine verifies files
+                             against the `checksums.md5` files of the source while copying them.
+                             `check_staging_space`, `staging_space_margin` and `staging_space_poll_interval`
+                             control the admission of orders based on the free space in the staging area.
+        :param local_copy_service: a instance of LocalCopyService, used by the `link` and `copy` staging engines
         """
         self.staging_dir = staging_dir
         self.external_program_service = external_program_service
@@ -65,10 +140,121 @@ class StagingService(object):
         self.project_links_directory = project_links_directory
         self.session_factory = session_factory
         self.file_system_service = file_system_service
+        self.staging_conf = staging_conf or {}
+        self.local_copy_service = local_copy_service or LocalCopyService()
+
+        max_concurrent_stagings = self.staging_conf.get("max_concurrent_stagings")
+        self._staging_slots = Semaphore(max_concurrent_stagings) if max_concurrent_stagings else None
+        self._max_concurrent_stagings_per_filesystem = \
+            self.staging_conf.get("max_concurrent_stagings_per_filesystem")
+        self._filesystem_staging_slots = {}
+
+        # The estimated size of the staging orders which have been admitted to the staging
+        # area, by staging order id
+        self._staging_space_reservations = {}
+        self._staging_space_released = Condition()
+
+    @staticmethod
+    def _plan_rsync_shards(source, nbr_of_shards, file_system_service):
+        """
+        Split the contents of a staging source into shards of roughly the same size, which can then be
+        copied by separate rsync processes. Directories that are large compared to the size of a shard
+        are split up into their contents, so e.g. a project holding a single runfolder will be split by
+        sample directory.
+        :param source: the directory to split up
+        :param nbr_of_shards: the maximum number of shards to create
+        :param file_system_service: a FileSystemService used to look up sizes on disk
+        :return: a list of shards, where each shard is a list of paths relative to the source
+        """
+        sizes = file_system_service.entry_sizes(source)
+        children = collections.defaultdict(list)
+        for path in sizes:
+            children[os.path.dirname(path)].append(path)
+
+        shard_size = sum(sizes[path] for path in children[""]) / nbr_of_shards
+        units = list(children[""])
+        while True:
+            splittable = [path for path in units if children[path]]
+            if not splittable:
+                break
+            largest = max(splittable, key=lambda path: sizes[path])
+            if sizes[largest] <= shard_size and len(units) >= nbr_of_shards:
+                break
+            units.remove(largest)
+            units.extend(children[largest])
+
+        # Hand out the largest units first, each to the shard which is currently the smallest
+        shards = [(0, index, []) for index in range(nbr_of_shards)]
+        for path in sorted(units, key=lambda path: sizes[path], reverse=True):
+            size, index, paths = heapq.heappop(shards)
+            paths.append(path)
+            heapq.heappush(shards, (size + sizes[path], index, paths))
+
+        return [sorted(paths) for _, _, paths in sorted(shards, key=lambda shard: shard[1]) if paths]
 
     @staticmethod
     @gen.coroutine
-    def _copy_dir(staging_order_id, external_program_service, session_factory, staging_repo):
+    def _run_commands(cmds, external_program_service, stdout_callbacks, started_callback):
+        """
+        Run a number of rsync commands side by side in the `rsync` pool of the external program service, and
+        wait for them to finish. As soon as one of them fails the remaining ones are terminated, since their
+        results will not be used anyway.
+        :param cmds: a list of commands to run
+        :param external_program_service: A instance of ExternalProgramService
+        :param stdout_callbacks: a list with one callback per command, which follows its output
+        :param started_callback: called with each Execution as soon as it has been started
+        :return: a list with one ExecutionResult per command, in the same order as the commands
+        """
+        running = []
+        failed = False
+
+        def _terminate(execution):
+            try:
+                os.kill(execution.pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+        @gen.coroutine
+        def _run(cmd, stdout_callback):
+            nonlocal failed
+            execution = yield external_program_service.run_in_pool(cmd, RSYNC_POOL)
+            started_callback(execution)
+            if failed:
+                _terminate(execution)
+            running.append(execution)
+            try:
+                execution_result = yield external_program_service.wait_for_execution(
+                    execution, stdout_callback=stdout_callback)
+            finally:
+                running.remove(execution)
+            if execution_result.status_code != 0 and not failed:
+                failed = True
+                for other_execution in running:
+                    _terminate(other_execution)
+            return execution_result
+
+        execution_results = yield [_run(cmd, stdout_callback)
+                                   for cmd, stdout_callback in zip(cmds, stdout_callbacks)]
+        return execution_results
+
+    @staticmethod
+    def _update_progress(staging_order, progress_parsers):
+        """
+        Set the progress of a staging order from the progress of the rsync processes carrying it out
+        :param staging_order: the StagingOrder to update
+        :param progress_parsers: a list with one RsyncProgressParser per rsync process
+        :return: None
+        """
+        staging_order.bytes_transferred = sum(parser.bytes_transferred for parser in progress_parsers)
+        staging_order.files_transferred = sum(parser.files_transferred for parser in progress_parsers)
+        staging_order.throughput = sum(parser.throughput for parser in progress_parsers)
+        etas = [parser.eta for parser in progress_parsers]
+        staging_order.eta = None if None in etas else max(etas)
+
+    @staticmethod
+    @gen.coroutine
+    def _copy_dir(staging_order_id, external_program_service, session_factory, staging_repo,
+                  rsync_shards=1, file_system_service=FileSystemService, progress_update_interval=5):
         """
         Copies the file or directory indicated by the staging order by calling the external_program_service.
         It will attempt the copying and update the database with the status of the StagingOrder depending on the
@@ -77,6 +263,11 @@ class StagingService(object):
         :param external_program_service: A instance of ExternalProgramService
         :param session_factory: A factory method which can produce a new sql alchemy Session instance
         :param staging_repo: A instance of DatabaseBasedStagingRepository
+        :param rsync_shards: the number of rsync processes to split a directory between. The pid of the
+                             first process is stored on the staging order.
+        :param file_system_service: a FileSystemService used to split a directory into shards
+        :param progress_update_interval: the minimum number of seconds between storing the progress
+                                         of the transfer in the database
         :return: None, only reports back through side-effects
         """
 
@@ -88,34 +279,96 @@ class StagingService(object):
         staging_order = staging_repo.get_staging_order_by_id(staging_order_id, session)
         try:
             staging_source_with_trailing_slash = staging_order.source + "/"
-            cmd = ['rsync', '--stats', '-r', '--copy-links', '--times',
-                   staging_source_with_trailing_slash, staging_order.staging_target]
-            log.debug("Running rsync with command: {}".format(" ".join(cmd)))
-
-            execution = external_program_service.run(cmd)
-
-            staging_order.pid = execution.pid
-            session.commit()
-
-            execution_result = yield external_program_service.wait_for_execution(execution)
-            log.debug("Execution result: {}".format(execution_result))
-            if execution_result.status_code == 0:
-
-                # Parse the file size from the output of rsync stats:
+            # With --partial an interrupted transfer can be resumed by running rsync again, since
+            # files which were completely transferred match on size and time and are skipped
+            base_cmd = ['rsync', '--stats', '-r', '--copy-links', '--times', '--partial',
+                        '--info=progress2', '--no-inc-recursive']
+            if staging_order.link_dest:
+                base_cmd.append('--link-dest={}'.format(staging_order.link_dest))
+
+            with ExitStack() as shard_files:
+                cmds = []
+                if rsync_shards > 1 and file_system_service.isdir(staging_order.source):
+                    # Sizing up the source means walking all of it, which is done in a separate thread
+                    shards = yield IOLoop.current().run_in_executor(
+                        None, StagingService._plan_rsync_shards, staging_order.source, rsync_shards,
+                        file_system_service)
+                    for shard in shards:
+                        shard_file = shard_files.enter_context(tempfile.NamedTemporaryFile(
+                            mode='w', prefix="staging_order_{}_".format(staging_order.id), suffix=".lst"))
+                        shard_file.write("\n".join(shard) + "\n")
+                        shard_file.flush()
+                        cmds.append(base_cmd + ['--files-from={}'.format(shard_file.name),
+                                                staging_source_with_trailing_slash, staging_order.staging_target])
+                if not cmds:
+                    cmds.append(base_cmd + [staging_source_with_trailing_slash, staging_order.staging_target])
+
+                for cmd in cmds:
+                    log.debug("Running rsync with command: {}".format(" ".join(cmd)))
+
+                progress_parsers = [RsyncProgressParser() for _ in cmds]
+                last_progress_update = time.monotonic()
+
+                started = []
+
+                def _store_pid(execution):
+                    # Processes waiting for a place in the rsync pool are started later on, so the
+                    # pid stored is the one of the first process to be started
+                    if not started:
+                        staging_order.pid = execution.pid
+                        session.commit()
+                    started.append(execution)
+
+                def _follow_progress(progress_parser):
+                    def _callback(output):
+                        nonlocal last_progress_update
+                        progress_parser.feed(output)
+                        if time.monotonic() - last_progress_update >= progress_update_interval:
+                            StagingService._update_progress(staging_order, progress_parsers)
+                            session.commit()
+                            last_progress_update = time.monotonic()
+                    return _callback
+
+                execution_results = yield StagingService._run_commands(
+                    cmds, external_program_service,
+                    [_follow_progress(progress_parser) for progress_parser in progress_parsers],
+                    _store_pid)
+                StagingService._update_progress(staging_order, progress_parsers)
+
+            resource_usage = ResourceUsage.total([result.resource_usage for result in execution_results])
+            if resource_usage:
+                resource_usage.store_on(staging_order)
+
+            log.debug("Execution results: {}".format(execution_results))
+            failed_results = [result for result in execution_results if result.status_code != 0]
+            if not failed_results:
+
+                # Parse the file size and the number of regular files from the output of rsync stats:
+                # Number of files: 4 (reg: 3, dir: 1)
                 # Total file size: 207,707,566 bytes
-                match = re.search(r'Total file size: ([\d,]+) bytes',
-                                  execution_result.stdout,
-                                  re.MULTILINE)
-                size_of_transfer = match.group(1)
-                size_of_transfer = int(size_of_transfer.replace(",", ""))
+                # The number of files staged is stored in place of the number transferred, since files
+                # which were already staged by an earlier attempt, or were linked from a previous batch,
+                # are not transferred again
+                size_of_transfer = 0
+                files_staged = 0
+                for execution_result in execution_results:
+                    match = re.search(r'Total file size: ([\d,]+) bytes',
+                                      execution_result.stdout,
+                                      re.MULTILINE)
+                    size_of_transfer += int(match.group(1).replace(",", ""))
+                    match = re.search(r'Number of files: [\d,]+ \([^)]*reg: ([\d,]+)',
+                                      execution_result.stdout)
+                    if match:
+                        files_staged += int(match.group(1).replace(",", ""))
                 staging_order.size = size_of_transfer
+                staging_order.files_transferred = files_staged
 
                 staging_order.status = StagingStatus.staging_successful
                 log.info("Successfully staged: {} to: {}".format(staging_order, staging_order.get_staging_path()))
             else:
                 staging_order.status = StagingStatus.staging_failed
                 log.error("Failed in staging: {} because rsync returned exit code: {}".
-                         format(staging_order, execution_result.status_code))
+                         format(staging_order, failed_results[0].status_code))
 
         # TODO Better exception handling here...
         except Exception as e:
@@ -126,15 +379,209 @@ class StagingService(object):
             # Always commit the state change to the database
             session.commit()
 
+    @staticmethod
+    @gen.coroutine
+    def _link_dir(staging_order_id, session_factory, staging_repo, local_copy_service):
+        """
+        Stage the directory indicated by the staging order by linking its files into the staging target,
+        which is only possible if the source and the target are on the same filesystem. Files which are
+        unchanged in the `link_dest` of the staging order are hardlinked from there instead. The linking is
+        carried out in a separate thread.
+        :param staging_order_id: The id of the staging order to execute
+        :param session_factory: A factory method which can produce a new sql alchemy Session instance
+        :param staging_repo: A instance of DatabaseBasedStagingRepository
+        :param local_copy_service: A instance of LocalCopyService
+        :return: True if the staging order was handled, False if the data needs to be copied instead
+        """
+        session = session_factory()
+        staging_order = staging_repo.get_staging_order_by_id(staging_order_id, session)
+        try:
+            staging_order.pid = os.getpid()
+            session.commit()
+
+            size_of_transfer = yield IOLoop.current().run_in_executor(
+                None, local_copy_service.link_tree, staging_order.source, staging_order.staging_target,
+                staging_order.link_dest)
+
+            if size_of_transfer is None:
+                log.info("Cannot link: {} into place, since it is not on the same filesystem as: {}".format(
+                    staging_order, staging_order.get_staging_path()))
+                return False
+
+            staging_order.size = size_of_transfer
+            staging_order.status = StagingStatus.staging_successful
+            log.info("Successfully staged: {} to: {} by linking".format(
+                staging_order, staging_order.get_staging_path()))
+
+        except Exception as e:
+            staging_order.status = StagingStatus.staging_failed
+            log.error("Failed in staging: {} because this exception was logged: {}".
+                      format(staging_order, e))
+        finally:
+            session.commit()
+
+        return True
+
+    @staticmethod
+    @gen.coroutine
+    def _copy_dir_in_process(staging_order_id, session_factory, staging_repo, local_copy_service,
+                             copy_workers=8, progress_update_interval=5, verify_checksums=False):
+        """
+        Copies the directory indicated by the staging order into the staging target without the help of
+        rsync. The files are copied by a pool of threads, and the progress is stored in the database
+        regularly while this is going on. Files which are unchanged in the `link_dest` of the staging order
+        are hardlinked from there instead of being copied.
+        :param staging_order_id: The id of the staging order to execute
+        :param session_factory: A factory method which can produce a new sql alchemy Session instance
+        :param staging_repo: A instance of DatabaseBasedStagingRepository
+        :param local_copy_service: A instance of LocalCopyService
+        :param copy_workers: the number of files to copy at the same time
+        :param progress_update_interval: the number of seconds between storing the progress of the copy
+        :param verify_checksums: if True, verify the copied files against the checksum files found in the
+                                 source, and fail the staging order if any of them does not match. The outcome
+                                 for each file is written to `checksum_verification.txt` next to (rather than in)
+                                 the staged directory, so that it is not delivered.
+        :return: None, only reports back through side-effects
+        """
+        session = session_factory()
+        staging_order = staging_repo.get_staging_order_by_id(staging_order_id, session)
+        progress = CopyProgress()
+        if verify_checksums:
+            checksum_report = os.path.join(os.path.dirname(staging_order.staging_target),
+                                           "checksum_verification.txt")
+        else:
+            checksum_report = None
+
+        def _update_progress():
+            staging_order.bytes_transferred = progress.bytes_transferred
+            staging_order.files_transferred = progress.files_transferred
+            staging_order.throughput = progress.throughput
+            staging_order.eta = progress.eta
+
+        try:
+            staging_order.pid = os.getpid()
+            session.commit()
+
+            copying = IOLoop.current().run_in_executor(
+                None, local_copy_service.copy_tree, staging_order.source, staging_order.staging_target,
+                progress, copy_workers, checksum_report, staging_order.link_dest)
+            while True:
+                try:
+                    size_of_transfer = yield gen.with_timeout(timedelta(seconds=progress_update_interval),
+                                                              copying)
+                    break
+                except gen.TimeoutError:
+                    _update_progress()
+                    session.commit()
+
+            _update_progress()
+            staging_order.size = size_of_transfer
+            staging_order.status = StagingStatus.staging_successful
+            log.info("Successfully staged: {} to: {}".format(staging_order, staging_order.get_staging_path()))
+
+        except Exception as e:
+            staging_order.status = StagingStatus.staging_failed
+            log.error("Failed in staging: {} because this exception was logged: {}".
+                      format(staging_order, e))
+        finally:
+            session.commit()
+
+    def _source_filesystem(self, source):
+        """
+        Get the id of the device holding the data of a staging source. Batch deliveries stage a directory
+        of links to the runfolders, so the first directory under the source (following links) is used when
+        there is one.
+        :param source: path to the staging source
+        :return: the device id of the filesystem
+        """
+        if self.file_system_service.isdir(source):
+            for directory in self.file_system_service.list_directories(source):
+                return self.file_system_service.stat(directory).st_dev
+        return self.file_system_service.stat(source).st_dev
+
+    def _staging_slots_for(self, stage_order):
+        """
+        Get the worker slots that a staging order needs to hold while it is being staged. The slot for
+        the source filesystem comes before the global slot, so that an order waiting for a busy
+        filesystem does not occupy a global slot in the meantime.
+        :param stage_order: the StagingOrder to get slots for
+        :return: a list of Semaphore instances to acquire, in order
+        """
+        slots = []
+        if self._max_concurrent_stagings_per_filesystem:
+            filesystem = self._source_filesystem(stage_order.source)
+            if filesystem not in self._filesystem_staging_slots:
+                self._filesystem_staging_slots[filesystem] = Semaphore(
+                    self._max_concurrent_stagings_per_filesystem)
+            slots.append(self._filesystem_staging_slots[filesystem])
+        if self._staging_slots:
+            slots.append(self._staging_slots)
+        return slots
+
+    def _reserved_staging_space(self):
+        """
+        Get the number of bytes which admitted staging orders are still expected to write to the
+        staging area, i.e. their estimated size minus what has been transferred so far.
+        :return: the number of reserved bytes
+        """
+        reserved = 0
+        for estimated_size, stage_order in self._staging_space_reservations.values():
+            reserved += max(estimated_size - (stage_order.bytes_transferred or 0), 0)
+        return reserved
+
+    @gen.coroutine
+    def _reserve_staging_space(self, stage_order):
+        """
+        Estimate the size of a staging order and wait until there is room for it in the staging area, taking
+        the space reserved by other orders into account. The space remains reserved until
+        `_release_staging_space` is called.
+        :param stage_order: the StagingOrder to reserve space for
+        :return: True if space was reserved, False if the order will never fit in the staging area
+        """
+        estimated_size = yield IOLoop.current().run_in_executor(
+            None, self.file_system_service.tree_size, stage_order.source)
+        margin = self.staging_conf.get("staging_space_margin", 0)
+        poll_interval = self.staging_conf.get("staging_space_poll_interval", 60)
+
+        if estimated_size + margin > self.file_system_service.disk_usage(self.staging_dir).total:
+            log.error("Staging order: {} needs {} bytes, which is more than the staging area can hold".format(
+                stage_order, estimated_size))
+            return False
+
+        while True:
+            available = self.file_system_service.disk_usage(self.staging_dir).free - \
+                self._reserved_staging_space() - margin
+            if estimated_size <= available:
+                break
+            log.info("Staging order: {} needs {} bytes but only {} are available, waiting for space to be "
+                     "freed".format(stage_order, estimated_size, available))
+            # Space is also freed when delivered data is removed from the staging area, hence the polling
+            yield self._staging_space_released.wait(timeout=timedelta(seconds=poll_interval))
+
+        self._staging_space_reservations[stage_order.id] = (estimated_size, stage_order)
+        return True
+
+    def _release_staging_space(self, stage_order):
+        """
+        Release the space reserved for a staging order, and wake up any orders waiting for space
+        :param stage_order: the StagingOrder to release space for
+        :return: None
+        """
+        del self._staging_space_reservations[stage_order.id]
+        self._staging_space_released.notify_all()
+
     @gen.coroutine
     def stage_order(self, stage_order):
         """
-        Validate a staging order and hand of the actual stating to a separate thread.
+        Validate a staging order and queue it for staging. The order will keep its `pending` status until
+        worker slots are available and there is room for it in the staging area (if this is checked), after
+        which the actual staging is handed of to a separate process.
         :param stage_order: to stage
         :return: None
         """
 
         session = self.session_factory()
+        has_reserved_space = False
 
         try:
 
@@ -142,30 +589,129 @@ class StagingService(object):
                 raise InvalidStatusException("Cannot start staging a delivery order with status: {}".
                                              format(stage_order.status))
 
-            stage_order.status = StagingStatus.staging_in_progress
-            session.commit()
-
-            args_for_copy_dir = {"staging_order_id": stage_order.id,
-                                 "external_program_service": self.external_program_service,
-                                 "staging_repo": self.staging_repo,
-                                 "session_factory": self.session_factory}
-
-            if not self.file_system_service.exists(stage_order.staging_target):
-                self.file_system_service.makedirs(stage_order.staging_target)
-
-            yield StagingService._copy_dir(**args_for_copy_dir)
+            with ExitStack() as staging_slots:
+                for slot in self._staging_slots_for(stage_order):
+                    staging_slots.enter_context((yield slot.acquire()))
+
+                # Space is only reserved by orders which are about to be staged, so that orders waiting for a
+                # slot do not hold back the ones which have got one
+                if self.staging_conf.get("check_staging_space", False):
+                    has_reserved_space = yield self._reserve_staging_space(stage_order)
+                    if not has_reserved_space:
+                        stage_order.status = StagingStatus.staging_rejected
+                        session.commit()
+                        return
+
+                if not self.staging_repo.claim_staging_order(stage_order, StagingStatus.staging_in_progress,
+                                                             custom_session=session):
+                    log.info("Staging order: {} has already been started by someone else".format(stage_order.id))
+                    return
+                stage_order.status = StagingStatus.staging_in_progress
+
+                args_for_copy_dir = {"staging_order_id": stage_order.id,
+                                     "external_program_service": self.external_program_service,
+                                     "staging_repo": self.staging_repo,
+                                     "session_factory": self.session_factory,
+                                     "rsync_shards": stage_order.rsync_shards or
+                                     self.staging_conf.get("rsync_shards", 1),
+                                     "file_system_service": self.file_system_service,
+                                     "progress_update_interval":
+                                         self.staging_conf.get("progress_update_interval", 5)}
+
+                if not self.file_system_service.exists(stage_order.staging_target):
+                    self.file_system_service.makedirs(stage_order.staging_target)
+
+                staging_engine = self.staging_conf.get("staging_engine", "rsync")
+                if staging_engine == "link" and self.file_system_service.isdir(stage_order.source):
+                    staged_by_linking = yield StagingService._link_dir(
+                        staging_order_id=stage_order.id,
+                        session_factory=self.session_factory,
+                        staging_repo=self.staging_repo,
+                        local_copy_service=self.local_copy_service)
+                    if staged_by_linking:
+                        return
+
+                if staging_engine == "copy" and self.file_system_service.isdir(stage_order.source):
+                    yield StagingService._copy_dir_in_process(
+                        staging_order_id=stage_order.id,
+                        session_factory=self.session_factory,
+                        staging_repo=self.staging_repo,
+                        local_copy_service=self.local_copy_service,
+                        copy_workers=self.staging_conf.get("copy_workers", 8),
+                        verify_checksums=self.staging_conf.get("verify_checksums", False),
+                        progress_update_interval=self.staging_conf.get("progress_update_interval", 5))
+                    return
+
+                yield StagingService._copy_dir(**args_for_copy_dir)
 
         # TODO Better error handling
         except Exception as e:
             stage_order.status = StagingStatus.staging_failed
             session.commit()
             raise e
+        finally:
+            if has_reserved_space:
+                self._release_staging_space(stage_order)
 
-    def create_new_stage_order(self, path, project_name):
+    def restart_pending_stage_orders(self):
+        """
+        Queue all staging orders which are `pending` in the database, e.g. orders which were still waiting
+        for a worker slot when the service was stopped.
+        :return: None
+        """
+        for stage_order in self.staging_repo.get_staging_orders_by_status(StagingStatus.pending):
+            log.info("Queueing pending staging order: {}".format(stage_order))
+            IOLoop.current().spawn_callback(self.stage_order, stage_order)
+
+    def get_incremental_staging_reference(self, project_name):
+        """
+        Find the staged directory of the last successfully staged batch of a project, which can be used as
+        reference when staging the next batch, provided that it has not been removed since.
+        :param project_name: the project to find a reference for
+        :return: the path to the staged directory, or None if there is no such directory
+        """
+        previous_stage_order = self.staging_repo.get_last_successful_batch_staging_order(project_name)
+        if not previous_stage_order:
+            log.info("No previous staging found to use as reference for project: {}".format(project_name))
+            return None
+
+        previous_staging_path = previous_stage_order.get_staging_path()
+        if not self.file_system_service.isdir(previous_staging_path):
+            log.info("The previous staging of project: {} at {} has been removed and cannot be used as "
+                     "reference".format(project_name, previous_staging_path))
+            return None
+
+        return previous_staging_path
+
+    def recover_orphaned_stage_orders(self):
+        """
+        Find staging orders which are `staging_in_progress`, but whose process is no longer running, e.g.
+        because the service was restarted while they were being staged, and queue them again. Since rsync
+        is run with `--partial`, files which were already staged will not be copied again. If several
+        service processes start at the same time, only one of them will requeue each order.
+
+        An order is claimed together with the pid of the service process, which is replaced by the one of
+        the staging process once it has been started, so an order without a pid cannot be told apart from
+        one which is just being started and is left alone.
+        :return: None
+        """
+        for stage_order in self.staging_repo.get_staging_orders_by_status(StagingStatus.staging_in_progress):
+            if stage_order.pid is None:
+                log.warning("Cannot tell if staging order: {} is orphaned, since it has no pid".format(stage_order))
+                continue
+            if self.external_program_service.is_running(stage_order.pid):
+                continue
+            if self.staging_repo.claim_staging_order(stage_order, StagingStatus.pending):
+                log.warning("Requeueing orphaned staging order: {}".format(stage_order))
+                IOLoop.current().spawn_callback(self.stage_order, stage_order)
+
+    def create_new_stage_order(self, path, project_name, rsync_shards=None, link_dest=None):
         staging_order = self.staging_repo.create_staging_order(source=path,
                                                                status=StagingStatus.pending,
                                                                staging_target_dir=self.staging_dir,
-                                                               project_name=project_name)
+                                                               project_name=project_name,
+                                                               rsync_shards=rsync_shards,
+                                                               link_dest=link_dest)
         return staging_order
 
     def get_stage_order_by_id(self, stage_order_id):
@@ -207,6 +753,9 @@ class StagingService(object):
                 raise InvalidStatusException(
                     "Can only kill processes where the staging order is 'staging_in_progress'")
 
+            if stage_order.pid is None or stage_order.pid == os.getpid():
+                raise OSError("Staging order: {} is not carried out by a separate process".format(stage_order.id))
+
             os.kill(stage_order.pid, signal.SIGTERM)
 
         except OSError:
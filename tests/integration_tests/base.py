@@ -8,6 +8,7 @@ from subprocess import PIPE
 
 from tornado.testing import *
 from tornado.web import Application
+from tornado.process import Subprocess
 
 from arteria.web.app import AppService
 
@@ -130,8 +131,8 @@ class BaseIntegration(AsyncHTTPTestCase):
 
                 log.debug(f"Running mocked {new_cmd}")
                 p = Subprocess(new_cmd,
-                               stdout=PIPE,
-                               stderr=PIPE,
+                               stdout=Subprocess.STREAM,
+                               stderr=Subprocess.STREAM,
                                stdin=PIPE,
                                shell=shell)
                 return Execution(pid=p.pid, process_obj=p)
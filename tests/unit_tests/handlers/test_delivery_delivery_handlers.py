@@ -21,11 +21,20 @@ class TestDeliveryHandlers(AsyncHTTPTestCase):
         self.mock_runfolder_repo.get_runfolders.return_value = FAKE_RUNFOLDERS
         self.mock_runfolder_repo.get_runfolder.return_value = FAKE_RUNFOLDERS[0]
 
+        self.mock_dds_service = MagicMock()
+
         return Application(
             routes(
                 config=DummyConfig(),
-                runfolder_repo=self.mock_runfolder_repo))
+                runfolder_repo=self.mock_runfolder_repo,
+                dds_service=self.mock_dds_service))
 
     def test_post_delivery_runfolder(self):
         # TODO Write tests
         pass
+
+    def test_post_delivery_with_invalid_staging_ids(self):
+        for staging_ids in [[], "1", [1, 2, 1], [1, "1"]]:
+            body = {'staging_ids': staging_ids, 'delivery_project_id': 'snpseq00001', 'auth_token': 'token'}
+            response = self.fetch(self.API_BASE + "/deliver/stage_ids", method='POST', body=json.dumps(body))
+            self.assertEqual(response.code, 400)
@@ -0,0 +1,67 @@
+import json
+from mock import MagicMock
+
+from tornado import gen
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application
+from sqlalchemy.orm import sessionmaker
+
+from delivery.app import routes
+from delivery.models.db_models import StagingOrder, StagingStatus
+from delivery.services.order_event_service import OrderEventService
+
+from tests.test_utils import DummyConfig
+
+
+class TestOrderEventsHandler(AsyncHTTPTestCase):
+
+    API_BASE = "/api/1.0"
+
+    def get_app(self):
+        self.order_event_service = OrderEventService(sessionmaker())
+        self.mock_delivery_service = MagicMock()
+        self.mock_delivery_service.check_staging_status.return_value = StagingOrder(
+            id=1, source='/foo/ABC_123', status=StagingStatus.staging_in_progress,
+            staging_target='/staging/1/ABC_123')
+
+        return Application(
+            routes(
+                config=DummyConfig(),
+                order_event_service=self.order_event_service,
+                delivery_service=self.mock_delivery_service,
+                dds_service=MagicMock()))
+
+    @gen_test
+    def test_stream_events(self):
+        chunks = []
+        response = self.http_client.fetch(
+            self.get_url(self.API_BASE + "/events?staging_order_id=1"),
+            streaming_callback=chunks.append,
+            request_timeout=1)
+
+        while not self.order_event_service.subscriptions:
+            yield gen.sleep(0.01)
+        self.order_event_service.publish({'type': 'staging_order', 'id': 2, 'project': 'ABC_123'})
+        self.order_event_service.publish({'type': 'staging_order', 'id': 1, 'project': 'ABC_123',
+                                          'status': 'staging_successful'})
+
+        try:
+            yield response
+        except Exception:
+            # The stream is never ended by the server
+            pass
+
+        events = b"".join(chunks).decode().strip().split("\n\n")
+        self.assertEqual(len(events), 2)
+        event_name, data = events[0].split("\n")
+        self.assertEqual(event_name, "event: staging_order")
+        self.assertEqual(json.loads(data[len("data: "):])['status'], 'staging_in_progress')
+        self.assertEqual(json.loads(events[1].split("\n")[1][len("data: "):])['status'], 'staging_successful')
+
+        # The subscription is removed once the server notices that the client has gone
+        while self.order_event_service.subscriptions:
+            yield gen.sleep(0.01)
+
+    def test_invalid_order_id(self):
+        response = self.fetch(self.API_BASE + "/events?delivery_order_id=foo")
+        self.assertEqual(response.code, 400)
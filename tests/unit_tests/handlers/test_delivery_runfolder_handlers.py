@@ -28,8 +28,11 @@ class TestRunfolderHandlers(AsyncHTTPTestCase):
 
         response = self.fetch(self.API_BASE + "/runfolders")
 
-        expected_result = list([runfolder.__dict__ for runfolder in FAKE_RUNFOLDERS])
-        expected_json = json.dumps({"runfolders": expected_result}, default=lambda x: x.__dict__)
+        def _public_attributes(x):
+            return {k: v for k, v in x.__dict__.items() if not k.startswith("_")}
+
+        expected_result = list([_public_attributes(runfolder) for runfolder in FAKE_RUNFOLDERS])
+        expected_json = json.dumps({"runfolders": expected_result}, default=_public_attributes)
 
         self.assertEqual(response.code, 200)
         self.assertDictEqual(json.loads(response.body), json.loads(expected_json))
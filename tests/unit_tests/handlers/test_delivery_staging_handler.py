@@ -1,5 +1,9 @@
+import json
+
 from mock import MagicMock
 
+from tornado.gen import coroutine
+
 from tornado.testing import *
 from tornado.web import Application
 
@@ -15,10 +19,20 @@ class TestStagingHandlers(AsyncHTTPTestCase):
     mock_runfolder_repo = MagicMock()
 
     def get_app(self):
+        self.mock_delivery_service = MagicMock()
+        self.mock_delivery_service.deliver_single_runfolder.return_value = {}
+        self.mock_delivery_service.deliver_arbitrary_directory_project.return_value = {}
+
+        @coroutine
+        def deliver_all_runfolders_for_project(project_id, delivery_mode, **kwargs):
+            return {}, []
+        self.mock_delivery_service.deliver_all_runfolders_for_project.side_effect = \
+            deliver_all_runfolders_for_project
         return Application(
             routes(
                 config=DummyConfig(),
-                runfolder_repo=self.mock_runfolder_repo))
+                runfolder_repo=self.mock_runfolder_repo,
+                delivery_service=self.mock_delivery_service))
 
     ###
     # A staging handler should:
@@ -45,3 +59,20 @@ class TestStagingHandlers(AsyncHTTPTestCase):
     # - kill the process of a staging attempt
     def test_cancel_staging_process(self):
         pass
+
+    # - only accept a positive integer as the number of rsync processes to stage with
+    def test_invalid_rsync_shards(self):
+        urls = [self.API_BASE + "/stage/runfolder/160930_ST-E00216_0111_BH37CWALXX",
+                self.API_BASE + "/stage/project/my_test_project",
+                self.API_BASE + "/stage/project/runfolders/ABC_123"]
+        for url in urls:
+            for rsync_shards in ["4", 0, -1, 2.0, True]:
+                response = self.fetch(url, method='POST',
+                                      body=json.dumps({'delivery_mode': 'BATCH', 'rsync_shards': rsync_shards}))
+                self.assertEqual(response.code, 400, msg="{} with rsync_shards: {!r}".format(url, rsync_shards))
+
+            response = self.fetch(url, method='POST', body=json.dumps({'delivery_mode': 'BATCH', 'rsync_shards': 4}))
+            self.assertEqual(response.code, 202)
+
+        self.mock_delivery_service.deliver_single_runfolder.assert_called_once_with(
+            '160930_ST-E00216_0111_BH37CWALXX', [], False, rsync_shards=4)
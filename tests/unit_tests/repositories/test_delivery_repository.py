@@ -1,4 +1,4 @@
-
+import os
 
 import unittest
 
@@ -66,8 +66,27 @@ class TestDeliveryRepository(unittest.TestCase):
         self.assertEqual(actual.delivery_project, 'snpseq00001')
         self.assertEqual(actual.delivery_status, DeliveryStatus.pending)
         self.assertEqual(actual.staging_order_id, 2)
+        self.assertEqual(actual.dds_pid, os.getpid())
 
         # Check that the object has been committed, i.e. there are no 'dirty' objects in session
         self.assertEqual(len(self.session.dirty), 0)
         order_from_session = self.session.query(DeliveryOrder).filter(DeliveryOrder.id == actual.id).one()
         self.assertEqual(order_from_session.id, actual.id)
+
+    def test_get_delivery_orders_by_status(self):
+        actual = self.delivery_repo.get_delivery_orders_by_status(DeliveryStatus.pending)
+        self.assertEqual([order.id for order in actual], [self.delivery_order_1.id])
+        self.assertEqual(self.delivery_repo.get_delivery_orders_by_status(DeliveryStatus.delivery_failed), [])
+
+    def test_claim_delivery_order(self):
+        other_instance = DeliveryOrder(id=self.delivery_order_1.id,
+                                       delivery_source='/foo/source',
+                                       delivery_project='bar',
+                                       delivery_status=DeliveryStatus.pending)
+
+        self.assertTrue(self.delivery_repo.claim_delivery_order(self.delivery_order_1,
+                                                                DeliveryStatus.delivery_failed))
+        self.session.expire_all()
+        self.assertEqual(self.delivery_order_1.delivery_status, DeliveryStatus.delivery_failed)
+        self.assertFalse(self.delivery_repo.claim_delivery_order(other_instance,
+                                                                 DeliveryStatus.delivery_failed))
@@ -74,6 +74,29 @@ class TestUnorganisedRunfolderProjectRepository(unittest.TestCase):
             for project in projects:
                 self.assertIsInstance(project, RunfolderProject)
 
+    def test_get_projects_lists_files_once(self):
+        project_paths = [project.path for project in self.runfolder.projects]
+        files_in_projects = {
+            path: [os.path.join(path, "Sample_1", "file.fastq.gz"), os.path.join(path, "report.html")]
+            for path in project_paths}
+        files_in_projects[project_paths[-1]] = [os.path.join(project_paths[-1], "file.txt")]
+
+        self.filesystem_service.find_project_directories.return_value = iter(project_paths)
+        self.filesystem_service.list_files_recursively.side_effect = lambda path: iter(files_in_projects[path])
+        self.filesystem_service.dirname.side_effect = os.path.dirname
+        self.filesystem_service.exists.return_value = False
+
+        projects = self.project_repository.get_projects(self.runfolder)
+
+        # the project without fastq files is left out
+        self.assertListEqual([project.path for project in projects], project_paths[:-1])
+        self.assertEqual(self.filesystem_service.list_files_recursively.call_count, len(project_paths))
+        for project in projects:
+            self.sample_repository.get_samples.assert_any_call(
+                project, self.runfolder, files_in_project=files_in_projects[project.path])
+            # the sisyphus report is found among the files in the project
+            self.assertEqual(project.project_files[0].file_path, os.path.join(project.path, "report.html"))
+
     def test_override_log_message(self):
 
         self.filesystem_service.dirname.return_value = "foo/bar"
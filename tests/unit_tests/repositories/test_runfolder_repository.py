@@ -1,8 +1,14 @@
+import os
+import tempfile
 import unittest
 
+from mock import MagicMock
+
+from delivery.exceptions import ChecksumFileNotFoundException
 from delivery.models.runfolder import Runfolder
 from delivery.models.project import RunfolderProject
 from delivery.repositories.runfolder_repository import FileSystemBasedRunfolderRepository
+from delivery.services.file_system_service import FileSystemService
 
 from tests.test_utils import FAKE_RUNFOLDERS, mock_file_system_service, mock_metadata_service, fake_directories, \
     fake_projects
@@ -48,6 +54,34 @@ class TestRunfolderRepository(unittest.TestCase):
         self.assertIsInstance(actual_runfolder, Runfolder)
         self.assertEqual(actual_runfolder.name, runfolder_name)
 
+    def test_get_runfolder_without_listing_runfolders(self):
+        file_system_service = mock_file_system_service(fake_directories, fake_projects)
+        file_system_service.isdir.return_value = True
+        repo = FileSystemBasedRunfolderRepository(base_path="/foo",
+                                                  file_system_service=file_system_service,
+                                                  metadata_service=self.metadata_service)
+
+        actual_runfolder = repo.get_runfolder("160930_ST-E00216_0111_BH37CWALXX")
+
+        self.assertEqual(actual_runfolder.path, "/foo/160930_ST-E00216_0111_BH37CWALXX")
+        file_system_service.isdir.assert_called_once_with("/foo/160930_ST-E00216_0111_BH37CWALXX")
+        file_system_service.find_runfolder_directories.assert_not_called()
+
+    def test_get_runfolder_falls_back_to_listing_runfolders(self):
+        file_system_service = mock_file_system_service(fake_directories, fake_projects)
+        file_system_service.isdir.return_value = False
+        repo = FileSystemBasedRunfolderRepository(base_path="/foo",
+                                                  file_system_service=file_system_service,
+                                                  metadata_service=self.metadata_service)
+
+        self.assertEqual(repo.get_runfolder("160930_ST-E00216_0112_BH37CWALXX").name,
+                         "160930_ST-E00216_0112_BH37CWALXX")
+        self.assertIsNone(repo.get_runfolder("160930_ST-E00216_0113_BH37CWALXX"))
+        self.assertEqual(file_system_service.find_runfolder_directories.call_count, 2)
+
+        self.assertIsNone(repo.get_runfolder("bar"))
+        self.assertEqual(file_system_service.find_runfolder_directories.call_count, 2)
+
     def test_get_projects(self):
         actual_projects = list(self.repo.get_projects())
         self.assertTrue(len(actual_projects) == 6)
@@ -67,3 +101,131 @@ class TestRunfolderRepository(unittest.TestCase):
 
         self.assertEqual(len(actual_projects), 2)
         self.assertEqual(actual_projects, expected_projects)
+
+
+class TestRunfolderRepositoryCatalogue(unittest.TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.TemporaryDirectory()
+        self.metadata_service = mock_metadata_service()
+        self.mtime = 1000000000000000000
+        self._add_dir("160930_ST-E00216_0111_BH37CWALXX", "Projects", "ABC_123")
+
+    def tearDown(self):
+        self.base_dir.cleanup()
+
+    def _add_dir(self, *path):
+        os.makedirs(os.path.join(self.base_dir.name, *path))
+        # Modification times are set explicitly, since the file system might not be able to tell
+        # changes made right after each other apart
+        for i in range(len(path)):
+            self.mtime += 1
+            os.utime(os.path.join(self.base_dir.name, *path[:i]), ns=(self.mtime, self.mtime))
+
+    def _repo(self, file_system_service=None, **kwargs):
+        return FileSystemBasedRunfolderRepository(base_path=self.base_dir.name,
+                                                  file_system_service=file_system_service or FileSystemService(),
+                                                  metadata_service=self.metadata_service,
+                                                  **kwargs)
+
+    def _load_checksums(self, repo):
+        for runfolder in repo.get_runfolders():
+            runfolder.checksums
+
+    def test_only_modified_runfolders_are_read_again(self):
+        repo = self._repo()
+        self._add_dir("160930_ST-E00216_0112_BH37CWALXX", "Projects", "ABC_123")
+
+        self.assertEqual(len(list(repo.get_runfolders())), 2)
+        self._load_checksums(repo)
+        self.assertEqual(self.metadata_service.parse_checksum_file.call_count, 2)
+
+        self.assertEqual(len(list(repo.get_projects())), 2)
+        self._load_checksums(repo)
+        self.assertEqual(self.metadata_service.parse_checksum_file.call_count, 2)
+
+        self._add_dir("160930_ST-E00216_0112_BH37CWALXX", "Projects", "DEF_456")
+        self.assertEqual(len(list(repo.get_projects())), 3)
+        self._load_checksums(repo)
+        self.assertEqual(self.metadata_service.parse_checksum_file.call_count, 3)
+
+        self._add_dir("160930_ST-E00216_0113_BH37CWALXX", "Projects", "DEF_456")
+        self.assertEqual(
+            sorted(project.runfolder_name for project in repo.get_project("DEF_456")),
+            ["160930_ST-E00216_0112_BH37CWALXX", "160930_ST-E00216_0113_BH37CWALXX"])
+        self._load_checksums(repo)
+        self.assertEqual(self.metadata_service.parse_checksum_file.call_count, 4)
+
+    def test_checksums_are_loaded_when_needed(self):
+        self.metadata_service.parse_checksum_file.return_value = {"foo.fastq.gz": "abc"}
+        repo = self._repo()
+
+        runfolders = list(repo.get_runfolders())
+        self.metadata_service.parse_checksum_file.assert_not_called()
+
+        self.assertEqual(runfolders[0].checksums, {"foo.fastq.gz": "abc"})
+        self.assertEqual(runfolders[0].checksums, {"foo.fastq.gz": "abc"})
+        self.metadata_service.parse_checksum_file.assert_called_once()
+
+    def test_get_runfolder_without_checksum_file(self):
+        with self.assertRaises(ChecksumFileNotFoundException):
+            self._repo().get_runfolder("160930_ST-E00216_0111_BH37CWALXX")
+
+    def test_listings_are_answered_from_catalogue_if_refreshed_in_background(self):
+        repo = self._repo(catalogue_refresh_interval=60)
+        # Nothing is listed until the catalogue has been built in the background
+        self.assertEqual(list(repo.get_runfolders()), [])
+        repo.refresh_catalogue()
+        self.assertEqual(len(list(repo.get_runfolders())), 1)
+
+        self._add_dir("160930_ST-E00216_0112_BH37CWALXX", "Projects", "ABC_123")
+        self.assertEqual(len(list(repo.get_runfolders())), 1)
+        self.assertEqual(len(list(repo.get_projects())), 1)
+
+        # Projects looked up to be delivered are found in every runfolder, even the ones added since
+        self.assertEqual(len(list(repo.get_project("ABC_123"))), 2)
+        self.assertEqual(len(list(repo.get_runfolders())), 2)
+
+        self._add_dir("160930_ST-E00216_0112_BH37CWALXX", "Projects", "DEF_456")
+        self.assertEqual(len(list(repo.get_project("DEF_456"))), 1)
+
+    def test_project_index_is_updated(self):
+        repo = self._repo()
+        self._add_dir("160930_ST-E00216_0112_BH37CWALXX", "Projects", "ABC_123")
+        self.assertEqual(len(list(repo.get_project("ABC_123"))), 2)
+
+        os.rmdir(os.path.join(self.base_dir.name, "160930_ST-E00216_0111_BH37CWALXX", "Projects", "ABC_123"))
+        self.mtime += 1
+        os.utime(os.path.join(self.base_dir.name, "160930_ST-E00216_0111_BH37CWALXX", "Projects"),
+                 ns=(self.mtime, self.mtime))
+
+        self.assertEqual([project.runfolder_name for project in repo.get_project("ABC_123")],
+                         ["160930_ST-E00216_0112_BH37CWALXX"])
+        self.assertEqual(list(repo.get_project("DEF_456")), [])
+
+    def test_unmodified_runfolders_are_only_checked_to_get_a_project(self):
+        self._add_dir("160930_ST-E00216_0112_BH37CWALXX", "Projects", "DEF_456")
+        file_system_service = FileSystemService()
+        file_system_service.mtime = MagicMock(wraps=FileSystemService.mtime)
+        repo = self._repo(catalogue_refresh_interval=60, file_system_service=file_system_service)
+        repo.refresh_catalogue()
+        self._load_checksums(repo)
+
+        file_system_service.mtime.reset_mock()
+        self.assertEqual(len(list(repo.get_project("ABC_123"))), 1)
+        self.assertEqual(list(repo.get_project("GHI_789")), [])
+        # The runfolder directory, and the runfolder, projects directory and checksum file of each runfolder
+        self.assertEqual(file_system_service.mtime.call_count, 2 * (1 + 2 * 3))
+        self._load_checksums(repo)
+        self.assertEqual(self.metadata_service.parse_checksum_file.call_count, 2)
+
+    def test_project_added_to_an_already_catalogued_runfolder(self):
+        self._add_dir("160930_ST-E00216_0112_BH37CWALXX")
+        repo = self._repo(catalogue_refresh_interval=60)
+        repo.refresh_catalogue()
+        self.assertEqual(len(list(repo.get_project("ABC_123"))), 1)
+
+        self._add_dir("160930_ST-E00216_0112_BH37CWALXX", "Projects", "ABC_123")
+        self.assertEqual(
+            sorted(project.runfolder_name for project in repo.get_project("ABC_123")),
+            ["160930_ST-E00216_0111_BH37CWALXX", "160930_ST-E00216_0112_BH37CWALXX"])
@@ -1,3 +1,4 @@
+import os
 
 
 import unittest
@@ -6,7 +7,7 @@ from mock import create_autospec
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-from delivery.models.db_models import SQLAlchemyBase, StagingOrder, StagingStatus
+from delivery.models.db_models import SQLAlchemyBase, StagingOrder, StagingStatus, DeliverySource
 from delivery.repositories.staging_repository import DatabaseBasedStagingRepository
 from delivery.services.file_system_service import FileSystemService
 
@@ -52,6 +53,65 @@ class TestStagingRepository(unittest.TestCase):
         actual = self.staging_repo.get_staging_order_by_id(self.staging_order_1.id)
         self.assertEqual(self.staging_order_1.id, actual.id)
 
+    # - get staging orders by status
+    def test_get_staging_orders_by_status(self):
+        actual = self.staging_repo.get_staging_orders_by_status(StagingStatus.pending)
+        self.assertEqual([self.staging_order_1.id], [order.id for order in actual])
+
+        actual = self.staging_repo.get_staging_orders_by_status(StagingStatus.staging_in_progress)
+        self.assertEqual(actual, [])
+
+    # - claim a staging order, provided that nobody else has done so first
+    def test_claim_staging_order(self):
+        self.staging_order_1.pid = 123
+        self.session.commit()
+        other_instance = StagingOrder(id=self.staging_order_1.id,
+                                      source='foo',
+                                      status=StagingStatus.pending,
+                                      pid=123)
+
+        self.assertTrue(self.staging_repo.claim_staging_order(self.staging_order_1,
+                                                              StagingStatus.staging_in_progress))
+        self.session.expire_all()
+        self.assertEqual(self.staging_order_1.status, StagingStatus.staging_in_progress)
+        # The order is now owned by the claiming process
+        self.assertEqual(self.staging_order_1.pid, os.getpid())
+        self.assertFalse(self.staging_repo.claim_staging_order(other_instance,
+                                                               StagingStatus.staging_in_progress))
+
+        # A new pid means that someone else has restarted the order
+        other_instance.status = StagingStatus.staging_in_progress
+        self.assertFalse(self.staging_repo.claim_staging_order(other_instance, StagingStatus.pending))
+        self.session.expire_all()
+        self.assertEqual(self.staging_order_1.status, StagingStatus.staging_in_progress)
+
+    # - get the last successful staging order of a batch of a project
+    def test_get_last_successful_batch_staging_order(self):
+        self.assertIsNone(self.staging_repo.get_last_successful_batch_staging_order('ABC_123'))
+
+        for batch_nbr, status in [(1, StagingStatus.staging_successful),
+                                  (2, StagingStatus.staging_successful),
+                                  (3, StagingStatus.staging_failed)]:
+            links_directory = '/links/ABC_123/{}'.format(batch_nbr)
+            self.session.add(DeliverySource(project_name='ABC_123',
+                                            source_name='ABC_123/batch{}'.format(batch_nbr),
+                                            path=links_directory,
+                                            batch=batch_nbr))
+            self.session.add(StagingOrder(source=links_directory,
+                                          status=status,
+                                          staging_target='/staging/{}/ABC_123'.format(batch_nbr)))
+        self.session.add(DeliverySource(project_name='ABC_123',
+                                        source_name='runfolder/ABC_123',
+                                        path='/runfolder/Projects/ABC_123'))
+        self.session.add(StagingOrder(source='/runfolder/Projects/ABC_123',
+                                      status=StagingStatus.staging_successful,
+                                      staging_target='/staging/4/ABC_123'))
+        self.session.commit()
+
+        actual = self.staging_repo.get_last_successful_batch_staging_order('ABC_123')
+        self.assertEqual(actual.staging_target, '/staging/2/ABC_123')
+        self.assertIsNone(self.staging_repo.get_last_successful_batch_staging_order('DEF_456'))
+
     # - create a new staging_order and persist it to the db
     def test_create_staging_order(self):
         order = self.staging_repo.create_staging_order(source='/foo',
@@ -1,4 +1,5 @@
 import json
+import os
 import random
 import tempfile
 from mock import MagicMock, AsyncMock, create_autospec, patch, call
@@ -7,7 +8,7 @@ from tornado.testing import AsyncTestCase, gen_test
 from tornado.gen import coroutine
 
 from delivery.services.external_program_service import ExternalProgramService
-from delivery.services.dds_service import DDSService
+from delivery.services.dds_service import DDSService, DDSUploadMonitor
 from delivery.models.db_models import DeliveryOrder, StagingOrder, StagingStatus, DeliveryStatus
 from delivery.models.execution import ExecutionResult, Execution
 from delivery.models.project import DDSProject
@@ -27,7 +28,7 @@ class TestDDSService(AsyncTestCase):
         self.mock_dds_runner.run.return_value = mock_execution
 
         @coroutine
-        def wait_as_coroutine(x):
+        def wait_as_coroutine(x, **kwargs):
             return ExecutionResult(
                     stdout="",
                     stderr="",
@@ -35,6 +36,12 @@ class TestDDSService(AsyncTestCase):
 
         self.mock_dds_runner.wait_for_execution = wait_as_coroutine
 
+        @coroutine
+        def run_in_pool_as_coroutine(cmd, pool, **kwargs):
+            return self.mock_dds_runner.run(cmd)
+
+        self.mock_dds_runner.run_in_pool = run_in_pool_as_coroutine
+
         self.mock_staging_service = MagicMock()
         self.mock_delivery_repo = MagicMock()
 
@@ -116,7 +123,7 @@ class TestDDSService(AsyncTestCase):
                     call([
                         'dds',
                         '--token-path', self.token_file.name,
-                        '--log-file', '/foo/bar/log',
+                        '--log-file', '/foo/bar/log.delivery_1',
                         '--no-prompt',
                         'data', 'put',
                         '--mount-dir', '/foo/bar/staging_dir',
@@ -181,7 +188,7 @@ class TestDDSService(AsyncTestCase):
                 self.mock_dds_runner.run.assert_called_once_with([
                         'dds',
                         '--token-path', self.token_file.name,
-                        '--log-file', '/foo/bar/log',
+                        '--log-file', '/foo/bar/log.delivery_1',
                         '--no-prompt',
                         'data', 'put',
                         '--mount-dir', '/foo/bar/staging_dir',
@@ -190,6 +197,199 @@ class TestDDSService(AsyncTestCase):
                         '--silent'
                         ])
 
+    @gen_test
+    def test_dds_put_many(self):
+        project_id = 'snpseq00001'
+        staging_orders = {
+                1: StagingOrder(id=1, source='/foo/bar', staging_target='/staging/dir/bar',
+                                status=StagingStatus.staging_successful),
+                2: StagingOrder(id=2, source='/foo/baz', staging_target='/staging/dir/baz',
+                                status=StagingStatus.staging_successful),
+                }
+        self.mock_staging_service.get_stage_order_by_id.side_effect = staging_orders.get
+
+        delivery_orders = []
+
+        def _create_delivery_order(**kwargs):
+            delivery_order = DeliveryOrder(id=len(delivery_orders) + 10, **kwargs)
+            delivery_orders.append(delivery_order)
+            return delivery_order
+
+        self.mock_delivery_repo.create_delivery_order.side_effect = _create_delivery_order
+
+        dds_project = DDSProject(
+                dds_service=self.dds_service,
+                auth_token=self.token_file.name,
+                dds_project_id=project_id)
+
+        with patch('shutil.rmtree') as mock_rmtree, \
+                patch('delivery.models.project.DDSProject.get_ngi_project_name',
+                      new_callable=AsyncMock, return_value='AB-1234'):
+            delivery_order_ids = yield dds_project.put_many([1, 2], deadline='90')
+
+            assert_eventually_equals(
+                    self, 1,
+                    lambda: [delivery_order.delivery_status for delivery_order in delivery_orders],
+                    [DeliveryStatus.delivery_successful] * 2)
+
+            self.assertEqual(delivery_order_ids, [10, 11])
+            self.assertEqual([delivery_order.staging_order_id for delivery_order in delivery_orders], [1, 2])
+            base_cmd = [
+                    'dds',
+                    '--token-path', self.token_file.name,
+                    '--log-file', '/foo/bar/log',
+                    '--no-prompt',
+                    ]
+            # One upload for both staging orders, and a single release
+            upload_cmd = base_cmd[:]
+            upload_cmd[upload_cmd.index('--log-file') + 1] = '/foo/bar/log.delivery_10'
+            self.assertEqual(self.mock_dds_runner.run.call_args_list, [
+                    call(upload_cmd + [
+                        'data', 'put',
+                        '--mount-dir', '/foo/bar/staging_dir',
+                        '--source', '/staging/dir/bar',
+                        '--source', '/staging/dir/baz',
+                        '--project', project_id,
+                        '--silent'
+                        ]),
+                    call(base_cmd + [
+                        'project', 'status', 'release',
+                        '--project', project_id,
+                        '--no-mail',
+                        '--deadline', '90',
+                        ]),
+                    ])
+            mock_rmtree.assert_has_calls([call('/staging/dir/bar'), call('/staging/dir/baz')])
+
+    @gen_test
+    def test_dds_put_many_raises_on_non_successful_stage_id(self):
+        self.mock_staging_service.get_stage_order_by_id.side_effect = {
+                1: StagingOrder(id=1, status=StagingStatus.staging_successful),
+                2: StagingOrder(id=2, status=StagingStatus.staging_failed),
+                }.get
+
+        dds_project = DDSProject(
+                dds_service=self.dds_service,
+                auth_token=self.token_file.name,
+                dds_project_id='snpseq00001')
+
+        with self.assertRaises(InvalidStatusException):
+            yield dds_project.put_many([1, 2])
+
+        self.mock_delivery_repo.create_delivery_order.assert_not_called()
+
+    def test_get_upload_threads(self):
+        gigabyte = 1024 ** 3
+        self.assertIsNone(self.dds_service.get_upload_threads([StagingOrder(size=100 * gigabyte)]))
+
+        self.dds_service.dds_conf.update({
+                'min_upload_threads': 2,
+                'max_upload_threads': 8,
+                'upload_bytes_per_thread': 10 * gigabyte,
+                })
+
+        # Small deliveries get the minimum number of threads
+        self.assertEqual(
+                self.dds_service.get_upload_threads([StagingOrder(size=gigabyte, files_transferred=100)]), 2)
+        # One thread per 10 GB, summed over the staging orders
+        self.assertEqual(
+                self.dds_service.get_upload_threads([StagingOrder(size=25 * gigabyte, files_transferred=100),
+                                                     StagingOrder(size=20 * gigabyte, files_transferred=100)]), 5)
+        # ... but no more than the maximum
+        self.assertEqual(
+                self.dds_service.get_upload_threads([StagingOrder(size=5000 * gigabyte, files_transferred=100)]), 8)
+        # ... or the number of files
+        self.assertEqual(
+                self.dds_service.get_upload_threads([StagingOrder(size=50 * gigabyte, files_transferred=3)]), 3)
+        # The number of files is not known when the data was linked into place
+        self.assertEqual(
+                self.dds_service.get_upload_threads([StagingOrder(size=50 * gigabyte, files_transferred=3),
+                                                     StagingOrder(size=50 * gigabyte)]), 8)
+
+    @gen_test
+    def test_dds_put_with_upload_threads(self):
+        staging_order = StagingOrder(source='/foo/bar', staging_target='/staging/dir/bar', size=1024,
+                                     status=StagingStatus.staging_successful)
+        self.mock_staging_service.get_stage_order_by_id.return_value = staging_order
+        self.dds_service.dds_conf['max_upload_threads'] = 8
+
+        dds_project = DDSProject(
+                dds_service=self.dds_service,
+                auth_token=self.token_file.name,
+                dds_project_id='snpseq00001')
+
+        with patch('delivery.models.project.DDSProject._run_delivery') as mock_run_delivery, \
+                patch('delivery.models.project.DDSProject.get_ngi_project_name',
+                      new_callable=AsyncMock, return_value='AB-1234'):
+            yield dds_project.put(staging_id=1)
+
+        cmd = mock_run_delivery.call_args[0][0]
+        self.assertEqual(cmd[-2:], ['--num-threads', '1'])
+
+    def _deliver_with_status_codes(self, status_codes):
+        staging_order = StagingOrder(source='/foo/bar', staging_target='/staging/dir/bar',
+                                     status=StagingStatus.staging_successful)
+        self.dds_service.upload_retries = 2
+        self.dds_service.upload_retry_backoff = 0
+
+        results = iter(status_codes)
+
+        @coroutine
+        def wait_as_coroutine(x, **kwargs):
+            return ExecutionResult(stdout="", stderr="", status_code=next(results))
+
+        self.mock_dds_runner.wait_for_execution = wait_as_coroutine
+
+        dds_project = DDSProject(
+                dds_service=self.dds_service,
+                auth_token=self.token_file.name,
+                dds_project_id='snpseq00001')
+
+        return dds_project._run_delivery(
+                ['dds', 'data', 'put'],
+                [self.delivery_order],
+                [staging_order],
+                '/foo/bar/log.delivery_1',
+                release=False)
+
+    @gen_test
+    def test_dds_put_is_retried(self):
+        with patch('shutil.rmtree') as mock_rmtree:
+            yield self._deliver_with_status_codes([1, 0])
+            mock_rmtree.assert_called_once_with('/staging/dir/bar')
+
+        self.assertEqual(self.delivery_order.delivery_status, DeliveryStatus.delivery_successful)
+        self.assertEqual(self.mock_dds_runner.run.call_count, 2)
+        self.assertEqual(self.delivery_order.delivery_attempts, 2)
+        attempt_timings = json.loads(self.delivery_order.attempt_timings)
+        self.assertEqual([attempt['status_code'] for attempt in attempt_timings], [1, 0])
+
+    @gen_test
+    def test_dds_put_is_pending_while_waiting_to_retry(self):
+        waiting = []
+
+        @coroutine
+        def record_while_waiting(backoff):
+            waiting.append((self.delivery_order.delivery_status, self.delivery_order.dds_pid))
+
+        with patch('shutil.rmtree'), \
+                patch('delivery.models.project.gen.sleep', side_effect=record_while_waiting):
+            yield self._deliver_with_status_codes([1, 0])
+
+        self.assertEqual(waiting, [(DeliveryStatus.pending, os.getpid())])
+        self.assertEqual(self.delivery_order.delivery_status, DeliveryStatus.delivery_successful)
+
+    @gen_test
+    def test_dds_put_fails_after_last_retry(self):
+        with patch('shutil.rmtree') as mock_rmtree:
+            with self.assertRaises(RuntimeError):
+                yield self._deliver_with_status_codes([1, 1, 1])
+            mock_rmtree.assert_not_called()
+
+        self.assertEqual(self.delivery_order.delivery_status, DeliveryStatus.delivery_failed)
+        self.assertEqual(self.mock_dds_runner.run.call_count, 3)
+        self.assertEqual(self.delivery_order.delivery_attempts, 3)
+
     def test_dds_project_with_token_string(self):
         expected_token_string = "supersecretstring"
 
@@ -383,3 +583,197 @@ project"""
 
             ngi_project_name = yield dds_project.get_ngi_project_name()
             self.assertEqual(ngi_project_name, "AB-1234")
+
+    @gen_test
+    def test_get_dds_project_title_is_cached(self):
+        mock_dds_projects = [
+                {"Project ID": "snpseq00024", "Title": "AB1233"},
+                {"Project ID": "snpseq00025", "Title": "AB1234"},
+                ]
+
+        with patch(
+                'delivery.models.project.DDSProject._run',
+                new_callable=AsyncMock,
+                return_value=json.dumps(mock_dds_projects),
+                ) as mock_run:
+            ngi_project_names = []
+            for project_id in ["snpseq00025", "snpseq00024", "snpseq00025"]:
+                dds_project = DDSProject(
+                        dds_service=self.dds_service,
+                        auth_token=self.token_file.name,
+                        dds_project_id=project_id,
+                        )
+                ngi_project_name = yield dds_project.get_ngi_project_name()
+                ngi_project_names.append(ngi_project_name)
+
+            self.assertEqual(ngi_project_names, ["AB-1234", "AB-1233", "AB-1234"])
+            mock_run.assert_called_once()
+
+            # The name is not given to someone with another token, who might not have access to the project
+            dds_project = DDSProject(
+                    dds_service=self.dds_service,
+                    auth_token="another token",
+                    dds_project_id="snpseq00025",
+                    )
+            yield dds_project.get_ngi_project_name()
+            self.assertEqual(mock_run.call_count, 2)
+
+            # Once expired, the projects are listed again
+            self.dds_service.project_name_cache_ttl = 0
+            dds_project = DDSProject(
+                    dds_service=self.dds_service,
+                    auth_token=self.token_file.name,
+                    dds_project_id="snpseq00025",
+                    )
+            self.dds_service.cache_ngi_project_name(dds_project._token_digest, "snpseq00025", "AB-1234")
+            yield dds_project.get_ngi_project_name()
+            self.assertEqual(mock_run.call_count, 3)
+
+    @gen_test
+    def test_create_project_caches_ngi_project_name(self):
+        self.dds_service.dds_client = MagicMock()
+        self.dds_service.dds_client.create_project = AsyncMock(return_value="snpseq00001")
+
+        dds_project = yield DDSProject.new(
+                "AA-1221",
+                {"description": "Dummy project", "pi": "alex@doe.com"},
+                auth_token=self.token_file.name,
+                dds_service=self.dds_service)
+
+        self.assertEqual(
+            self.dds_service.get_cached_ngi_project_name(dds_project._token_digest, "snpseq00001"), "AA-1221")
+
+    @gen_test
+    def test_create_and_release_project_with_dds_client(self):
+        self.dds_service.dds_client = MagicMock()
+        self.dds_service.dds_client.create_project = AsyncMock(return_value="snpseq00001")
+        self.dds_service.dds_client.release_project = AsyncMock()
+        project_metadata = {
+                "description": "Dummy project",
+                "pi": "alex@doe.com",
+                "owners": ["alex@doe.com"],
+                }
+
+        dds_project = yield DDSProject.new(
+                "AA-1221",
+                project_metadata,
+                auth_token=self.token_file.name,
+                dds_service=self.dds_service)
+        yield dds_project.release(deadline='90')
+
+        self.assertEqual(dds_project.project_id, "snpseq00001")
+        self.dds_service.dds_client.create_project.assert_called_once_with(
+                token_path=self.token_file.name,
+                title="AA1221",
+                description="Dummy project",
+                pi="alex@doe.com",
+                owners=["alex@doe.com"],
+                researchers=[],
+                non_sensitive=False)
+        self.dds_service.dds_client.release_project.assert_called_once_with(
+                self.token_file.name, "snpseq00001", deadline='90')
+        self.mock_dds_runner.run.assert_not_called()
+
+    @gen_test
+    def test_get_dds_project_title_with_dds_client(self):
+        self.dds_service.dds_client = MagicMock()
+        self.dds_service.dds_client.list_projects = AsyncMock(return_value=[
+                {"Project ID": "snpseq00024", "Title": "AB1233"},
+                {"Project ID": "snpseq00025", "Title": "AB1234"},
+                ])
+        dds_project = DDSProject(
+                dds_service=self.dds_service,
+                auth_token=self.token_file.name,
+                dds_project_id="snpseq00025",
+                )
+
+        ngi_project_name = yield dds_project.get_ngi_project_name()
+
+        self.assertEqual(ngi_project_name, "AB-1234")
+        self.mock_dds_runner.run.assert_not_called()
+
+    def test_upload_monitor(self):
+        with tempfile.TemporaryDirectory() as staging_dir, \
+                tempfile.NamedTemporaryFile(mode='w') as upload_log:
+            source = os.path.join(staging_dir, 'ABC_123')
+            os.mkdir(source)
+            for name, size in [('a.fastq.gz', 100), ('b.fastq.gz', 200)]:
+                with open(os.path.join(source, name), 'wb') as f:
+                    f.write(b'0' * size)
+            monitor = DDSUploadMonitor(
+                pid=os.getpid(), log_path=upload_log.name, total_size=10 ** 15, source_directories=[source])
+
+            upload_log.write("File successfully uploaded and added to the database: ABC_123/a.fastq.gz\n"
+                             "Some other message\n"
+                             "File successfully uploaded and added to the da")
+            upload_log.flush()
+            monitor.update()
+            self.assertEqual(monitor.files_uploaded, 1)
+            self.assertEqual(monitor.bytes_uploaded, 100)
+            self.assertIsNone(monitor.eta)
+
+            upload_log.write("tabase: ABC_123/b.fastq.gz\n"
+                             "File successfully uploaded and added to the database: ABC_123/a.fastq.gz\n")
+            upload_log.flush()
+            monitor.update()
+            self.assertEqual(monitor.files_uploaded, 2)
+            self.assertEqual(monitor.bytes_uploaded, 300)
+            self.assertIsNotNone(monitor.eta)
+
+            delivery_order = DeliveryOrder()
+            monitor.store_on(delivery_order)
+            self.assertEqual(delivery_order.files_uploaded, 2)
+            self.assertEqual(delivery_order.bytes_uploaded, 300)
+
+            # If the size of an uploaded file is not known, the bytes read by dds are used as an estimate,
+            # which can not be more than the size of the delivery
+            upload_log.write("File successfully uploaded and added to the database: ABC_123/c.fastq.gz\n")
+            upload_log.flush()
+            monitor.total_size = 301
+            monitor.update()
+            self.assertEqual(monitor.files_uploaded, 3)
+            self.assertEqual(monitor.bytes_uploaded, 301)
+
+        # Nothing has been uploaded until dds has logged it
+        monitor = DDSUploadMonitor(pid=os.getpid(), log_path="/does/not/exist", total_size=1)
+        monitor.update()
+        self.assertEqual(monitor.bytes_uploaded, 0)
+        self.assertEqual(monitor.files_uploaded, 0)
+
+    def test_upload_log_is_added_to_dds_log(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            self.dds_service.dds_conf['log_path'] = os.path.join(log_dir, 'dds.log')
+            upload_log_path = os.path.join(log_dir, 'dds.log.delivery_1')
+            with open(self.dds_service.dds_conf['log_path'], 'w') as dds_log:
+                dds_log.write("before\n")
+            with open(upload_log_path, 'w') as upload_log:
+                upload_log.write("upload\n")
+
+            dds_project = DDSProject(
+                    dds_service=self.dds_service,
+                    auth_token=self.token_file.name,
+                    dds_project_id='snpseq00001')
+            dds_project._append_upload_log(upload_log_path)
+
+            with open(self.dds_service.dds_conf['log_path']) as dds_log:
+                self.assertEqual(dds_log.read(), "before\nupload\n")
+            self.assertFalse(os.path.exists(upload_log_path))
+
+    def test_recover_orphaned_delivery_orders(self):
+        running = DeliveryOrder(id=2, delivery_status=DeliveryStatus.delivery_in_progress, dds_pid=123)
+        orphaned = DeliveryOrder(id=3, delivery_status=DeliveryStatus.delivery_in_progress, dds_pid=456)
+        without_pid = DeliveryOrder(id=4, delivery_status=DeliveryStatus.delivery_in_progress)
+        queued = DeliveryOrder(id=5, delivery_status=DeliveryStatus.pending, dds_pid=321)
+        orphaned_in_queue = DeliveryOrder(id=6, delivery_status=DeliveryStatus.pending, dds_pid=654)
+        self.mock_delivery_repo.get_delivery_orders_by_status.side_effect = lambda status: {
+            DeliveryStatus.pending: [queued, orphaned_in_queue],
+            DeliveryStatus.delivery_in_progress: [running, orphaned, without_pid]}[status]
+        self.mock_dds_runner.is_running.side_effect = lambda pid: pid in (123, 321)
+
+        self.dds_service.recover_orphaned_delivery_orders()
+
+        self.assertEqual(
+            self.mock_delivery_repo.claim_delivery_order.call_args_list,
+            [call(orphaned_in_queue, DeliveryStatus.delivery_failed),
+             call(orphaned, DeliveryStatus.delivery_failed)])
+
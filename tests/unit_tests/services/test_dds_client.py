@@ -0,0 +1,103 @@
+import tempfile
+
+from mock import patch
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from delivery.services.dds_client import DDSClient
+
+
+class TestDDSClient(AsyncTestCase):
+
+    def setUp(self):
+        self.dds_client = DDSClient(max_workers=1)
+        self.token_file = tempfile.NamedTemporaryFile(mode='w')
+        self.token_file.write("token")
+        self.token_file.flush()
+        super(TestDDSClient, self).setUp()
+
+    def tearDown(self):
+        self.token_file.close()
+        super(TestDDSClient, self).tearDown()
+
+    @gen_test
+    def test_create_project(self):
+        with patch('delivery.services.dds_client.ProjectCreator') as mock_project_creator:
+            creator = mock_project_creator.return_value
+            creator.create_project.return_value = (True, "snpseq00001", [], None)
+
+            project_id = yield self.dds_client.create_project(
+                self.token_file.name, "AA1221", "Dummy project", "alex@doe.com",
+                owners=["alex@doe.com"], researchers=["robin@doe.com"])
+
+        self.assertEqual(project_id, "snpseq00001")
+        mock_project_creator.assert_called_once_with(no_prompt=True, token_path=self.token_file.name)
+        creator.create_project.assert_called_once_with(
+            title="AA1221",
+            description="Dummy project",
+            principal_investigator="alex@doe.com",
+            non_sensitive=False,
+            users_to_add=[{"email": "alex@doe.com", "role": "Project Owner"},
+                          {"email": "robin@doe.com", "role": "Researcher"}])
+
+    @gen_test
+    def test_create_project_fails(self):
+        with patch('delivery.services.dds_client.ProjectCreator') as mock_project_creator:
+            creator = mock_project_creator.return_value
+            creator.create_project.return_value = (False, None, [], "Title already in use")
+
+            with self.assertRaises(RuntimeError):
+                yield self.dds_client.create_project(self.token_file.name, "AA1221", "Dummy project",
+                                                     "alex@doe.com")
+
+    @gen_test
+    def test_list_projects(self):
+        projects = [{"Project ID": "snpseq00025", "Title": "AB1234"}]
+        with patch('delivery.services.dds_client.DataLister') as mock_data_lister:
+            mock_data_lister.return_value.list_projects.return_value = projects
+
+            result = yield self.dds_client.list_projects(self.token_file.name)
+
+        self.assertEqual(result, projects)
+        mock_data_lister.assert_called_once_with(no_prompt=True, json=True, token_path=self.token_file.name)
+
+    @gen_test
+    def test_clients_are_reused_per_token(self):
+        with patch('delivery.services.dds_client.DataLister') as mock_data_lister:
+            mock_data_lister.return_value.list_projects.return_value = []
+
+            yield self.dds_client.list_projects(self.token_file.name)
+            # The same token written to another file, like a token given as a string is
+            with tempfile.NamedTemporaryFile(mode='w') as same_token_file:
+                same_token_file.write("token")
+                same_token_file.flush()
+                yield self.dds_client.list_projects(same_token_file.name)
+            self.assertEqual(mock_data_lister.call_count, 1)
+
+            with tempfile.NamedTemporaryFile() as other_token_file:
+                yield self.dds_client.list_projects(other_token_file.name)
+            self.assertEqual(mock_data_lister.call_count, 2)
+            self.assertEqual(len(self.dds_client._clients), 2)
+
+            self.assertEqual(mock_data_lister.return_value.list_projects.call_count, 3)
+
+    @gen_test
+    def test_expired_clients_are_dropped(self):
+        dds_client = DDSClient(max_workers=1, client_ttl=0)
+        with patch('delivery.services.dds_client.DataLister') as mock_data_lister:
+            mock_data_lister.return_value.list_projects.return_value = []
+
+            yield dds_client.list_projects(self.token_file.name)
+            yield dds_client.list_projects(self.token_file.name)
+
+            self.assertEqual(mock_data_lister.call_count, 2)
+            self.assertEqual(len(dds_client._clients), 1)
+
+    @gen_test
+    def test_release_project(self):
+        with patch('delivery.services.dds_client.ProjectStatusManager') as mock_status_manager:
+            yield self.dds_client.release_project("/foo/token", "snpseq00001", deadline="90")
+
+        mock_status_manager.assert_called_once_with(project="snpseq00001", no_prompt=True, token_path="/foo/token")
+        mock_status_manager.return_value.__enter__.return_value.update_status.assert_called_once_with(
+            new_status="Available", deadline=90, no_mail=True)
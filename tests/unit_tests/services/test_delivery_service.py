@@ -4,6 +4,8 @@ import mock
 import tempfile
 import os
 
+from tornado.testing import AsyncTestCase, gen_test
+
 from delivery.exceptions import ProjectAlreadyDeliveredException
 
 from delivery.models.project import RunfolderProject, GeneralProject
@@ -18,7 +20,7 @@ from delivery.services.runfolder_service import RunfolderService
 from delivery.repositories.delivery_sources_repository import DatabaseBasedDeliverySourcesRepository
 from delivery.repositories.project_repository import GeneralProjectRepository
 
-class TestDeliveryService(unittest.TestCase):
+class TestDeliveryService(AsyncTestCase):
 
     runfolder_projects = [
             RunfolderProject(
@@ -62,6 +64,7 @@ class TestDeliveryService(unittest.TestCase):
                 project_links_directory=self.project_links_dir)
 
     def setUp(self):
+        super(TestDeliveryService, self).setUp()
         self._compose_delivery_service()
 
     def test__create_links_area_for_project_runfolders(self):
@@ -224,6 +227,7 @@ class TestDeliveryService(unittest.TestCase):
                                                                 force_delivery=True)
         self.assertEqual(result["ABC_123"], 1)
 
+    @gen_test
     def test_deliver_all_runfolders_for_project(self):
         with tempfile.TemporaryDirectory() as tmpdirname:
 
@@ -258,7 +262,7 @@ class TestDeliveryService(unittest.TestCase):
                                            project_links_dir=tmpdirname)
 
             projects_and_ids, projects = \
-                self.delivery_service.deliver_all_runfolders_for_project(project_name="ABC_123",
+                yield self.delivery_service.deliver_all_runfolders_for_project(project_name="ABC_123",
                                                                          mode=DeliveryMode.CLEAN)
 
             self.assertEqual(projects_and_ids["ABC_123"], 1)
@@ -269,6 +273,46 @@ class TestDeliveryService(unittest.TestCase):
                 paths.append(item['path'])
             self.assertEqual(paths,["/foo/160930_ST-E00216_0112_BH37CWALXX/Projects/ABC_123",
                                     "/foo/160930_ST-E00216_0111_BH37CWALXX/Projects/ABC_123"])
+            staging_service_mock.get_incremental_staging_reference.assert_not_called()
+            self.assertIsNone(staging_service_mock.create_new_stage_order.call_args[1]["link_dest"])
+
+    @gen_test
+    def test_deliver_all_runfolders_for_project_incrementally(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+
+            staging_service_mock = mock.create_autospec(StagingService)
+            staging_service_mock.create_new_stage_order.return_value = \
+                StagingOrder(id=2,
+                             source=os.path.join(tmpdirname, "ABC_123", "2"),
+                             status=StagingStatus.pending,
+                             staging_target='/foo/bar')
+            staging_service_mock.get_incremental_staging_reference.return_value = '/staging/1/ABC_123'
+            runfolder_service_mock = mock.create_autospec(RunfolderService)
+            runfolder_service_mock.find_runfolders_for_project.return_value = iter(self.runfolder_projects)
+
+            delivery_sources_repo_mock = mock.create_autospec(DatabaseBasedDeliverySourcesRepository)
+            delivery_sources_repo_mock.source_exists.return_value = False
+            delivery_sources_repo_mock.find_highest_batch_nbr.return_value = 1
+            delivery_sources_repo_mock.create_source.return_value = \
+                DeliverySource(project_name="ABC_123",
+                               source_name="ABC_123/batch2",
+                               path=self.general_project.path,
+                               batch=2)
+
+            self._compose_delivery_service(runfolder_service=runfolder_service_mock,
+                                           delivery_sources_repo=delivery_sources_repo_mock,
+                                           staging_service=staging_service_mock,
+                                           project_links_dir=tmpdirname)
+
+            projects_and_ids, _ = \
+                yield self.delivery_service.deliver_all_runfolders_for_project(project_name="ABC_123",
+                                                                         mode=DeliveryMode.FORCE,
+                                                                         incremental=True)
+
+            self.assertEqual(projects_and_ids["ABC_123"], 2)
+            staging_service_mock.get_incremental_staging_reference.assert_called_once_with("ABC_123")
+            self.assertEqual(staging_service_mock.create_new_stage_order.call_args[1]["link_dest"],
+                             '/staging/1/ABC_123')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,178 @@
+import os
+import signal
+import sys
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from delivery.models.execution import ResourceUsage
+from delivery.services.external_program_service import ExternalProgramService, ExecutionPool, OutputTail
+
+
+class TestExternalProgramService(AsyncTestCase):
+
+    @gen_test
+    def test_wait_for_execution(self):
+        execution = ExternalProgramService.run(
+            [sys.executable, '-c', 'import sys; print("foo"); print("bar", file=sys.stderr); sys.exit(3)'])
+        execution_result = yield ExternalProgramService.wait_for_execution(execution)
+
+        self.assertEqual(execution_result.stdout, "foo\n")
+        self.assertEqual(execution_result.stderr, "bar\n")
+        self.assertEqual(execution_result.status_code, 3)
+        self.assertGreater(execution_result.resource_usage.cpu_time, 0)
+        self.assertGreater(execution_result.resource_usage.max_rss, 0)
+
+    @gen_test(timeout=10)
+    def test_wait_for_execution_with_a_lot_of_output(self):
+        # More than fits in the pipe buffers, on both stdout and stderr
+        execution = ExternalProgramService.run(
+            [sys.executable, '-c',
+             'import sys; sys.stderr.write("e" * 1000000); print("\\n".join(map(str, range(100000))))'])
+        lines = []
+        execution_result = yield ExternalProgramService.wait_for_execution(
+            execution,
+            stdout_callback=ExternalProgramService.line_callback(lines.append),
+            output_tail_size=10)
+
+        self.assertEqual(lines, [str(i) for i in range(100000)])
+        self.assertEqual(execution_result.stdout, "\n99998\n99999\n"[-10:])
+        self.assertEqual(execution_result.stderr, "e" * 10)
+        self.assertEqual(execution_result.status_code, 0)
+
+    @gen_test
+    def test_wait_for_execution_with_a_character_split_between_chunks(self):
+        execution = ExternalProgramService.run(
+            [sys.executable, '-c',
+             'import sys, time; sys.stdout.buffer.write(b"\\xc3"); sys.stdout.flush(); time.sleep(0.2); '
+             'sys.stdout.buffer.write(b"\\xa9\\n")'])
+        chunks = []
+        execution_result = yield ExternalProgramService.wait_for_execution(execution, stdout_callback=chunks.append)
+
+        self.assertEqual("".join(chunks), "\u00e9\n")
+        self.assertNotIn("\ufffd", "".join(chunks))
+        self.assertEqual(execution_result.stdout, "\u00e9\n")
+
+    @gen_test
+    def test_wait_for_execution_of_killed_process(self):
+        execution = ExternalProgramService.run(['sleep', '10'])
+        os.kill(execution.pid, signal.SIGKILL)
+        execution_result = yield ExternalProgramService.wait_for_execution(execution)
+
+        self.assertEqual(execution_result.status_code, -signal.SIGKILL)
+
+    def test_exit_code(self):
+        pid = os.fork()
+        if pid == 0:
+            os._exit(5)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(ExternalProgramService._exit_code(status), 5)
+
+        pid = os.fork()
+        if pid == 0:
+            os.kill(os.getpid(), signal.SIGTERM)
+            os._exit(0)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(ExternalProgramService._exit_code(status), -signal.SIGTERM)
+
+    @gen_test
+    def test_run_in_pool(self):
+        external_program_service = ExternalProgramService(pools={'test': 1})
+        cmd = [sys.executable, '-c', 'pass']
+
+        first = yield external_program_service.run_in_pool(cmd, 'test')
+        waiting = [external_program_service.run_in_pool(cmd, 'test') for _ in range(2)]
+        yield gen.moment
+        self.assertFalse(any(future.done() for future in waiting))
+
+        yield ExternalProgramService.wait_for_execution(first)
+        second = yield waiting[0]
+        self.assertFalse(waiting[1].done())
+
+        yield ExternalProgramService.wait_for_execution(second)
+        third = yield waiting[1]
+        yield ExternalProgramService.wait_for_execution(third)
+
+        # Pools which are not configured do not limit the number of programs
+        executions = yield [external_program_service.run_in_pool(cmd, 'other') for _ in range(2)]
+        for execution in executions:
+            yield ExternalProgramService.wait_for_execution(execution)
+
+    @staticmethod
+    def _dispatch_order(pool, waiting):
+        holder = pool.acquire()
+        futures = {name: pool.acquire(size=size, group=group) for name, size, group in waiting}
+
+        order = []
+        while futures:
+            holder.result().release()
+            name = next(name for name, future in futures.items() if future.done())
+            order.append(name)
+            holder = futures.pop(name)
+        return order
+
+    def test_execution_pool_fifo(self):
+        pool = ExecutionPool(1)
+        order = self._dispatch_order(pool, [("a", 3, "x"), ("b", 1, "x"), ("c", 2, "y")])
+        self.assertEqual(order, ["a", "b", "c"])
+
+    def test_execution_pool_smallest_first(self):
+        pool = ExecutionPool(1, policy='smallest_first')
+        order = self._dispatch_order(pool, [("a", 3, "x"), ("b", 1, "x"), ("c", 2, "y"), ("d", 1, "y")])
+        self.assertEqual(order, ["b", "d", "c", "a"])
+
+    def test_execution_pool_fair_share(self):
+        pool = ExecutionPool(2, policy='fair_share')
+        first = pool.acquire(group="x")
+        second = pool.acquire(group="x")
+        waiting = [pool.acquire(group="x"), pool.acquire(group="y")]
+
+        # The group without anything running goes first, even though it arrived later
+        first.result().release()
+        self.assertEqual([future.done() for future in waiting], [False, True])
+
+        second.result().release()
+        self.assertEqual([future.done() for future in waiting], [True, True])
+        self.assertEqual(pool.running, {"x": 1, "y": 1})
+
+    def test_execution_pool_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            ExecutionPool(1, policy='random')
+
+    def test_total_resource_usage(self):
+        resource_usage = ResourceUsage.total([ResourceUsage(cpu_time=1.5, max_rss=100, block_input=1, block_output=2),
+                                              None,
+                                              ResourceUsage(cpu_time=2, max_rss=200, block_input=3, block_output=4)])
+        self.assertEqual(resource_usage.cpu_time, 3.5)
+        self.assertEqual(resource_usage.max_rss, 200)
+        self.assertEqual(resource_usage.block_input, 4)
+        self.assertEqual(resource_usage.block_output, 6)
+
+        self.assertIsNone(ResourceUsage.total([None]))
+
+    def test_line_callback(self):
+        lines = []
+        callback = ExternalProgramService.line_callback(lines.append)
+
+        callback("foo\nb")
+        callback("ar\r  10%\r  20%")
+        callback("\n")
+
+        self.assertEqual(lines, ["foo", "bar", "  10%", "  20%"])
+
+    def test_output_tail(self):
+        tail = OutputTail(max_size=5)
+        for chunk in [b"abc", b"defg", b"hi"]:
+            tail.append(chunk)
+        self.assertEqual(tail.getvalue(), "efghi")
+
+        tail = OutputTail(max_size=None)
+        for chunk in [b"abc", b"defg", b"hi"]:
+            tail.append(chunk)
+        self.assertEqual(tail.getvalue(), "abcdefghi")
+
+    def test_is_running(self):
+        self.assertTrue(ExternalProgramService.is_running(os.getpid()))
+
+        # pid_max can not be larger than 2^22 on Linux
+        self.assertFalse(ExternalProgramService.is_running(2 ** 22 + 1))
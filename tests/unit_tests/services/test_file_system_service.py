@@ -1,4 +1,5 @@
 
+import os
 import shutil
 import tempfile
 import unittest
@@ -30,7 +31,87 @@ class TestFileSystemService(unittest.TestCase):
         shutil.rmtree(self.rootdir)
 
     def test_list_files_recursively(self):
+        # The files are listed in the same order every time
         self.assertListEqual(
             sorted(self.files),
-            sorted(list(FileSystemService().list_files_recursively(self.rootdir)))
+            list(FileSystemService().list_files_recursively(self.rootdir))
         )
+
+    def test_entry_sizes(self):
+        with open(self.files[-1], "wb") as f:
+            f.write(b"0" * 10)
+        with open(self.files[0], "wb") as f:
+            f.write(b"0" * 5)
+
+        sizes = FileSystemService.entry_sizes(self.rootdir)
+
+        self.assertEqual(sizes[os.path.relpath(self.files[-1], self.rootdir)], 10)
+        self.assertEqual(sizes[os.path.relpath(self.dirs[1], self.rootdir)], 10)
+        self.assertEqual(sizes[os.path.relpath(self.dirs[0], self.rootdir)], 0)
+        self.assertEqual(sum(sizes[os.path.relpath(f, self.rootdir)] for f in self.files), 15)
+        self.assertEqual(list(sizes.keys()), sorted(sizes.keys()))
+
+    def test_entry_sizes_follows_links(self):
+        with open(self.files[-1], "wb") as f:
+            f.write(b"0" * 10)
+        os.symlink(self.dirs[1], os.path.join(self.dirs[0], "link_to_dir"))
+        os.symlink(self.rootdir, os.path.join(self.dirs[-1], "link_to_root"))
+
+        sizes = FileSystemService.entry_sizes(self.rootdir)
+
+        linked_file = os.path.join(os.path.relpath(self.dirs[0], self.rootdir), "link_to_dir",
+                                   os.path.relpath(self.files[-1], self.dirs[1]))
+        self.assertEqual(sizes[linked_file], 10)
+        self.assertEqual(sizes[os.path.relpath(self.dirs[0], self.rootdir)], 10)
+        self.assertEqual(sum(size for path, size in sizes.items() if os.path.dirname(path) == ""), 20)
+
+    def test_tree_size(self):
+        with open(self.files[-1], "wb") as f:
+            f.write(b"0" * 10)
+        with open(self.files[0], "wb") as f:
+            f.write(b"0" * 5)
+        # Linked files and directories are counted like rsync --copy-links would copy them, while
+        # links back up the tree are not followed
+        os.symlink(self.files[-1], os.path.join(self.dirs[0], "link_to_file"))
+        os.symlink(self.dirs[1], os.path.join(self.dirs[0], "link_to_dir"))
+        os.symlink(self.rootdir, os.path.join(self.dirs[-1], "link_to_root"))
+
+        self.assertEqual(FileSystemService.tree_size(self.rootdir), 35)
+        self.assertEqual(FileSystemService.tree_size(self.files[0]), 5)
+
+    def test_scan(self):
+        entries = list(FileSystemService.scan(self.rootdir))
+        self.assertListEqual(
+            sorted(self.dirs[:2] + self.files[:3]),
+            sorted(entry.path for entry in entries))
+        self.assertListEqual(
+            sorted(self.dirs[:2]),
+            sorted(entry.path for entry in entries if entry.is_dir))
+        self.assertTrue(all(entry.size is None for entry in entries))
+
+    def test_scan_recursively(self):
+        with open(self.files[-1], "wb") as f:
+            f.write(b"0" * 10)
+        # Links to directories are listed, but not followed
+        os.symlink(self.dirs[1], os.path.join(self.dirs[0], "link_to_dir"))
+
+        entries = {entry.path: entry for entry in FileSystemService.scan(self.rootdir, recursive=True, stat=True)}
+
+        self.assertListEqual(
+            sorted(self.dirs + self.files + [os.path.join(self.dirs[0], "link_to_dir")]),
+            sorted(entries.keys()))
+        self.assertEqual(entries[self.files[-1]].size, 10)
+        self.assertEqual(entries[self.files[-1]].mtime, os.stat(self.files[-1]).st_mtime_ns)
+        self.assertTrue(entries[os.path.join(self.dirs[0], "link_to_dir")].is_dir)
+
+    def test_scan_missing_directory(self):
+        with self.assertRaises(FileNotFoundError):
+            list(FileSystemService.scan(os.path.join(self.rootdir, "missing")))
+        self.assertListEqual(
+            [],
+            list(FileSystemService.list_files_recursively(os.path.join(self.rootdir, "missing"))))
+
+    def test_list_directories(self):
+        self.assertListEqual(
+            sorted(self.dirs[:2]),
+            sorted(FileSystemService.list_directories(self.rootdir)))
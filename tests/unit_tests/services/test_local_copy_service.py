@@ -0,0 +1,176 @@
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from delivery.exceptions import ChecksumMismatchException
+from delivery.services.file_system_service import FileSystemService
+from delivery.services.local_copy_service import LocalCopyService, CopyProgress
+from delivery.services.metadata_service import MetadataService
+
+
+class TestLocalCopyService(unittest.TestCase):
+
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp()
+        self.runfolder = os.path.join(self.rootdir, "runfolder")
+        os.makedirs(os.path.join(self.runfolder, "sample1"))
+        with open(os.path.join(self.runfolder, "sample1", "reads.fastq.gz"), "wb") as f:
+            f.write(b"0" * 100)
+        with open(os.path.join(self.runfolder, "report.html"), "wb") as f:
+            f.write(b"0" * 10)
+
+        # Mimic an organised project, i.e. a directory of symlinks
+        self.source = os.path.join(self.rootdir, "project")
+        os.makedirs(os.path.join(self.source, "runfolder"))
+        os.symlink(os.path.join(self.runfolder, "sample1"), os.path.join(self.source, "runfolder", "sample1"))
+        os.symlink(os.path.join(self.runfolder, "report.html"), os.path.join(self.source, "report.html"))
+
+        self.target = os.path.join(self.rootdir, "staging")
+        os.makedirs(self.target)
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def test_link_tree(self):
+        local_copy_service = LocalCopyService(use_reflinks=False)
+
+        size = local_copy_service.link_tree(self.source, self.target)
+
+        self.assertEqual(size, 110)
+        staged_file = os.path.join(self.target, "runfolder", "sample1", "reads.fastq.gz")
+        self.assertFalse(os.path.islink(staged_file))
+        self.assertTrue(os.path.samefile(staged_file, os.path.join(self.runfolder, "sample1", "reads.fastq.gz")))
+        self.assertTrue(os.path.samefile(os.path.join(self.target, "report.html"),
+                                         os.path.join(self.runfolder, "report.html")))
+
+    def test_link_tree_with_reflinks(self):
+        local_copy_service = LocalCopyService(use_reflinks=True)
+
+        size = local_copy_service.link_tree(self.source, self.target)
+
+        self.assertEqual(size, 110)
+        staged_file = os.path.join(self.target, "runfolder", "sample1", "reads.fastq.gz")
+        with open(staged_file, "rb") as f:
+            self.assertEqual(f.read(), b"0" * 100)
+        self.assertEqual(os.stat(staged_file).st_mtime_ns,
+                         os.stat(os.path.join(self.runfolder, "sample1", "reads.fastq.gz")).st_mtime_ns)
+
+    def test_link_tree_across_devices(self):
+        real_stat = FileSystemService.stat
+
+        def stat_on_other_device(path):
+            result = real_stat(path)
+            if path.endswith("report.html"):
+                return mock.MagicMock(st_dev=result.st_dev + 1, st_size=result.st_size)
+            return result
+
+        mock_file_system_service = mock.create_autospec(FileSystemService)
+        mock_file_system_service.stat.side_effect = stat_on_other_device
+        local_copy_service = LocalCopyService(file_system_service=mock_file_system_service)
+
+        self.assertIsNone(local_copy_service.link_tree(self.source, self.target))
+        self.assertEqual(os.listdir(self.target), [])
+
+    def test_copy_tree(self):
+        local_copy_service = LocalCopyService()
+        progress = CopyProgress()
+
+        size = local_copy_service.copy_tree(self.source, self.target, progress, max_workers=2)
+
+        self.assertEqual(size, 110)
+        self.assertEqual((progress.total_bytes, progress.bytes_transferred, progress.files_transferred),
+                         (110, 110, 2))
+        staged_file = os.path.join(self.target, "runfolder", "sample1", "reads.fastq.gz")
+        source_file = os.path.join(self.runfolder, "sample1", "reads.fastq.gz")
+        self.assertFalse(os.path.islink(staged_file))
+        self.assertFalse(os.path.samefile(staged_file, source_file))
+        with open(staged_file, "rb") as f:
+            self.assertEqual(f.read(), b"0" * 100)
+        self.assertEqual(os.stat(staged_file).st_mtime_ns, os.stat(source_file).st_mtime_ns)
+
+    def test_copy_tree_with_sendfile(self):
+        local_copy_service = LocalCopyService()
+
+        with mock.patch("delivery.services.local_copy_service.os.copy_file_range",
+                        side_effect=OSError(errno.EXDEV, "Invalid cross-device link")):
+            size = local_copy_service.copy_tree(self.source, self.target)
+
+        self.assertEqual(size, 110)
+        with open(os.path.join(self.target, "report.html"), "rb") as f:
+            self.assertEqual(f.read(), b"0" * 10)
+
+    def _stage_previous_batch(self):
+        previous = os.path.join(self.rootdir, "previous")
+        LocalCopyService().copy_tree(self.source, previous)
+        with open(os.path.join(self.runfolder, "report.html"), "wb") as f:
+            f.write(b"1" * 20)
+        return previous
+
+    def _assert_linked_from(self, previous):
+        self.assertTrue(os.path.samefile(os.path.join(self.target, "runfolder", "sample1", "reads.fastq.gz"),
+                                         os.path.join(previous, "runfolder", "sample1", "reads.fastq.gz")))
+        self.assertFalse(os.path.samefile(os.path.join(self.target, "report.html"),
+                                          os.path.join(previous, "report.html")))
+        with open(os.path.join(self.target, "report.html"), "rb") as f:
+            self.assertEqual(f.read(), b"1" * 20)
+
+    def test_link_tree_with_link_dest(self):
+        previous = self._stage_previous_batch()
+
+        size = LocalCopyService(use_reflinks=False).link_tree(self.source, self.target, link_dest=previous)
+
+        self.assertEqual(size, 120)
+        self._assert_linked_from(previous)
+
+    def test_copy_tree_with_link_dest(self):
+        previous = self._stage_previous_batch()
+        progress = CopyProgress()
+
+        size = LocalCopyService().copy_tree(self.source, self.target, progress=progress, link_dest=previous)
+
+        self.assertEqual(size, 120)
+        self.assertEqual(progress.bytes_transferred, 120)
+        self.assertEqual(progress.files_transferred, 2)
+        self._assert_linked_from(previous)
+
+    def test_copy_tree_verifying_checksums(self):
+        MetadataService.write_checksum_file(
+            os.path.join(self.runfolder, "checksums.md5"),
+            {"runfolder/sample1/reads.fastq.gz": MetadataService.hash_string("0" * 100)})
+        os.symlink(os.path.join(self.runfolder, "checksums.md5"),
+                   os.path.join(self.source, "runfolder", "checksums.md5"))
+        checksum_report = os.path.join(self.rootdir, "checksum_verification.txt")
+
+        size = LocalCopyService().copy_tree(self.source, self.target, checksum_report=checksum_report)
+
+        self.assertEqual(size, os.path.getsize(os.path.join(self.runfolder, "checksums.md5")) + 110)
+        with open(checksum_report) as f:
+            self.assertEqual(f.read().splitlines(), ["report.html: NOT VERIFIED",
+                                                     "runfolder/checksums.md5: NOT VERIFIED",
+                                                     "runfolder/sample1/reads.fastq.gz: OK"])
+
+    def test_copy_tree_with_checksum_mismatch(self):
+        MetadataService.write_checksum_file(
+            os.path.join(self.runfolder, "checksums.md5"),
+            {"runfolder/sample1/reads.fastq.gz": MetadataService.hash_string("1" * 100)})
+        os.symlink(os.path.join(self.runfolder, "checksums.md5"),
+                   os.path.join(self.source, "runfolder", "checksums.md5"))
+        checksum_report = os.path.join(self.rootdir, "checksum_verification.txt")
+
+        with self.assertRaises(ChecksumMismatchException):
+            LocalCopyService().copy_tree(self.source, self.target, checksum_report=checksum_report)
+
+        with open(checksum_report) as f:
+            self.assertIn("runfolder/sample1/reads.fastq.gz: FAILED", f.read().splitlines())
+
+    def test_copy_tree_does_not_write_checksum_report_into_target(self):
+        checksum_report = os.path.join(self.target, "checksum_verification.txt")
+
+        with self.assertRaises(ValueError):
+            LocalCopyService().copy_tree(self.source, self.target, checksum_report=checksum_report)
+
+        self.assertEqual(os.listdir(self.target), [])
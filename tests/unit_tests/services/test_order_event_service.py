@@ -0,0 +1,118 @@
+import unittest
+
+from mock import MagicMock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from delivery.models.db_models import SQLAlchemyBase, StagingOrder, StagingStatus, DeliveryOrder, \
+    DeliveryStatus
+from delivery.repositories.deliveries_repository import DatabaseBasedDeliveriesRepository
+from delivery.repositories.staging_repository import DatabaseBasedStagingRepository
+from delivery.services.order_event_service import OrderEventService
+
+
+class TestOrderEventService(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite:///:memory:', echo=False)
+        SQLAlchemyBase.metadata.create_all(engine)
+
+        self.session_factory = sessionmaker()
+        self.session_factory.configure(bind=engine)
+        self.session = self.session_factory()
+
+        self.order_event_service = OrderEventService(self.session_factory)
+
+    def _events(self, subscription):
+        events = []
+        while subscription.queue.qsize():
+            events.append(subscription.queue.get_nowait())
+        return events
+
+    def test_committed_changes_are_published(self):
+        subscription = self.order_event_service.subscribe()
+
+        staging_order = StagingOrder(source='/foo/ABC_123', status=StagingStatus.pending,
+                                     staging_target='/staging/1/ABC_123')
+        self.session.add(staging_order)
+        self.session.commit()
+
+        staging_order.status = StagingStatus.staging_in_progress
+        staging_order.bytes_transferred = 1024
+        self.session.flush()
+        self.assertEqual(self._events(subscription)[0]['status'], 'pending')
+
+        self.session.commit()
+        events = self._events(subscription)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['type'], 'staging_order')
+        self.assertEqual(events[0]['id'], staging_order.id)
+        self.assertEqual(events[0]['project'], 'ABC_123')
+        self.assertEqual(events[0]['status'], 'staging_in_progress')
+        self.assertEqual(events[0]['bytes_transferred'], 1024)
+
+    def test_rolled_back_changes_are_not_published(self):
+        subscription = self.order_event_service.subscribe()
+
+        self.session.add(DeliveryOrder(delivery_source='/staging/1/ABC_123', delivery_project='snpseq00001',
+                                       delivery_status=DeliveryStatus.pending))
+        self.session.flush()
+        self.session.rollback()
+
+        self.assertEqual(self._events(subscription), [])
+
+    def test_events_are_filtered(self):
+        by_project = self.order_event_service.subscribe(projects=['snpseq00002'])
+        by_id = self.order_event_service.subscribe(delivery_order_ids=['1'])
+
+        for project in ['snpseq00001', 'snpseq00002']:
+            self.session.add(DeliveryOrder(delivery_source='/staging/1/ABC_123', delivery_project=project,
+                                           delivery_status=DeliveryStatus.pending))
+        self.session.commit()
+
+        self.assertEqual([event['delivery_project'] for event in self._events(by_project)], ['snpseq00002'])
+        self.assertEqual([event['id'] for event in self._events(by_id)], [1])
+
+    def test_unsubscribed_get_no_events(self):
+        subscription = self.order_event_service.subscribe()
+        self.order_event_service.unsubscribe(subscription)
+
+        self.session.add(StagingOrder(source='/foo/ABC_123', status=StagingStatus.pending))
+        self.session.commit()
+
+        self.assertEqual(self._events(subscription), [])
+
+    def test_created_orders_are_published_once(self):
+        subscription = self.order_event_service.subscribe()
+        staging_repo = DatabaseBasedStagingRepository(self.session_factory, file_system_service=MagicMock())
+
+        staging_order = staging_repo.create_staging_order(source='/foo/ABC_123', status=StagingStatus.pending,
+                                                          staging_target_dir='/staging', project_name='ABC_123')
+
+        events = self._events(subscription)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['id'], staging_order.id)
+        self.assertEqual(events[0]['project'], 'ABC_123')
+        self.assertEqual(events[0]['status'], 'pending')
+
+    def test_claimed_orders_are_published(self):
+        staging_repo = DatabaseBasedStagingRepository(self.session_factory, file_system_service=MagicMock())
+        delivery_repo = DatabaseBasedDeliveriesRepository(self.session_factory)
+        staging_order = staging_repo.create_staging_order(source='/foo/ABC_123', status=StagingStatus.pending,
+                                                          staging_target_dir='/staging', project_name='ABC_123')
+        delivery_order = delivery_repo.create_delivery_order(
+            delivery_source='/staging/1/ABC_123', delivery_project='snpseq00001', ngi_project_name='ABC_123',
+            delivery_status=DeliveryStatus.pending, staging_order_id=staging_order.id)
+        subscription = self.order_event_service.subscribe()
+
+        self.assertTrue(staging_repo.claim_staging_order(staging_order, StagingStatus.staging_in_progress))
+        self.assertTrue(delivery_repo.claim_delivery_order(delivery_order, DeliveryStatus.delivery_failed))
+        # Nothing is published when an order has already been claimed by someone else
+        self.assertFalse(staging_repo.claim_staging_order(
+            StagingOrder(id=staging_order.id, status=StagingStatus.pending), StagingStatus.staging_in_progress))
+
+        events = self._events(subscription)
+        self.assertEqual([(event['type'], event['status']) for event in events],
+                         [('staging_order', 'staging_in_progress'), ('delivery_order', 'delivery_failed')])
+        self.assertEqual(events[0]['project'], 'ABC_123')
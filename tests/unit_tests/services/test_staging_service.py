@@ -3,17 +3,25 @@ import signal
 import random
 import os
 import tempfile
+import unittest
 
 from tornado.testing import AsyncTestCase
 from tornado.gen import coroutine
+from tornado.concurrent import Future
+from tornado import gen
 import tornado.testing
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
 
-from delivery.exceptions import InvalidStatusException, RunfolderNotFoundException, ProjectNotFoundException
-from delivery.services.staging_service import StagingService
+from delivery.exceptions import InvalidStatusException, RunfolderNotFoundException, ProjectNotFoundException, \
+    ChecksumMismatchException
+from delivery.repositories.staging_repository import DatabaseBasedStagingRepository
+from delivery.services.staging_service import StagingService, RsyncProgressParser
 from delivery.services.file_system_service import FileSystemService
+from delivery.services.local_copy_service import CopyProgress
 from delivery.services.external_program_service import ExternalProgramService
-from delivery.models.db_models import StagingOrder, StagingStatus
-from delivery.models.execution import Execution, ExecutionResult
+from delivery.models.db_models import SQLAlchemyBase, StagingOrder, StagingStatus
+from delivery.models.execution import Execution, ExecutionResult, ResourceUsage
 from delivery.models.project import GeneralProject
 from delivery.models.project import RunfolderProject
 from tests.test_utils import FAKE_RUNFOLDERS, assert_eventually_equals, MockIOLoop
@@ -64,6 +72,7 @@ class TestStagingService(AsyncTestCase):
             sent 207,758,378 bytes  received 35 bytes  138,505,608.67 bytes/sec
             total size is 207,707,566  speedup is 1.00
         """
+        self.stdout_mimicing_rsync = stdout_mimicing_rsync
 
         mock_process = mock.MagicMock()
         mock_execution = Execution(pid=random.randint(1, 1000), process_obj=mock_process)
@@ -74,10 +83,16 @@ class TestStagingService(AsyncTestCase):
         self.mock_file_system_service = mock.create_autospec(FileSystemService)
 
         @coroutine
-        def wait_as_coroutine(x):
+        def wait_as_coroutine(x, **kwargs):
             return ExecutionResult(stdout=stdout_mimicing_rsync, stderr="", status_code=0)
 
         self.mock_external_runner_service.wait_for_execution = wait_as_coroutine
+
+        @coroutine
+        def run_in_pool_as_coroutine(cmd, pool, **kwargs):
+            return self.mock_external_runner_service.run(cmd)
+
+        self.mock_external_runner_service.run_in_pool = run_in_pool_as_coroutine
         mock_staging_repo = mock.MagicMock()
         mock_staging_repo.get_staging_order_by_id.return_value = self.staging_order1
         mock_staging_repo.create_staging_order.return_value = self.staging_order1
@@ -111,12 +126,15 @@ class TestStagingService(AsyncTestCase):
 
         assert_eventually_equals(self, 1, _get_stating_status, StagingStatus.staging_successful)
         self.assertEqual(self.staging_order1.size, 207707566)
+        # The number of files staged, also when rsync did not report transferring them, e.g. since
+        # they were staged before the staging was resumed
+        self.assertEqual(self.staging_order1.files_transferred, 1)
 
     # - Set status to failed if rsyncing is not successful
     @tornado.testing.gen_test
     def test_unsuccessful_staging_order(self):
         @coroutine
-        def wait_as_coroutine(x):
+        def wait_as_coroutine(x, **kwargs):
             return ExecutionResult(stdout="", stderr="", status_code=1)
 
         self.mock_external_runner_service.wait_for_execution = wait_as_coroutine
@@ -190,3 +208,472 @@ class TestStagingService(AsyncTestCase):
         actual = self.staging_service.kill_process_of_staging_order(self.staging_order1.id)
         mock_os.kill.assert_not_called()
         self.assertFalse(actual)
+
+    # - Only stage as many orders at the same time as there are worker slots
+    @tornado.testing.gen_test
+    def test_stage_order_waits_for_free_slot(self):
+        staging_order2 = StagingOrder(id=2,
+                                      source='/test/that',
+                                      staging_target='/bar',
+                                      status=StagingStatus.pending)
+        orders = {1: self.staging_order1, 2: staging_order2}
+
+        mock_staging_repo = mock.MagicMock()
+        mock_staging_repo.get_staging_order_by_id.side_effect = lambda identifier, session: orders[identifier]
+
+        executions = []
+
+        def wait_for_execution(execution, **kwargs):
+            executions.append(Future())
+            return executions[-1]
+
+        self.mock_external_runner_service.wait_for_execution = wait_for_execution
+
+        staging_service = StagingService(staging_dir="/tmp",
+                                         project_links_directory="/tmp",
+                                         external_program_service=self.mock_external_runner_service,
+                                         staging_repo=mock_staging_repo,
+                                         runfolder_repo=self.mock_runfolder_repo,
+                                         session_factory=mock.MagicMock(),
+                                         project_dir_repo=self.mock_general_project_repo,
+                                         file_system_service=self.mock_file_system_service,
+                                         staging_conf={"max_concurrent_stagings": 1})
+
+        first = staging_service.stage_order(stage_order=self.staging_order1)
+        second = staging_service.stage_order(stage_order=staging_order2)
+
+        self.assertEqual(self.staging_order1.status, StagingStatus.staging_in_progress)
+        self.assertEqual(staging_order2.status, StagingStatus.pending)
+        self.assertEqual(len(executions), 1)
+
+        executions[0].set_result(ExecutionResult(stdout="", stderr="", status_code=1))
+        yield first
+        yield gen.moment
+
+        self.assertEqual(self.staging_order1.status, StagingStatus.staging_failed)
+        self.assertEqual(staging_order2.status, StagingStatus.staging_in_progress)
+
+        executions[1].set_result(ExecutionResult(stdout="", stderr="", status_code=1))
+        yield second
+        self.assertEqual(staging_order2.status, StagingStatus.staging_failed)
+
+    # - Split a large source into shards of roughly equal size
+    def test_plan_rsync_shards(self):
+        with tempfile.TemporaryDirectory() as source:
+            sample_sizes = {"sample1": 400, "sample2": 300, "sample3": 200, "sample4": 100}
+            for sample, size in sample_sizes.items():
+                sample_dir = os.path.join(source, "runfolder", sample)
+                os.makedirs(sample_dir)
+                with open(os.path.join(sample_dir, "reads.fastq.gz"), "wb") as f:
+                    f.write(b"0" * size)
+
+            shards = StagingService._plan_rsync_shards(source, 2, FileSystemService)
+
+            self.assertEqual(shards, [[os.path.join("runfolder", "sample1"), os.path.join("runfolder", "sample4")],
+                                      [os.path.join("runfolder", "sample2"), os.path.join("runfolder", "sample3")]])
+
+    # - Stage a staging order using several rsync processes
+    @tornado.testing.gen_test
+    def test_stage_order_in_shards(self):
+        self.staging_order1.rsync_shards = 2
+        self.mock_file_system_service.isdir.return_value = True
+
+        with mock.patch.object(StagingService, '_plan_rsync_shards', return_value=[['a'], ['b']]):
+            yield self.staging_service.stage_order(stage_order=self.staging_order1)
+
+        self.assertEqual(self.mock_external_runner_service.run.call_count, 2)
+        for call, shard in zip(self.mock_external_runner_service.run.call_args_list, ['a', 'b']):
+            cmd = call[0][0]
+            files_from = [arg for arg in cmd if arg.startswith('--files-from=')]
+            self.assertEqual(len(files_from), 1)
+            self.assertEqual(cmd[-2:], ['/test/this/', '/foo'])
+
+        self.assertEqual(self.staging_order1.status, StagingStatus.staging_successful)
+        self.assertEqual(self.staging_order1.size, 2 * 207707566)
+
+    # - Terminate the other shards when one of them fails
+    @tornado.testing.gen_test
+    def test_failed_shard_terminates_the_others(self):
+        self.staging_order1.rsync_shards = 2
+        self.mock_file_system_service.isdir.return_value = True
+
+        executions = [Execution(pid=1001, process_obj=mock.MagicMock()),
+                      Execution(pid=1002, process_obj=mock.MagicMock())]
+        self.mock_external_runner_service.run.side_effect = executions
+        results = {1001: Future(), 1002: Future()}
+        self.mock_external_runner_service.wait_for_execution = lambda execution, **kwargs: results[execution.pid]
+
+        with mock.patch.object(StagingService, '_plan_rsync_shards', return_value=[['a'], ['b']]), \
+                mock.patch('delivery.services.staging_service.os.kill') as mock_kill:
+            staging = self.staging_service.stage_order(stage_order=self.staging_order1)
+            results[1001].set_result(ExecutionResult(stdout="", stderr="", status_code=1))
+            yield gen.sleep(0.01)
+            mock_kill.assert_called_once_with(1002, signal.SIGTERM)
+            results[1002].set_result(ExecutionResult(stdout="", stderr="", status_code=-15))
+            yield staging
+
+        self.assertEqual(self.staging_order1.status, StagingStatus.staging_failed)
+
+    # - Store the resources used by the rsync processes on the staging order
+    @tornado.testing.gen_test
+    def test_stage_order_stores_resource_usage(self):
+        self.staging_order1.rsync_shards = 2
+        self.mock_file_system_service.isdir.return_value = True
+
+        @coroutine
+        def wait_with_resource_usage(execution, **kwargs):
+            return ExecutionResult(stdout=self.stdout_mimicing_rsync, stderr="", status_code=0,
+                                   resource_usage=ResourceUsage(cpu_time=1.5, max_rss=1024, block_input=10,
+                                                                block_output=20))
+
+        self.mock_external_runner_service.wait_for_execution = wait_with_resource_usage
+
+        with mock.patch.object(StagingService, '_plan_rsync_shards', return_value=[['a'], ['b']]):
+            yield self.staging_service.stage_order(stage_order=self.staging_order1)
+
+        self.assertEqual(self.staging_order1.status, StagingStatus.staging_successful)
+        self.assertEqual(self.staging_order1.cpu_time, 3)
+        self.assertEqual(self.staging_order1.max_rss, 1024)
+        self.assertEqual(self.staging_order1.block_input, 20)
+        self.assertEqual(self.staging_order1.block_output, 40)
+
+    # - Stage a staging order by linking when using the link engine
+    @tornado.testing.gen_test
+    def test_stage_order_by_linking(self):
+        self.staging_service.staging_conf = {"staging_engine": "link"}
+        self.staging_service.local_copy_service = mock.MagicMock()
+        self.staging_service.local_copy_service.link_tree.return_value = 1234
+        self.mock_file_system_service.isdir.return_value = True
+        self.staging_order1.link_dest = '/staging/0/this'
+
+        yield self.staging_service.stage_order(stage_order=self.staging_order1)
+
+        self.staging_service.local_copy_service.link_tree.assert_called_once_with(
+            '/test/this', '/foo', '/staging/0/this')
+        self.mock_external_runner_service.run.assert_not_called()
+        self.assertEqual(self.staging_order1.status, StagingStatus.staging_successful)
+        self.assertEqual(self.staging_order1.size, 1234)
+
+    # - Fall back to rsync when the source cannot be linked into place
+    @tornado.testing.gen_test
+    def test_stage_order_by_linking_falls_back_to_rsync(self):
+        self.staging_service.staging_conf = {"staging_engine": "link"}
+        self.staging_service.local_copy_service = mock.MagicMock()
+        self.staging_service.local_copy_service.link_tree.return_value = None
+        self.mock_file_system_service.isdir.return_value = True
+
+        yield self.staging_service.stage_order(stage_order=self.staging_order1)
+
+        self.mock_external_runner_service.run.assert_called_once()
+        self.assertEqual(self.staging_order1.status, StagingStatus.staging_successful)
+        self.assertEqual(self.staging_order1.size, 207707566)
+
+    # - Follow the progress of rsync while it is running
+    @tornado.testing.gen_test
+    def test_stage_order_reports_progress(self):
+        self.staging_service.staging_conf = {"progress_update_interval": 0}
+        progress = []
+
+        @coroutine
+        def wait_with_progress(execution, stdout_callback=None):
+            stdout_callback("\r    103,853,783  50%   10.00MB/s    0:00:09 (xfr#1, to-c")
+            stdout_callback("hk=1/2)\r")
+            progress.append((self.staging_order1.bytes_transferred,
+                             self.staging_order1.files_transferred,
+                             self.staging_order1.throughput,
+                             self.staging_order1.eta))
+            stdout_callback("    103,853,783  50%    5.00MB/s    0:00:19  \n")
+            return ExecutionResult(stdout="", stderr="", status_code=1)
+
+        self.mock_external_runner_service.wait_for_execution = wait_with_progress
+
+        yield self.staging_service.stage_order(stage_order=self.staging_order1)
+
+        self.assertEqual(progress, [(103853783, 1, 10 * 1024 ** 2, 9)])
+        self.assertEqual(self.staging_order1.throughput, 5 * 1024 ** 2)
+        self.assertEqual(self.staging_order1.eta, 19)
+
+    # - Use a previously staged directory as reference for rsync
+    @tornado.testing.gen_test
+    def test_stage_order_with_link_dest(self):
+        self.staging_order1.link_dest = '/staging/1/ABC_123'
+
+        yield self.staging_service.stage_order(stage_order=self.staging_order1)
+
+        cmd = self.mock_external_runner_service.run.call_args[0][0]
+        self.assertIn('--link-dest=/staging/1/ABC_123', cmd)
+        self.assertEqual(self.staging_order1.status, StagingStatus.staging_successful)
+
+    # - Find the staged directory of the previous batch of a project, if it still exists
+    def test_get_incremental_staging_reference(self):
+        self.staging_service.staging_repo.get_last_successful_batch_staging_order.return_value = None
+        self.assertIsNone(self.staging_service.get_incremental_staging_reference('ABC_123'))
+
+        self.staging_service.staging_repo.get_last_successful_batch_staging_order.return_value = \
+            StagingOrder(id=1, source='/links/ABC_123/1', staging_target='/staging/1/ABC_123',
+                         status=StagingStatus.staging_successful)
+        self.mock_file_system_service.isdir.return_value = False
+        self.assertIsNone(self.staging_service.get_incremental_staging_reference('ABC_123'))
+
+        self.mock_file_system_service.isdir.return_value = True
+        self.assertEqual(self.staging_service.get_incremental_staging_reference('ABC_123'), '/staging/1/ABC_123')
+
+    # - Reject a staging order which will never fit in the staging area
+    @tornado.testing.gen_test
+    def test_stage_order_rejected_when_too_large(self):
+        self.staging_service.staging_conf = {"check_staging_space": True}
+        self.mock_file_system_service.tree_size.return_value = 2000
+        self.mock_file_system_service.disk_usage.return_value = mock.MagicMock(total=1000, free=1000)
+
+        yield self.staging_service.stage_order(stage_order=self.staging_order1)
+
+        self.assertEqual(self.staging_order1.status, StagingStatus.staging_rejected)
+        self.mock_external_runner_service.run.assert_not_called()
+
+    # - Hold back a staging order until there is space for it in the staging area
+    @tornado.testing.gen_test
+    def test_stage_order_waits_for_staging_space(self):
+        self.staging_service.staging_conf = {"check_staging_space": True, "staging_space_poll_interval": 10}
+        self.mock_file_system_service.tree_size.return_value = 600
+        self.mock_file_system_service.disk_usage.return_value = mock.MagicMock(total=1000, free=1000)
+
+        staging_order2 = StagingOrder(id=2, source='/test/that', staging_target='/bar', status=StagingStatus.pending)
+        orders = {1: self.staging_order1, 2: staging_order2}
+        self.staging_service.staging_repo.get_staging_order_by_id.side_effect = \
+            lambda identifier, session: orders[identifier]
+
+        executions = []
+
+        def wait_for_execution(execution, **kwargs):
+            executions.append(Future())
+            return executions[-1]
+
+        self.mock_external_runner_service.wait_for_execution = wait_for_execution
+
+        first = self.staging_service.stage_order(stage_order=self.staging_order1)
+        yield gen.sleep(0.01)
+        second = self.staging_service.stage_order(stage_order=staging_order2)
+        yield gen.sleep(0.01)
+
+        # Half of the first order has been written, but the rest is still reserved
+        self.staging_order1.bytes_transferred = 300
+        self.mock_file_system_service.disk_usage.return_value = mock.MagicMock(total=1000, free=700)
+        self.assertEqual(self.staging_service._reserved_staging_space(), 300)
+        self.assertEqual(staging_order2.status, StagingStatus.pending)
+        self.assertEqual(len(executions), 1)
+
+        self.mock_file_system_service.disk_usage.return_value = mock.MagicMock(total=1000, free=400)
+        executions[0].set_result(ExecutionResult(stdout="", stderr="", status_code=1))
+        yield first
+        yield gen.sleep(0.01)
+        self.assertEqual(staging_order2.status, StagingStatus.pending)
+
+        # The first order has been delivered and removed from the staging area
+        self.mock_file_system_service.disk_usage.return_value = mock.MagicMock(total=1000, free=1000)
+        self.staging_service._staging_space_released.notify_all()
+        yield gen.sleep(0.01)
+        self.assertEqual(staging_order2.status, StagingStatus.staging_in_progress)
+        executions[1].set_result(ExecutionResult(stdout="", stderr="", status_code=1))
+        yield second
+        self.assertEqual(self.staging_service._staging_space_reservations, {})
+
+    # - Only reserve space in the staging area for an order once it has got a worker slot
+    @tornado.testing.gen_test
+    def test_stage_order_reserves_space_after_getting_a_slot(self):
+        self.mock_file_system_service.tree_size.return_value = 600
+        self.mock_file_system_service.disk_usage.return_value = mock.MagicMock(total=1000, free=1000)
+
+        staging_order2 = StagingOrder(id=2, source='/test/that', staging_target='/bar', status=StagingStatus.pending)
+        orders = {1: self.staging_order1, 2: staging_order2}
+        self.staging_service.staging_repo.get_staging_order_by_id.side_effect = \
+            lambda identifier, session: orders[identifier]
+
+        executions = []
+
+        def wait_for_execution(execution, **kwargs):
+            executions.append(Future())
+            return executions[-1]
+
+        self.mock_external_runner_service.wait_for_execution = wait_for_execution
+
+        staging_service = StagingService(staging_dir="/tmp",
+                                         project_links_directory="/tmp",
+                                         external_program_service=self.mock_external_runner_service,
+                                         staging_repo=self.staging_service.staging_repo,
+                                         runfolder_repo=self.mock_runfolder_repo,
+                                         session_factory=mock.MagicMock(),
+                                         project_dir_repo=self.mock_general_project_repo,
+                                         file_system_service=self.mock_file_system_service,
+                                         staging_conf={"max_concurrent_stagings": 1, "check_staging_space": True})
+
+        first = staging_service.stage_order(stage_order=self.staging_order1)
+        second = staging_service.stage_order(stage_order=staging_order2)
+        yield gen.sleep(0.01)
+
+        self.assertEqual(list(staging_service._staging_space_reservations.keys()), [1])
+        self.mock_file_system_service.tree_size.assert_called_once_with('/test/this')
+
+        executions[0].set_result(ExecutionResult(stdout="", stderr="", status_code=1))
+        yield first
+        yield gen.sleep(0.01)
+        self.assertEqual(list(staging_service._staging_space_reservations.keys()), [2])
+
+        executions[1].set_result(ExecutionResult(stdout="", stderr="", status_code=1))
+        yield second
+        self.assertEqual(staging_service._staging_space_reservations, {})
+
+    # - Stage a staging order without rsync when using the copy engine
+    @tornado.testing.gen_test
+    def test_stage_order_by_copying(self):
+        self.staging_service.staging_conf = {"staging_engine": "copy", "copy_workers": 4}
+        self.staging_service.local_copy_service = mock.MagicMock()
+        self.staging_service.local_copy_service.copy_tree.return_value = 1234
+        self.mock_file_system_service.isdir.return_value = True
+        self.staging_order1.link_dest = '/staging/0/this'
+
+        yield self.staging_service.stage_order(stage_order=self.staging_order1)
+
+        args = self.staging_service.local_copy_service.copy_tree.call_args[0]
+        self.assertEqual(args[:2], ('/test/this', '/foo'))
+        self.assertIsInstance(args[2], CopyProgress)
+        self.assertEqual(args[3], 4)
+        self.assertIsNone(args[4])
+        self.assertEqual(args[5], '/staging/0/this')
+        self.mock_external_runner_service.run.assert_not_called()
+        self.assertEqual(self.staging_order1.status, StagingStatus.staging_successful)
+        self.assertEqual(self.staging_order1.size, 1234)
+
+    # - Verify checksums while copying if requested
+    @tornado.testing.gen_test
+    def test_stage_order_by_copying_verifies_checksums(self):
+        self.staging_order1.staging_target = '/staging/1/ABC_123'
+        self.staging_service.staging_conf = {"staging_engine": "copy", "verify_checksums": True}
+        self.staging_service.local_copy_service = mock.MagicMock()
+        self.staging_service.local_copy_service.copy_tree.side_effect = \
+            ChecksumMismatchException("1 files did not match their checksums")
+        self.mock_file_system_service.isdir.return_value = True
+
+        yield self.staging_service.stage_order(stage_order=self.staging_order1)
+
+        args = self.staging_service.local_copy_service.copy_tree.call_args[0]
+        self.assertEqual(args[4], '/staging/1/checksum_verification.txt')
+        self.assertEqual(self.staging_order1.status, StagingStatus.staging_failed)
+
+    # - Set status to failed if copying is not successful
+    @tornado.testing.gen_test
+    def test_unsuccessful_stage_order_by_copying(self):
+        self.staging_service.staging_conf = {"staging_engine": "copy"}
+        self.staging_service.local_copy_service = mock.MagicMock()
+        self.staging_service.local_copy_service.copy_tree.side_effect = OSError("No space left on device")
+        self.mock_file_system_service.isdir.return_value = True
+
+        yield self.staging_service.stage_order(stage_order=self.staging_order1)
+
+        self.assertEqual(self.staging_order1.status, StagingStatus.staging_failed)
+
+    # - Requeue staging orders whose process is no longer running
+    @tornado.testing.gen_test
+    def test_recover_orphaned_stage_orders(self):
+        running = StagingOrder(id=2, source='/test/that', staging_target='/bar',
+                               status=StagingStatus.staging_in_progress, pid=123)
+        orphaned = StagingOrder(id=3, source='/test/those', staging_target='/baz',
+                                status=StagingStatus.staging_in_progress, pid=456)
+        claimed_by_someone_else = StagingOrder(id=4, source='/test/these', staging_target='/qux',
+                                               status=StagingStatus.staging_in_progress, pid=789)
+        without_pid = StagingOrder(id=5, source='/test/thus', staging_target='/quux',
+                                   status=StagingStatus.staging_in_progress)
+        staging_repo = self.staging_service.staging_repo
+        staging_repo.get_staging_orders_by_status.return_value = [running, orphaned, claimed_by_someone_else,
+                                                                  without_pid]
+        staging_repo.claim_staging_order.side_effect = \
+            lambda stage_order, status, **kwargs: stage_order is not claimed_by_someone_else
+        self.mock_external_runner_service.is_running.side_effect = lambda pid: pid == 123
+
+        with mock.patch.object(self.staging_service, 'stage_order') as mock_stage_order:
+            self.staging_service.recover_orphaned_stage_orders()
+            yield gen.moment
+
+        staging_repo.get_staging_orders_by_status.assert_called_once_with(StagingStatus.staging_in_progress)
+        self.assertEqual(staging_repo.claim_staging_order.call_args_list,
+                         [mock.call(orphaned, StagingStatus.pending),
+                          mock.call(claimed_by_someone_else, StagingStatus.pending)])
+        mock_stage_order.assert_called_once_with(orphaned)
+
+    # - Requeue an orphaned staging order only once, when several services recover it at the same time
+    @tornado.testing.gen_test
+    def test_recover_orphaned_stage_orders_race(self):
+        engine = create_engine('sqlite:///:memory:', echo=False)
+        SQLAlchemyBase.metadata.create_all(engine)
+        session_factory = sessionmaker()
+        session_factory.configure(bind=engine)
+
+        session = session_factory()
+        orphaned = StagingOrder(source='/test/those', staging_target='/baz',
+                                status=StagingStatus.staging_in_progress, pid=456)
+        session.add(orphaned)
+        session.commit()
+
+        staging_services = [
+            StagingService(staging_dir="/tmp",
+                           project_links_directory="/tmp",
+                           external_program_service=self.mock_external_runner_service,
+                           staging_repo=DatabaseBasedStagingRepository(session_factory),
+                           runfolder_repo=self.mock_runfolder_repo,
+                           session_factory=session_factory,
+                           project_dir_repo=self.mock_general_project_repo,
+                           file_system_service=self.mock_file_system_service)
+            for _ in range(2)]
+        self.mock_external_runner_service.is_running.side_effect = lambda pid: pid == os.getpid()
+
+        # Both services find the order before either of them has claimed it
+        orders_found = [staging_service.staging_repo.get_staging_orders_by_status(
+            StagingStatus.staging_in_progress) for staging_service in staging_services]
+        for staging_service, found in zip(staging_services, orders_found):
+            staging_service.staging_repo.get_staging_orders_by_status = mock.MagicMock(return_value=found)
+
+        with mock.patch.object(StagingService, 'stage_order') as mock_stage_order:
+            for staging_service in staging_services:
+                staging_service.recover_orphaned_stage_orders()
+            yield gen.moment
+
+        self.assertEqual(mock_stage_order.call_count, 1)
+        session.expire_all()
+        self.assertEqual(orphaned.status, StagingStatus.pending)
+        self.assertEqual(orphaned.pid, os.getpid())
+
+        # The order is now owned by a running process, and is left alone
+        for staging_service in staging_services:
+            staging_service.staging_repo.get_staging_orders_by_status = mock.MagicMock(
+                return_value=[orphaned])
+        orphaned.status = StagingStatus.staging_in_progress
+        session.commit()
+        with mock.patch.object(StagingService, 'stage_order') as mock_stage_order:
+            for staging_service in staging_services:
+                staging_service.recover_orphaned_stage_orders()
+            yield gen.moment
+        mock_stage_order.assert_not_called()
+
+    # - Not stage an order which has been claimed by someone else
+    @tornado.testing.gen_test
+    def test_stage_order_claimed_by_someone_else(self):
+        self.staging_service.staging_repo.claim_staging_order.return_value = False
+
+        yield self.staging_service.stage_order(stage_order=self.staging_order1)
+
+        self.mock_external_runner_service.run.assert_not_called()
+        self.assertEqual(self.staging_order1.status, StagingStatus.pending)
+
+
+class TestRsyncProgressParser(unittest.TestCase):
+
+    def test_feed(self):
+        parser = RsyncProgressParser()
+        parser.feed("sending incremental file list\n\r              0   0%    0.00kB/s    0:00:00 (xfr#0, to-chk=3/4)")
+        self.assertEqual((parser.bytes_transferred, parser.throughput, parser.eta), (0, 0.0, None))
+
+        parser.feed("\r      2,048  25%    1.00kB/s    0:00:06  \r      8,192 100%    2.00kB/s    0:00:04 (xfr#3, ")
+        self.assertEqual((parser.bytes_transferred, parser.throughput, parser.eta), (2048, 1024.0, 6))
+
+        parser.feed("to-chk=0/4)\n\nNumber of files: 4 (reg: 3, dir: 1)\n")
+        self.assertEqual((parser.bytes_transferred, parser.files_transferred, parser.throughput, parser.eta),
+                         (8192, 3, 2048.0, 0))